@@ -1,15 +1,79 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for, stream_with_context
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
-from datetime import datetime, timedelta
+from datetime import datetime
+from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
+import hmac
+import io
+import os
+import threading
+import time
+import uuid
 import bcrypt
+import click
+
+import carts
+import catalog
+import catalog_io
+import inventory
+import metrics
+import mongo
+import order_history
+import order_pipeline
+import passwords
+import query_plans
+import recommendations
+import reports
+import stats
+import stock_levels
+from cache import ReferenceCache, backend_from_url
+from indexes import ensure_indexes
+from pricing import DealBook, parse_discount
+from ratelimit import TokenBucket
+from search_index import SearchIndex
 
 app = Flask(__name__)
 app.secret_key = "my_super_secret_key_1234567890"
 
-# Database Connection
-client = MongoClient("mongodb://localhost:27017/")
-db = client["pharmacy_db"]
+# ----------------- REVERSE PROXY -----------------
+# Behind a proxy remote_addr is the proxy's address, and per-IP limits would
+# lump every client together. Trust PHARMACARE_PROXY_HOPS X-Forwarded-For
+# hops; App Service (which sets WEBSITE_SITE_NAME) fronts the app with one.
+# Leave it at 0 when clients connect directly, or they could spoof the header.
+PROXY_HOPS = int(os.environ.get("PHARMACARE_PROXY_HOPS") or (1 if os.environ.get("WEBSITE_SITE_NAME") else 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+# ----------------- INSTRUMENTATION -----------------
+# Per-route latency and Mongo command counts, served at /admin/metrics.
+# PHARMACARE_SLOW_REQUEST_MS logs slower requests with their queries;
+# PHARMACARE_METRICS_TOKEN lets a scraper in with a bearer token.
+instrumentation = metrics.Instrumentation(
+    slow_ms=float(os.environ["PHARMACARE_SLOW_REQUEST_MS"]) if os.environ.get("PHARMACARE_SLOW_REQUEST_MS") else None,
+)
+instrumentation.install(app)
+METRICS_TOKEN = os.environ.get("PHARMACARE_METRICS_TOKEN")
+
+# ----------------- DATABASE -----------------
+# Connection settings come from PHARMACARE_MONGO_* (see mongo.py). Nothing
+# connects at import: the client opens on first use in each process, i.e.
+# after gunicorn forks its workers, and ensures the indexes then, unless
+# PHARMACARE_ENSURE_INDEXES=0 because the deploy runs `flask ensure-indexes`.
+mongo_settings = mongo.Settings.from_env()
+mongo_connection = mongo.Connection(
+    mongo_settings,
+    event_listeners=[instrumentation.listener],
+    on_connect=ensure_indexes if os.environ.get("PHARMACARE_ENSURE_INDEXES") != "0" else None,
+)
+client = mongo.LazyClient(mongo_connection)
+db = mongo.LazyDatabase(mongo_connection)
+# Read-only catalog routes read through this handle, which follows
+# PHARMACARE_MONGO_READ_PREFERENCE; carts and checkout stay on the primary
+read_db = mongo.LazyDatabase(mongo_connection, read_only=True)
+medicine_reads = read_db["medicines"]
 users = db["users"]
 admins = db["admins"]
 medicines = db["medicines"]
@@ -20,61 +84,319 @@ deals = db["deals"]
 messages = db["messages"]
 brands = db["brands"]
 
-# ----------------- CREATE DEFAULT ADMIN -----------------
-if not admins.find_one({"email": "admin@example.com"}):
-    password = bcrypt.hashpw("admin123".encode("utf-8"), bcrypt.gensalt())
-    admins.insert_one({
-        "owner_name": "Admin",
-        "email": "admin@example.com",
-        "password": password
-    })
+# ----------------- SEARCH INDEX -----------------
+SEARCH_REBUILD_SECONDS = 300
+SEARCH_FIELDS = {"name": 1, "category": 1, "description": 1, "sold": 1, "price": 1, "image": 1}
+
+def load_search_docs():
+    return medicine_reads.find({}, SEARCH_FIELDS)
+
+# Built by the first search in each process
+search_index = SearchIndex()
+
+# ----------------- RECOMMENDATIONS -----------------
+# Co-purchase neighbours from order history (see recommendations.py), held
+# in memory per process. The first request loads the snapshot `flask
+# build-recommendations` writes to PHARMACARE_RECOMMENDATIONS_PATH (or builds
+# from the orders when there is none) in the background; later ones fold in
+# newly completed orders and pick up newer snapshots.
+RECOMMENDATIONS_PATH = os.environ.get("PHARMACARE_RECOMMENDATIONS_PATH")
+RECOMMENDATIONS_REFRESH_SECONDS = 30
+RECOMMENDATIONS_MAX_AGE = 300
+recommender = recommendations.CoPurchaseIndex()
+
+# ----------------- SALES REPORTS -----------------
+# /admin/reports runs on a columnar snapshot of completed orders (see
+# reports.py) that `flask snapshot-reports` writes under
+# PHARMACARE_REPORTS_DIR, so reporting never queries the live orders.
+REPORTS_DIR = os.environ.get("PHARMACARE_REPORTS_DIR") or os.path.join(app.instance_path, "reports")
+sales_reports = reports.Reports(REPORTS_DIR)
+
+# ----------------- REFERENCE DATA CACHE -----------------
+# Carousel, deals and brands only change through the admin routes, which
+# invalidate them. Catalog lists also change on purchase (stock, sold), so
+# they get a short TTL on top of invalidation.
+reference_cache = ReferenceCache(
+    backend_from_url(os.environ.get("PHARMACARE_CACHE_URL")),
+    default_ttl=3600,
+    ttls={"medicines": 60, "top_medicines": 60, "categories": 60},
+)
+
+def _with_str_ids(cursor):
+    docs = list(cursor)
+    for doc in docs:
+        doc['_id'] = str(doc['_id'])
+    return docs
+
+def cached_medicines():
+    return reference_cache.get("medicines", lambda: catalog.rows(medicine_reads.find({}, catalog.LIST_FIELDS)))
+
+def cached_top_medicines():
+    return reference_cache.get("top_medicines",
+                               lambda: catalog.rows(medicine_reads.find({}, catalog.LIST_FIELDS).sort("sold", -1).limit(8)))
+
+def cached_carousel():
+    return reference_cache.get("carousel", lambda: _with_str_ids(carousel.find()))
+
+def cached_deals():
+    return reference_cache.get("deals", lambda: _with_str_ids(deals.find()))
+
+def cached_brands():
+    return reference_cache.get("brands", lambda: _with_str_ids(brands.find()))
+
+def cached_deal_book():
+    return reference_cache.get("deal_book", lambda: DealBook(cached_deals()))
+
+def cached_categories():
+    return reference_cache.get("categories", lambda: sorted(medicine_reads.distinct("category")))
+
+def cached_stock_thresholds():
+    return reference_cache.get("stock_thresholds", lambda: stock_levels.load_thresholds(db))
+
+def stock_changed(med_ids):
+    # Keeps each medicine's stock status and the dashboard counts current
+    stock_levels.refresh(db, med_ids, cached_stock_thresholds())
+
+# ----------------- CATALOG FRAGMENTS -----------------
+# The catalog blocks look the same to every visitor, so they are rendered once
+# and cached under the versions of the reference data they show. The admin
+# routes' invalidate() calls re-render them; pages only render the
+# user-specific parts (header, cart, wishlist state) around them.
+FRAGMENTS = {
+    # name: (template, reference data it is rendered from)
+    "landing_offers": ("fragments/landing_offers.html", ("medicines", "deals")),
+    "landing_top_sellers": ("fragments/landing_top_sellers.html", ("top_medicines",)),
+    "landing_brands": ("fragments/landing_brands.html", ("brands",)),
+    "home_offers": ("fragments/home_offers.html", ("medicines", "deals")),
+    "home_top_sellers": ("fragments/home_top_sellers.html", ("top_medicines",)),
+    "home_brands": ("fragments/home_brands.html", ("brands",)),
+    "carousel": ("fragments/carousel.html", ("carousel",)),
+    "medicine_grid": ("fragments/medicine_grid.html", ("medicines", "deals")),
+}
+
+def fragment(name, context):
+    """Cached HTML for ``name``; ``context()`` builds the template context on a miss."""
+    template, depends = FRAGMENTS[name]
+    return Markup(reference_cache.fragment(name, depends, lambda: render_template(template, **context())))
+
+def offers_context():
+    deal_book = cached_deal_book()
+    return {"medicines": [med for med in cached_medicines() if deal_book.has_deal(med['category'])],
+            "deals": cached_deals()}
+
+def medicine_grid_context():
+    first_page, next_cursor = catalog.fetch_page(medicine_reads, {})
+    return {"medicines": first_page, "next_cursor": next_cursor, "deals": cached_deals()}
+
+# ----------------- HTTP CACHING -----------------
+# Public pages and API reads carry a strong ETag over the body, so browsers and
+# a reverse proxy can revalidate with If-None-Match and get a bodiless 304.
+LANDING_MAX_AGE = 60
+MEDICINE_MAX_AGE = 60
+# Checkout's reservation tags are internal; keep them out of the public detail
+MEDICINE_DETAIL_FIELDS = {inventory.RESERVATIONS: 0}
+
+def cacheable(response, max_age):
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+# ----------------- AUTH -----------------
+# bcrypt runs in a bounded process pool; when it is full, login and register
+# answer 503 at once rather than tying up the worker. Raising the work factor
+# upgrades stored hashes as users log in.
+password_hasher = passwords.PasswordHasher(
+    rounds=int(os.environ.get("PHARMACARE_BCRYPT_ROUNDS", passwords.DEFAULT_ROUNDS)),
+    workers=int(os.environ.get("PHARMACARE_HASH_WORKERS", 2)),
+    max_pending=int(os.environ.get("PHARMACARE_HASH_QUEUE", 32)),
+)
+# Per-IP limits cover login and register, per-email limits cover login only.
+auth_ip_limit = TokenBucket(
+    rate=float(os.environ.get("PHARMACARE_AUTH_IP_RATE", 1.0)),
+    capacity=int(os.environ.get("PHARMACARE_AUTH_IP_BURST", 20)),
+)
+login_email_limit = TokenBucket(rate=0.1, capacity=5)
+
+def _throttled(retry_after):
+    response = jsonify({"message": "Too many attempts, please wait and try again"})
+    response.headers["Retry-After"] = str(max(1, round(retry_after)))
+    return response, 429
+
+def _hashing_busy():
+    response = jsonify({"message": "Server busy, please try again"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+def find_account(email):
+    """Return ``(collection, account)`` for ``email``; admins take precedence."""
+    found = next(admins.aggregate([
+        {"$match": {"email": email}},
+        {"$set": {"_kind": "admin"}},
+        {"$unionWith": {"coll": users.name, "pipeline": [
+            {"$match": {"email": email}},
+            {"$set": {"_kind": "user"}},
+        ]}},
+        {"$limit": 1},
+    ]), None)
+    if found is None:
+        return None, None
+    return (admins if found.pop("_kind") == "admin" else users), found
+
+# ----------------- CARTS -----------------
+# Carts and wishlists live server-side as {med_id: qty}; the session only
+# holds a cart ID, issued at login.
+if os.environ.get("PHARMACARE_CART_STORE") == "memory":
+    cart_store = carts.MemoryCartStore()
+else:
+    cart_store = carts.MongoCartStore(db["carts"])
+
+def current_cart_id():
+    if 'cart_id' not in session:
+        session['cart_id'] = uuid.uuid4().hex
+    return session['cart_id']
+
+def saved_items(kind=carts.CART):
+    return carts.hydrate(medicines, {kind: cart_store.get(current_cart_id(), kind)})[kind]
+
+def cart_and_wishlist():
+    # Both lists hydrated with a single query for page renders
+    lists = carts.hydrate(medicines, cart_store.get_all(current_cart_id()))
+    return lists[carts.CART], lists[carts.WISHLIST]
+
+# ----------------- ORDER PIPELINE -----------------
+# complete_payment only queues the order; worker threads (or `flask
+# order-worker` with PHARMACARE_ORDER_WORKERS=0) apply stock and rollups.
+orders_queue = order_pipeline.OrderPipeline(
+    client, db, cart_store,
+    workers=int(os.environ.get("PHARMACARE_ORDER_WORKERS", 1)),
+    lease=float(os.environ.get("PHARMACARE_ORDER_LEASE", 30)),
+    stock_changed=stock_changed,
+)
+
+def order_status(order):
+    status = order_pipeline.status_of(order)
+    body = {"order_id": str(order["_id"]), "status": status, "redirect": f"/receipt/{order['_id']}"}
+    if status == order_pipeline.FAILED:
+        body["message"] = order["failure"]["message"]
+        body["out_of_stock"] = order["failure"].get("out_of_stock", [])
+    return body
+
+# ----------------- HEALTH -----------------
+# /healthz is liveness and never touches Mongo; /readyz pings it and checks
+# this worker's connection pool, so a load balancer only routes to workers
+# that can serve.
+READY_TIMEOUT = float(os.environ.get("PHARMACARE_READY_TIMEOUT", 2.0))
+
+@app.route("/healthz")
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz")
+def readyz():
+    ready, details = mongo_connection.check(READY_TIMEOUT)
+    details["status"] = "ready" if ready else "unavailable"
+    response = jsonify(details)
+    response.cache_control.no_store = True
+    return response, 200 if ready else 503
 
 # ----------------- PUBLIC LANDING PAGE -----------------
 @app.route("/")
 def landing_page():
-    # Fetch data needed for the landing page
-    all_medicines = list(medicines.find())
-    all_deals = list(deals.find())
-    
-    # Fetch Top Selling (Sort by sold)
-    top_medicines = list(medicines.find().sort("sold", -1).limit(8))
-    for m in top_medicines:
-        m['_id'] = str(m['_id'])
-
-    # Fetch Banners
-    carousel_banners = list(carousel.find())
-    for b in carousel_banners:
-        b['_id'] = str(b['_id'])
-
-    # Fetch Brands
-    all_brands = list(brands.find())
-    for brand in all_brands:
-        brand['_id'] = str(brand['_id'])
-
-    # Convert IDs to string for template compatibility
-    for med in all_medicines:
-        med['_id'] = str(med['_id'])
-
-    return render_template("landing_page.html", 
-                         medicines=all_medicines, 
-                         deals=all_deals, 
-                         top_medicines=top_medicines,
-                         carousel_banners=carousel_banners,
-                         brands=all_brands)
+    # Catalog blocks come from the fragment cache; a warm hit makes no Mongo calls
+    fragments = {
+        "landing_offers": fragment("landing_offers", lambda: {"medicines": cached_medicines(), "deals": cached_deals()}),
+        "landing_top_sellers": fragment("landing_top_sellers", lambda: {"top_medicines": cached_top_medicines()}),
+        "carousel": fragment("carousel", lambda: {"carousel_banners": cached_carousel()}),
+        "landing_brands": fragment("landing_brands", lambda: {"brands": cached_brands()}),
+    }
+    html = render_template("landing_page.html", fragments=fragments, deals=cached_deals())
+    return cacheable(app.make_response(html), LANDING_MAX_AGE)
 
 # ------------------- API: MEDICINE DETAILS (Allows guests to view details on landing page) -----------------
 @app.route("/api/medicine/<id>")
 def get_medicine_details_api(id):
     # Allows guests to view details via modal on landing page
     try:
-        med = medicines.find_one({"_id": ObjectId(id)})
+        med = medicine_reads.find_one({"_id": ObjectId(id)}, MEDICINE_DETAIL_FIELDS)
         if med:
             med['_id'] = str(med['_id'])
-            return jsonify(med)
+            return cacheable(jsonify(med), MEDICINE_MAX_AGE)
         return jsonify({"error": "Medicine not found"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# ------------------- API: CATALOG PAGES -----------------
+@app.route("/api/medicines")
+def list_medicines_api():
+    # Keyset-paginated catalog; pass back `next_cursor` to get the following page
+    args = request.args
+    try:
+        query = catalog.build_filter(
+            category=args.get("category"),
+            min_price=args.get("min_price"),
+            max_price=args.get("max_price"),
+            price_range=args.get("price"),
+        )
+        items, next_cursor = catalog.fetch_page(
+            medicine_reads, query,
+            sort=args.get("sort", catalog.DEFAULT_SORT),
+            cursor=args.get("cursor"),
+            limit=args.get("limit", catalog.PAGE_SIZE, type=int),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"items": [row.as_dict() for row in items], "next_cursor": next_cursor})
+
+# ------------------- API: SEARCH -----------------
+@app.route("/api/search")
+def search_api():
+    # Typeahead hits come straight from the in-memory index; `full=1` re-reads
+    # the matched documents so the catalog grid gets live stock levels
+    search_index.ensure_built(load_search_docs)
+    search_index.refresh_async(load_search_docs, SEARCH_REBUILD_SECONDS)
+    limit = max(1, min(request.args.get("limit", 10, type=int), catalog.MAX_PAGE_SIZE))
+    hits = search_index.search(request.args.get("q", ""), limit=limit,
+                               prefix=request.args.get("mode", "prefix") == "prefix")
+    if request.args.get("full") == "1" and hits:
+        order = {h["_id"]: i for i, h in enumerate(hits)}
+        docs = catalog.rows(medicine_reads.find({"_id": {"$in": [ObjectId(h["_id"]) for h in hits]}}, catalog.LIST_FIELDS))
+        hits = [row.as_dict() for row in sorted(docs, key=lambda row: order[row._id])]
+    return jsonify({"items": hits})
+
+# ------------------- API: RECOMMENDATIONS -----------------
+@app.route("/api/recommendations")
+def recommendations_api():
+    # `medicine_id` (repeatable): frequently bought together with those
+    # medicines; without it, picks for the logged-in customer. Top sellers
+    # fill in while the index loads and when there is no purchase history.
+    recommender.refresh_async(orders, RECOMMENDATIONS_REFRESH_SECONDS, RECOMMENDATIONS_PATH)
+    limit = max(1, min(request.args.get("limit", recommendations.DEFAULT_LIMIT, type=int), recommendations.MAX_LIMIT))
+    med_ids = request.args.getlist("medicine_id")
+    if med_ids:
+        # Overfetch so out of stock picks can be dropped
+        picks = recommender.similar(med_ids, 2 * limit)
+    elif 'user' in session:
+        picks = recommender.for_customer(session['user']['email'], 2 * limit)
+    else:
+        picks = []
+    scores = dict(pick for pick in picks if ObjectId.is_valid(pick[0]))
+    items = []
+    if scores:
+        rank = {med_id: i for i, med_id in enumerate(scores)}
+        docs = catalog.rows(medicine_reads.find({"_id": {"$in": [ObjectId(med_id) for med_id in scores]}},
+                                                catalog.LIST_FIELDS))
+        items = [dict(row.as_dict(), score=scores[row._id])
+                 for row in sorted(docs, key=lambda row: rank[row._id]) if row.get("quantity", 0) > 0][:limit]
+    source = "co_purchase"
+    if not items:
+        source = "top_sellers"
+        items = [row.as_dict() for row in cached_top_medicines() if row._id not in med_ids][:limit]
+    response = jsonify({"items": items, "source": source})
+    if med_ids:
+        return cacheable(response, RECOMMENDATIONS_MAX_AGE)
+    return response
+
 # ------------------- REGISTER -------------------
 @app.route("/register")
 def register_page():
@@ -83,16 +405,26 @@ def register_page():
 @app.route("/register", methods=["POST"])
 def register():
     data = request.json
+    retry_after = auth_ip_limit.take(request.remote_addr)
+    if retry_after:
+        return _throttled(retry_after)
     if users.find_one({"email": data["email"]}):
         return jsonify({"message": "Email already exists"}), 400
-    hashed_password = bcrypt.hashpw(data["password"].encode("utf-8"), bcrypt.gensalt())
-    users.insert_one({
-        "owner_name": data["owner_name"],
-        "email": data["email"],
-        "phone": data["phone"],
-        "password": hashed_password,
-        "role": "user"
-    })
+    try:
+        hashed_password = password_hasher.hash(data["password"])
+    except passwords.Overloaded:
+        return _hashing_busy()
+    try:
+        users.insert_one({
+            "owner_name": data["owner_name"],
+            "email": data["email"],
+            "phone": data["phone"],
+            "password": hashed_password,
+            "role": "user"
+        })
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration for the same email.
+        return jsonify({"message": "Email already exists"}), 400
     return jsonify({"message": "Registered successfully"})
 
 
@@ -104,26 +436,37 @@ def login_page():
 @app.route("/login", methods=["POST"])
 def login():
     data = request.json
-    user = users.find_one({"email": data["email"]})
-    admin = admins.find_one({"email": data["email"]})
-
-    if admin:
-        if bcrypt.checkpw(data["password"].encode("utf-8"), admin["password"]):
-            session['admin'] = {"name": admin['owner_name'], "email": admin['email']}
-            return jsonify({"message": f"Welcome Admin {admin['owner_name']}!", "role": "admin"})
-        else:
-            return jsonify({"message": "Incorrect password"}), 400
+    retry_after = auth_ip_limit.take(request.remote_addr) or login_email_limit.take(data["email"].lower())
+    if retry_after:
+        return _throttled(retry_after)
 
-    if user:
-        if bcrypt.checkpw(data["password"].encode("utf-8"), user["password"]):
-            session['user'] = {"name": user['owner_name'], "email": user['email']}
-            session['cart'] = []
-            session['wishlist'] = []
-            return jsonify({"message": f"Welcome {user['owner_name']}!", "role": "user"})
-        else:
+    collection, account = find_account(data["email"])
+    if account is None:
+        return jsonify({"message": "Email not registered"}), 400
+
+    try:
+        if not password_hasher.check(data["password"], account["password"]):
             return jsonify({"message": "Incorrect password"}), 400
+    except passwords.Overloaded:
+        return _hashing_busy()
 
-    return jsonify({"message": "Email not registered"}), 400
+    if password_hasher.needs_rehash(account["password"]):
+        try:
+            # Only replace the hash we checked against, in case of a concurrent change.
+            collection.update_one({"_id": account["_id"], "password": account["password"]},
+                                  {"$set": {"password": password_hasher.hash(data["password"])}})
+        except passwords.Overloaded:
+            pass  # upgrade on a later login
+
+    if collection is admins:
+        session['admin'] = {"name": account['owner_name'], "email": account['email']}
+        return jsonify({"message": f"Welcome Admin {account['owner_name']}!", "role": "admin"})
+
+    session['user'] = {"name": account['owner_name'], "email": account['email']}
+    session['cart_id'] = uuid.uuid4().hex
+    # Where the order pipeline puts back the lines of a failed order
+    users.update_one({"_id": account["_id"]}, {"$set": {"cart_id": session['cart_id']}})
+    return jsonify({"message": f"Welcome {account['owner_name']}!", "role": "user"})
 
 # ------------------- USER HOME -------------------
 @app.route("/home")
@@ -131,47 +474,21 @@ def user_home():
     if 'user' not in session:
         return redirect(url_for('login_page'))
     
-    # Fetch all medicines
-    all_medicines = list(medicines.find())
-    
-    # Fetch Top Selling
-    top_medicines = list(medicines.find().sort("sold", -1).limit(8))
-    for m in top_medicines:
-        m['_id'] = str(m['_id'])
-    
-    # Fetch Carousel Banners
-    carousel_banners = list(carousel.find())
-    for b in carousel_banners:
-        b['_id'] = str(b['_id'])
-
-    # Fetch Active Deals
-    all_deals = list(deals.find())
-    
-    # --- FETCH BRANDS ---
-    all_brands = list(brands.find())
-    for brand in all_brands:
-        brand['_id'] = str(brand['_id'])
-    
-    # --- LOGIC: Filter medicines that have deals ---
-    deal_categories = [deal['category'] for deal in all_deals]
-    medicines_with_deals = []
-    for med in all_medicines:
-        if "All" in deal_categories or med['category'] in deal_categories:
-            med['_id'] = str(med['_id'])
-            medicines_with_deals.append(med)
-    
-    if 'wishlist' not in session:
-        session['wishlist'] = []
+    # Special offers only list medicines that have a deal
+    fragments = {
+        "home_offers": fragment("home_offers", offers_context),
+        "home_top_sellers": fragment("home_top_sellers", lambda: {"top_medicines": cached_top_medicines()}),
+        "carousel": fragment("carousel", lambda: {"carousel_banners": cached_carousel()}),
+        "home_brands": fragment("home_brands", lambda: {"brands": cached_brands()}),
+    }
+    cart, wishlist = cart_and_wishlist()
     
     return render_template("user_index.html", 
                          user=session['user'], 
-                         medicines=medicines_with_deals, 
-                         top_medicines=top_medicines,
-                         carousel_banners=carousel_banners,
-                         brands=all_brands, 
-                         cart=session.get('cart', []), 
-                         wishlist=session.get('wishlist', []),
-                         deals=all_deals)
+                         fragments=fragments,
+                         cart=cart, 
+                         wishlist=wishlist,
+                         deals=cached_deals())
 
 # ------------------- ALL MEDICINES PAGE -------------------
 @app.route("/medicines")
@@ -179,27 +496,17 @@ def medicines_page():
     if 'user' not in session:
         return redirect(url_for('login_page'))
     
-    all_medicines = list(medicines.find())
-    
-    # Convert IDs to string for template compatibility
-    for med in all_medicines:
-        med['_id'] = str(med['_id'])
-        
-    # Get distinct categories and sort them
-    categories = sorted(list(medicines.distinct("category")))
-    
-    all_deals = list(deals.find())
-    
-    if 'wishlist' not in session:
-        session['wishlist'] = []
+    # Only the first page is rendered (and cached); the rest is fetched from /api/medicines
+    fragments = {"medicine_grid": fragment("medicine_grid", medicine_grid_context)}
+    cart, wishlist = cart_and_wishlist()
 
     return render_template("medicines.html", 
                          user=session['user'], 
-                         medicines=all_medicines, 
-                         cart=session.get('cart', []), 
-                         wishlist=session.get('wishlist', []),
-                         deals=all_deals,
-                         categories=categories)
+                         fragments=fragments,
+                         cart=cart, 
+                         wishlist=wishlist,
+                         deals=cached_deals(),
+                         categories=cached_categories())
 
 # ------------------- CART -------------------
 @app.route("/user/add_to_cart", methods=["POST"])
@@ -207,31 +514,32 @@ def add_to_cart():
     if 'user' not in session:
         return jsonify({"message":"Login first"}), 401
     data = request.json
-    med = medicines.find_one({"_id": ObjectId(data["med_id"])})
+    med = medicines.find_one({"_id": ObjectId(data["med_id"])}, {"quantity": 1})
     if not med: return jsonify({"message":"Medicine not found"}), 404
     if med["quantity"] <= 0: return jsonify({"message":"Medicine out of stock"}), 400
 
-    cart_item = {
-        "id": str(med["_id"]), 
-        "name": med["name"], 
-        "price": med["price"],
-        "category": med["category"], 
-        "image": med.get("image", "/static/images/default.png")
-    }
-    session['cart'].append(cart_item)
-    session.modified = True
-    return jsonify({"message":"Added to cart", "cart": session['cart']})
+    cart_store.add(current_cart_id(), carts.CART, str(med["_id"]))
+    return jsonify({"message":"Added to cart", "cart": saved_items()})
+
+@app.route("/user/update_cart", methods=["POST"])
+def update_cart():
+    if 'user' not in session:
+        return jsonify({"message":"Login first"}), 401
+    data = request.json
+    quantity = data.get("quantity")
+    if not isinstance(quantity, int) or isinstance(quantity, bool):
+        return jsonify({"message":"Quantity must be a whole number"}), 400
+    med_id = str(ObjectId(data["med_id"]))
+    cart_store.set(current_cart_id(), carts.CART, med_id, quantity)
+    return jsonify({"message":"Cart updated", "cart": saved_items()})
 
 @app.route("/user/remove_from_cart", methods=["POST"])
 def remove_from_cart():
     if 'user' not in session:
         return jsonify({"message":"Login first"}), 401
     data = request.json
-    cart = session.get('cart', [])
-    new_cart = [item for item in cart if item["id"] != data["med_id"]]
-    session['cart'] = new_cart
-    session.modified = True
-    return jsonify({"message":"Removed from cart", "cart": session['cart']})
+    cart_store.remove(current_cart_id(), carts.CART, str(ObjectId(data["med_id"])))
+    return jsonify({"message":"Removed from cart", "cart": saved_items()})
 
 # ------------------- WISHLIST -------------------
 @app.route("/user/add_to_wishlist", methods=["POST"])
@@ -239,35 +547,25 @@ def add_to_wishlist():
     if 'user' not in session:
         return jsonify({"message":"Login first"}), 401
     data = request.json
-    med = medicines.find_one({"_id": ObjectId(data["med_id"])})
+    med = medicines.find_one({"_id": ObjectId(data["med_id"])}, {"_id": 1})
     if not med: return jsonify({"message":"Medicine not found"}), 404
 
-    wishlist = session.get('wishlist', [])
-    if not any(item['id'] == str(med["_id"]) for item in wishlist):
-        wishlist_item = {
-            "id": str(med["_id"]), 
-            "name": med["name"], 
-            "price": med["price"],
-            "category": med["category"], 
-            "image": med.get("image", "/static/images/default.png")
-        }
-        wishlist.append(wishlist_item)
-        session['wishlist'] = wishlist
-        session.modified = True
-        return jsonify({"message":"Added to wishlist", "wishlist": session['wishlist'], "action": "added"})
-    
-    return jsonify({"message":"Already in wishlist", "wishlist": session['wishlist'], "action": "exists"})
+    med_id = str(med["_id"])
+    action = "exists"
+    if med_id not in cart_store.get(current_cart_id(), carts.WISHLIST):
+        cart_store.set(current_cart_id(), carts.WISHLIST, med_id, 1)
+        action = "added"
+    wishlist = saved_items(carts.WISHLIST)
+    message = "Added to wishlist" if action == "added" else "Already in wishlist"
+    return jsonify({"message": message, "wishlist": wishlist, "action": action})
 
 @app.route("/user/remove_from_wishlist", methods=["POST"])
 def remove_from_wishlist():
     if 'user' not in session:
         return jsonify({"message":"Login first"}), 401
     data = request.json
-    wishlist = session.get('wishlist', [])
-    new_wishlist = [item for item in wishlist if item["id"] != data["med_id"]]
-    session['wishlist'] = new_wishlist
-    session.modified = True
-    return jsonify({"message":"Removed from wishlist", "wishlist": session['wishlist']})
+    cart_store.remove(current_cart_id(), carts.WISHLIST, str(ObjectId(data["med_id"])))
+    return jsonify({"message":"Removed from wishlist", "wishlist": saved_items(carts.WISHLIST)})
 
 # ------------------- ADMIN DASHBOARD -------------------
 @app.route("/dashboard")
@@ -275,53 +573,40 @@ def dashboard():
     if 'admin' not in session:
         return redirect(url_for('login_page'))
 
-    all_medicines = list(medicines.find())
-    all_deals = list(deals.find())
-    all_banners = list(carousel.find())
-    all_brands = list(brands.find())
+    # Inventory rows; the edit form loads the description on demand
+    all_medicines = catalog.rows(medicines.find({}, catalog.LIST_FIELDS))
 
-    for med in all_medicines: med['_id'] = str(med['_id'])
-    for deal in all_deals: deal['_id'] = str(deal['_id'])
-    for b in all_banners: b['_id'] = str(b['_id'])
-    for brand in all_brands: brand['_id'] = str(brand['_id'])
-
-    total_medicines = len(all_medicines)
-    low_stock = sum(1 for m in all_medicines if m.get("quantity", 0) < 10 and m.get("quantity", 0) > 0)
-    out_of_stock = sum(1 for m in all_medicines if m.get("quantity", 0) == 0)
-    total_sales_count = sum(m.get("sold", 0) for m in all_medicines)
-    total_users_count = users.count_documents({})
-    total_revenue = sum(order.get("total", 0) for order in orders.find())
+    # KPIs: one aggregation pass over medicines plus the running revenue and
+    # stock status counters
+    kpis = stats.catalog_kpis(medicines)
+    stock = stock_levels.stock_counts(db, cached_stock_thresholds())
+    revenue = stats.revenue_totals(db)
+    total_users_count = users.estimated_document_count()
 
     return render_template(
         "dashboard.html",
         admin=session['admin'],
         medicines=all_medicines,
-        deals=all_deals,
-        banners=all_banners,
-        brands=all_brands, 
-        total_medicines=total_medicines,
-        low_stock=low_stock,
-        out_of_stock=out_of_stock,
-        total_sales=total_sales_count,
+        deals=cached_deals(),
+        banners=cached_carousel(),
+        brands=cached_brands(), 
+        total_medicines=kpis["total_medicines"],
+        low_stock=stock["low_stock"],
+        out_of_stock=stock["out_of_stock"],
+        total_sales=kpis["total_sales"],
         total_users=total_users_count,
-        total_revenue=total_revenue
+        total_revenue=revenue["total"]
     )
 
 @app.route("/admin/dashboard_data")
 def dashboard_data():
     if 'admin' not in session:
         return jsonify({"error":"Unauthorized"}), 401
-    today = datetime.today()
-    
-    sales_over_time = {"dates": [], "amounts": []}
-    for i in range(7):
-        day = today - timedelta(days=6-i)
-        start = datetime(day.year, day.month, day.day)
-        end = start + timedelta(days=1)
-        daily_orders = list(orders.find({"date": {"$gte": start, "$lt": end}}))
-        total_amount = sum(order.get("total", 0) for order in daily_orders)
-        sales_over_time["dates"].append(day.strftime("%d %b"))
-        sales_over_time["amounts"].append(total_amount)
+    days = request.args.get("days", 7, type=int)
+    granularity = request.args.get("granularity", "day")
+    if not stats.valid_chart_window(days, granularity):
+        return jsonify({"error": "Unsupported chart window"}), 400
+    sales_over_time = stats.sales_over_time(db, days, granularity)
 
     top_meds_cursor = medicines.find().sort("sold", -1).limit(5)
     top_meds = {"names": [], "sold": []}
@@ -329,28 +614,11 @@ def dashboard_data():
         top_meds["names"].append(med["name"])
         top_meds["sold"].append(med.get("sold",0))
 
-    in_stock = medicines.count_documents({"quantity": {"$gte": 10}})
-    low_stock_count = medicines.count_documents({"quantity": {"$gt": 0, "$lt": 10}})
-    out_of_stock_count = medicines.count_documents({"quantity": 0})
-    stock_status = {"in_stock": in_stock, "low_stock": low_stock_count, "out_of_stock": out_of_stock_count}
+    stock_status = stock_levels.stock_counts(db, cached_stock_thresholds())
 
-    top_users_pipeline = [
-        {"$group": {"_id": "$user_email", "total_spent": {"$sum": "$total"}, "order_count": {"$sum": 1}}},
-        {"$sort": {"total_spent": -1}},
-        {"$limit": 5}
-    ]
-    
-    top_users_cursor = orders.aggregate(top_users_pipeline)
-    top_users_list = []
-    for u in top_users_cursor:
-        user_info = users.find_one({"email": u["_id"]})
-        name = user_info['owner_name'] if user_info else "Unknown User"
-        top_users_list.append({
-            "name": name,
-            "email": u["_id"],
-            "spent": round(u["total_spent"], 2),
-            "orders": u["order_count"]
-        })
+    top_limit = max(1, min(request.args.get("top_limit", 5, type=int), stats.MAX_LEADERBOARD))
+    top_offset = max(0, request.args.get("top_offset", 0, type=int))
+    top_users_list = stats.top_customers(db, limit=top_limit, offset=top_offset)
 
     return jsonify({
         "sales_over_time": sales_over_time,
@@ -359,6 +627,75 @@ def dashboard_data():
         "top_users": top_users_list
     })
 
+@app.route("/admin/reports")
+def admin_reports():
+    if 'admin' not in session:
+        return jsonify({"error":"Unauthorized"}), 401
+    snapshot = sales_reports.current()
+    return jsonify({"reports": list(reports.REPORTS), "snapshot": snapshot.manifest if snapshot else None})
+
+@app.route("/admin/reports/<name>")
+def admin_report(name):
+    # start/end (YYYY-MM-DD, inclusive) limit the orders; cohorts also take months
+    if 'admin' not in session:
+        return jsonify({"error":"Unauthorized"}), 401
+    if name not in reports.REPORTS:
+        return jsonify({"error": "Unknown report"}), 404
+    snapshot = sales_reports.current()
+    if snapshot is None:
+        return jsonify({"error": "No sales snapshot yet; run flask snapshot-reports"}), 503
+    try:
+        start = reports.parse_day(request.args.get("start"))
+        end = reports.parse_day(request.args.get("end"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    options = {"months": request.args.get("months", reports.COHORT_MONTHS, type=int)} if name == "cohorts" else {}
+    result = reports.REPORTS[name](snapshot, start, end, **options)
+    return jsonify(dict(result, report=name, snapshot=snapshot.manifest))
+
+@app.route("/admin/low_stock")
+def low_stock():
+    # Medicines at or under their category's threshold, emptiest first
+    if 'admin' not in session:
+        return jsonify({"error":"Unauthorized"}), 401
+    thresholds = cached_stock_thresholds()
+    try:
+        items, next_cursor = stock_levels.low_stock(
+            db, thresholds,
+            category=request.args.get("category"),
+            cursor=request.args.get("cursor"),
+            limit=request.args.get("limit", stock_levels.PAGE_SIZE, type=int),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"counts": stock_levels.stock_counts(db, thresholds), "items": items, "next_cursor": next_cursor})
+
+@app.route("/admin/low_stock/thresholds", methods=["GET", "POST"])
+def stock_thresholds():
+    if 'admin' not in session:
+        return jsonify({"error":"Unauthorized"}), 401
+    if request.method == "GET":
+        return jsonify({"default": stock_levels.DEFAULT_THRESHOLD, "categories": cached_stock_thresholds()})
+    data = request.json or {}
+    category = str(data.get("category") or "").strip()
+    threshold = data.get("threshold")
+    if not category:
+        return jsonify({"message": "Missing field: category"}), 400
+    if threshold is not None and (not isinstance(threshold, int) or isinstance(threshold, bool) or threshold < 1):
+        return jsonify({"message": f"Invalid threshold: {threshold!r}"}), 400
+    counts = stock_levels.set_threshold(db, category, threshold)
+    reference_cache.invalidate("stock_thresholds")
+    return jsonify({"message": "Threshold updated", "counts": counts})
+
+@app.route("/admin/metrics")
+def admin_metrics():
+    # Prometheus text format; admins in the browser, scrapers with the token
+    auth = request.headers.get("Authorization", "")
+    token_ok = bool(METRICS_TOKEN) and hmac.compare_digest(auth, f"Bearer {METRICS_TOKEN}")
+    if 'admin' not in session and not token_ok:
+        return jsonify({"error":"Unauthorized"}), 401
+    return app.response_class(instrumentation.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.route("/admin/add_banner", methods=["POST"])
 def add_banner():
     if 'admin' not in session:
@@ -371,6 +708,7 @@ def add_banner():
             "image": data.get('image', 'https://via.placeholder.com/800x400'),
             "link": data.get('link', '/shop')
         })
+        reference_cache.invalidate("carousel")
         return jsonify({"message":"Banner added successfully"})
     except Exception as e:
         return jsonify({"message": str(e)}), 500
@@ -382,6 +720,7 @@ def delete_banner():
     data = request.json
     try:
         carousel.delete_one({"_id": ObjectId(data['id'])})
+        reference_cache.invalidate("carousel")
         return jsonify({"message":"Banner deleted successfully"})
     except Exception as e:
         return jsonify({"message": f"Error: {str(e)}"}), 500
@@ -391,13 +730,19 @@ def add_deal():
     if 'admin' not in session:
         return jsonify({"message":"Unauthorized"}), 401
     data = request.json
+    try:
+        discount_pct = parse_discount(data.get('discount', "0%"))
+    except (TypeError, ValueError):
+        return jsonify({"message": f"Invalid discount: {data.get('discount')}"}), 400
     deals.insert_one({
         "title": data['title'],
         "description": data.get('description', ""),
-        "discount": data.get('discount', "0%"),
+        "discount": f"{discount_pct:g}%",
+        "discount_pct": discount_pct,
         "code": data.get('code', "OFFER"),
         "category": data.get('category', "All")
     })
+    reference_cache.invalidate("deals", "deal_book")
     return jsonify({"message":"Deal added successfully"})
 
 @app.route("/admin/delete_deal", methods=["POST"])
@@ -407,6 +752,7 @@ def delete_deal():
     data = request.json
     try:
         deals.delete_one({"_id": ObjectId(data['id'])})
+        reference_cache.invalidate("deals", "deal_book")
         return jsonify({"message":"Deal deleted successfully"})
     except Exception as e:
         return jsonify({"message": f"Error: {str(e)}"}), 500
@@ -417,15 +763,14 @@ def add_medicine():
         return jsonify({"message":"Unauthorized"}), 401
     data = request.json
     try:
-        medicines.insert_one({
-            "name": data['name'],
-            "category": data.get('category', "General"),
-            "price": float(data['price']),
-            "quantity": int(data['quantity']),
-            "sold": 0,
-            "description": data.get('description', "No description available."), # UPDATED: Handles description
-            "image": data.get('image', "/static/images/default.png")
-        })
+        med = {**catalog_io.medicine_fields(data), "sold": 0}
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    try:
+        medicines.insert_one(med)
+        stock_changed([med["_id"]])
+        search_index.upsert(med)
+        reference_cache.invalidate("medicines", "top_medicines", "categories")
         return jsonify({"message":"Medicine added successfully"})
     except Exception as e:
         return jsonify({"message": str(e)}), 500
@@ -435,7 +780,9 @@ def delete_medicine():
     if 'admin' not in session:
         return jsonify({"message":"Unauthorized"}), 401
     data = request.json
-    medicines.delete_one({"_id": ObjectId(data['id'])})
+    stock_levels.forget(db, medicines.find_one_and_delete({"_id": ObjectId(data['id'])}))
+    search_index.remove(data['id'])
+    reference_cache.invalidate("medicines", "top_medicines", "categories")
     return jsonify({"message":"Medicine deleted successfully"})
 
 @app.route("/admin/edit_medicine", methods=["POST"])
@@ -443,19 +790,56 @@ def edit_medicine():
     if 'admin' not in session:
         return jsonify({"message":"Unauthorized"}), 401
     data = request.json
-    medicines.update_one(
-        {"_id": ObjectId(data['id'])},
-        {"$set": {
-            "name": data['name'],
-            "category": data.get('category', "General"),
-            "price": float(data['price']),
-            "quantity": int(data['quantity']),
-            "description": data.get('description', "No description available."), # UPDATED
-            "image": data.get('image', "/static/images/default.png")
-        }}
-    )
+    try:
+        changes = catalog_io.medicine_fields(data)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    result = medicines.update_one({"_id": ObjectId(data['id'])}, {"$set": changes})
+    if result.matched_count:
+        stock_changed([data['id']])
+        search_index.upsert({"_id": data['id'], **changes})
+    reference_cache.invalidate("medicines", "top_medicines", "categories")
     return jsonify({"message":"Medicine updated successfully"})
 
+def catalog_changed():
+    # After a bulk import: every cached catalog view now; stock statuses and
+    # this process's search index are rebuilt in the background so a large
+    # import does not hold the request (other processes' indexes catch up on
+    # their periodic rebuild)
+    reference_cache.invalidate("medicines", "top_medicines", "categories")
+    search_index.refresh_async(load_search_docs, 0)
+    threading.Thread(target=stock_levels.rebuild, args=(db, cached_stock_thresholds()), daemon=True).start()
+
+@app.route("/admin/medicines/import", methods=["POST"])
+def import_medicines():
+    # Streams the request body (CSV or JSON Lines); rows are upserted in
+    # batches and failures come back per line
+    if 'admin' not in session:
+        return jsonify({"message":"Unauthorized"}), 401
+    fmt = request.args.get("format") or ("jsonl" if "json" in (request.mimetype or "") else "csv")
+    if fmt not in catalog_io.FORMATS:
+        return jsonify({"message": f"Unsupported format: {fmt}"}), 400
+    stream = io.TextIOWrapper(request.stream, encoding="utf-8-sig", newline="" if fmt == "csv" else None)
+    try:
+        report = catalog_io.import_medicines(medicines, stream, fmt)
+    except UnicodeDecodeError:
+        return jsonify({"message": "Upload must be UTF-8 text"}), 400
+    finally:
+        # Batches before a decode error are already written
+        catalog_changed()
+    return jsonify(report.as_dict())
+
+@app.route("/admin/medicines/export")
+def export_medicines():
+    if 'admin' not in session:
+        return jsonify({"message":"Unauthorized"}), 401
+    fmt = request.args.get("format", "csv")
+    if fmt not in catalog_io.FORMATS:
+        return jsonify({"message": f"Unsupported format: {fmt}"}), 400
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(stream_with_context(catalog_io.export_medicines(medicines, fmt)), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=medicines.{fmt}"})
+
 @app.route("/admin/add_brand", methods=["POST"])
 def add_brand():
     if 'admin' not in session:
@@ -466,6 +850,7 @@ def add_brand():
             "name": data['name'],
             "image": data.get('image', "https://via.placeholder.com/100")
         })
+        reference_cache.invalidate("brands")
         return jsonify({"message":"Brand added successfully"})
     except Exception as e:
         return jsonify({"message": str(e)}), 500
@@ -477,6 +862,7 @@ def delete_brand():
     data = request.json
     try:
         brands.delete_one({"_id": ObjectId(data['id'])})
+        reference_cache.invalidate("brands")
         return jsonify({"message":"Brand deleted successfully"})
     except Exception as e:
         return jsonify({"message": f"Error: {str(e)}"}), 500
@@ -485,82 +871,63 @@ def delete_brand():
 def checkout():
     if 'user' not in session: return redirect(url_for('login_page'))
     
-    raw_cart = session.get('cart', [])
+    raw_cart = saved_items()
     user = session['user']
     if not raw_cart: return redirect(url_for('user_home'))
     
-    active_deals = list(deals.find())
-    processed_cart = []
-    subtotal = 0.0
-    total_savings = 0.0
-    
-    for item in raw_cart:
-        item_discount_percent = 0
-        applied_deal = None
-        for deal in active_deals:
-            if deal.get('category') == item.get('category') or deal.get('category') == 'All':
-                discount_str = deal.get('discount', '0%').replace('%', '')
-                try:
-                    item_discount_percent = float(discount_str)
-                    applied_deal = deal
-                except: pass
-        
-        original_price = float(item['price'])
-        if item_discount_percent > 0:
-            discount_value = original_price * (item_discount_percent / 100)
-            final_price = original_price - discount_value
-            total_savings += discount_value
-        else:
-            final_price = original_price
-        subtotal += final_price
-        
-        processed_cart.append({
-            "id": item['id'], "name": item['name'], "image": item['image'],
-            "original_price": original_price, "final_price": final_price,
-            "discount_percent": item_discount_percent, "applied_deal": applied_deal
-        })
+    processed_cart, subtotal, total_savings = cached_deal_book().price_cart(raw_cart)
 
-    return render_template("checkout.html", cart=processed_cart, user=user, subtotal=round(subtotal, 2), total_savings=round(total_savings, 2))
+    return render_template("checkout.html", cart=processed_cart, user=user, subtotal=subtotal, total_savings=total_savings)
 
 @app.route("/complete_payment", methods=["POST"])
 def complete_payment():
     if 'user' not in session: return jsonify({"message":"Login first"}), 401
-    data = request.json
-    raw_cart = session.get('cart', [])
+    data = request.json or {}
+    # A retried checkout (double click, dropped response) sends the same key
+    # and gets the order it already placed.
+    idempotency_key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    if idempotency_key:
+        existing = orders_queue.find(session['user']['email'], idempotency_key)
+        if existing:
+            return jsonify(dict(order_status(existing), message="Order already placed"))
+    else:
+        idempotency_key = uuid.uuid4().hex
+
+    raw_cart = saved_items()
     if not raw_cart: return jsonify({"message":"Cart is empty"}), 400
     
-    active_deals = list(deals.find())
-    total_amount = 0.0
-    
-    # Calculate total
-    for item in raw_cart:
-        price = float(item['price'])
-        discount = 0
-        for deal in active_deals:
-            if deal.get('category') == item.get('category') or deal.get('category') == 'All':
-                try: discount = float(deal.get('discount', '0%').replace('%', ''))
-                except: pass
-                break
-        final = price * (1 - (discount/100))
-        total_amount += final
-
-    # UPDATE STOCK AND SALES COUNT
-    for item in raw_cart:
-        medicines.update_one(
-            {"_id": ObjectId(item['id'])}, 
-            {"$inc": {"sold": 1, "quantity": -1}}  # <--- FIXED: Added "quantity": -1
-        )
-    
+    priced, total_amount, _ = cached_deal_book().price_cart(raw_cart)
+    # Lines keep the deal they were priced under, for /admin/reports
+    for item, line in zip(raw_cart, priced):
+        deal = line["applied_deal"]
+        if deal:
+            item.update(discount_percent=line["discount_percent"], deal_id=str(deal["_id"]),
+                        deal=deal.get("title") or deal.get("code"))
+
     order = {
         "user_email": session['user']['email'], "user_name": session['user']['name'],
-        "cart": raw_cart, "total": round(total_amount, 2),
+        "cart": raw_cart, "total": total_amount,
         "payment_info": {"card_last4": data.get("cardNumber", "")[-4:], "method": "Card"},
         "date": datetime.now()
     }
-    order_id = orders.insert_one(order).inserted_id
-    session['cart'] = []
-    session.modified = True
-    return jsonify({"message":"Payment successful", "redirect": f"/receipt/{order_id}"})
+
+    # Stock and sales counts are applied by an order worker; the receipt
+    # page polls until it has. submit empties the cart before queueing.
+    order, created = orders_queue.submit(order, idempotency_key, cart_id=current_cart_id())
+    if not created:
+        return jsonify(dict(order_status(order), message="Order already placed"))
+    return jsonify(dict(order_status(order), message="Payment successful, confirming your order")), 202
+
+@app.route("/api/orders/<order_id>/status")
+def order_status_api(order_id):
+    if 'user' not in session: return jsonify({"error": "Unauthorized"}), 401
+    try:
+        order = orders.find_one({"_id": ObjectId(order_id)}, {"user_email": 1, "status": 1, "failure": 1})
+    except InvalidId:
+        order = None
+    if not order or order["user_email"] != session['user']['email']: return jsonify({"error": "Order not found"}), 404
+    orders_queue.start()
+    return jsonify(order_status(order))
 
 @app.route("/receipt/<order_id>")
 def receipt(order_id):
@@ -568,16 +935,31 @@ def receipt(order_id):
     order = orders.find_one({"_id": ObjectId(order_id)})
     if not order or order["user_email"] != session['user']['email']: return "Order not found", 404
     order['_id'] = str(order['_id'])
-    all_orders = list(orders.find({"user_email": session['user']['email']}).sort("date", -1))
-    for o in all_orders: o['_id'] = str(o['_id'])
-    return render_template("receipt.html", order=order, all_orders=all_orders)
+    order['status'] = order_pipeline.status_of(order)
+    # Just this order; the history lives on /user/receipts
+    return render_template("receipt.html", order=order)
 
 @app.route("/user/receipts")
 def user_receipts():
     if 'user' not in session: return redirect(url_for('login_page'))
-    all_orders = list(orders.find({"user_email": session['user']['email']}).sort("date", -1))
-    for o in all_orders: o['_id'] = str(o['_id'])
-    return render_template("user_receipts.html", all_orders=all_orders, user=session['user'])
+    all_orders, next_cursor = order_history.fetch_history(orders, session['user']['email'])
+    return render_template("user_receipts.html", all_orders=all_orders, next_cursor=next_cursor, user=session['user'])
+
+@app.route("/api/orders")
+def order_history_api():
+    # Summaries only; open /receipt/<id> for the cart of a single order
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        items, next_cursor = order_history.fetch_history(
+            orders, session['user']['email'],
+            cursor=request.args.get("cursor"),
+            limit=request.args.get("limit", order_history.PAGE_SIZE, type=int),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    for o in items: o['date'] = o['date'].isoformat()
+    return jsonify({"items": items, "next_cursor": next_cursor})
 
 @app.route("/user/update_profile", methods=["POST"])
 def update_profile():
@@ -594,5 +976,137 @@ def logout():
     session.pop('admin', None)
     return redirect(url_for('landing_page'))
 
+# ------------------- CLI -------------------
+@app.cli.command("create-admin")
+@click.option("--email", default="admin@example.com", show_default=True)
+@click.option("--name", default="Admin", show_default=True)
+@click.option("--password", prompt=True, hide_input=True, confirmation_prompt=True,
+              envvar="PHARMACARE_ADMIN_PASSWORD", help="Prompted for unless PHARMACARE_ADMIN_PASSWORD is set.")
+def create_admin_command(email, name, password):
+    """Create an admin account; does nothing if the email is already an admin."""
+    if admins.find_one({"email": email}, {"_id": 1}):
+        print(f"Admin {email} already exists")
+        return
+    hashed = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(password_hasher.rounds))
+    admins.insert_one({"owner_name": name, "email": email, "password": hashed})
+    print(f"Created admin {email}")
+
+@app.cli.command("ensure-indexes")
+@click.option("--rebuild", is_flag=True, help="Drop and rebuild indexes that differ from their spec.")
+def ensure_indexes_command(rebuild):
+    """Create or update every index; run once per deploy with PHARMACARE_ENSURE_INDEXES=0."""
+    ensure_indexes(db, rebuild=rebuild)
+    print("Indexes are up to date")
+
+@app.cli.command("backfill-rollups")
+def backfill_rollups_command():
+    """Fold orders placed before sales rollups existed into the rollups and customer summaries."""
+    buckets, customers = stats.backfill_rollups(db)
+    print(f"Backfilled {buckets} sales rollup buckets and {customers} customer summaries")
+
+@app.cli.command("order-worker")
+@click.option("--threads", type=click.IntRange(min=1), default=1, show_default=True, help="Worker threads in this process.")
+def order_worker_command(threads):
+    """Process queued orders until interrupted."""
+    worker = order_pipeline.OrderPipeline(client, db, cart_store, workers=threads - 1, lease=orders_queue.lease)
+    worker.start()
+    print(f"Processing orders with {threads} thread(s); Ctrl+C to stop")
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.shutdown()
+
+@app.cli.command("watch-stock-levels")
+def watch_stock_levels_command():
+    """Keep stock statuses current from a change stream (replica sets only)."""
+    stock_levels.rebuild(db, stock_levels.load_thresholds(db))
+    print("Watching medicines for stock changes; Ctrl+C to stop")
+    try:
+        stock_levels.watch(db, lambda: stock_levels.load_thresholds(db))
+    except OperationFailure as e:
+        raise click.ClickException(f"Change streams are unavailable: {e}")
+    except KeyboardInterrupt:
+        pass
+
+@app.cli.command("rebuild-stock-levels")
+def rebuild_stock_levels_command():
+    """Recompute every medicine's stock status and the dashboard stock counts."""
+    counts = stock_levels.rebuild(db, stock_levels.load_thresholds(db))
+    print(", ".join(f"{status}: {n}" for status, n in counts.items()))
+
+@app.cli.command("build-recommendations")
+@click.option("--output", default=lambda: RECOMMENDATIONS_PATH, required=True, type=click.Path(dir_okay=False),
+              help="Snapshot path; defaults to PHARMACARE_RECOMMENDATIONS_PATH.")
+def build_recommendations_command(output):
+    """Build co-purchase recommendations from every completed order and save the snapshot servers load."""
+    index = recommendations.CoPurchaseIndex()
+    index.build(recommendations.completed_orders(orders))
+    index.save(output)
+    print(f"{index.orders} orders, {len(index)} medicines -> {output}")
+
+@app.cli.command("snapshot-reports")
+@click.option("--every", type=click.IntRange(min=1), default=None,
+              help="Minutes between snapshots; takes one and exits when omitted.")
+def snapshot_reports_command(every):
+    """Snapshot completed orders and the catalog for /admin/reports."""
+    while True:
+        # Read-only handles, so a secondary can serve the scan
+        manifest = reports.write_snapshot(REPORTS_DIR, reports.completed_orders(read_db["orders"]),
+                                          medicine_reads.find({}, reports.MEDICINE_FIELDS))
+        print(f"Snapshot {manifest['name']}: {manifest['orders']} orders, {manifest['lines']} lines -> {REPORTS_DIR}")
+        if not every:
+            return
+        time.sleep(every * 60)
+
+@app.cli.command("import-medicines")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(catalog_io.FORMATS), default=None,
+              help="Defaults to the file extension.")
+@click.option("--batch-size", default=catalog_io.BATCH_SIZE, show_default=True)
+def import_medicines_command(path, fmt, batch_size):
+    """Upsert medicines from a CSV or JSON Lines file."""
+    fmt = fmt or catalog_io.format_for(path)
+    with open(path, encoding="utf-8-sig", newline="" if fmt == "csv" else None) as f:
+        report = catalog_io.import_medicines(medicines, f, fmt, batch_size)
+    # Reaches running servers through a shared cache backend; their search
+    # indexes pick the rows up on their next periodic rebuild
+    reference_cache.invalidate("medicines", "top_medicines", "categories")
+    stock_levels.rebuild(db, stock_levels.load_thresholds(db))
+    for error in report.errors:
+        print(f"line {error['line']}: {error['error']}")
+    print(f"{report.rows} rows: {report.inserted} inserted, {report.updated} updated, {report.failed} failed")
+    if report.failed:
+        raise SystemExit(1)
+
+@app.cli.command("export-medicines")
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--format", "fmt", type=click.Choice(catalog_io.FORMATS), default=None,
+              help="Defaults to the file extension.")
+def export_medicines_command(path, fmt):
+    """Write every medicine to a CSV or JSON Lines file."""
+    fmt = fmt or catalog_io.format_for(path)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for chunk in catalog_io.export_medicines(medicines, fmt):
+            f.write(chunk)
+
+@app.cli.command("check-query-plans")
+@click.option("--uri", default=None, help="MongoDB to run against; defaults to the app's server.")
+@click.option("--database", default="pharmacy_db_plancheck", show_default=True,
+              help="Scratch database, dropped before and after the run.")
+def check_query_plans_command(uri, database):
+    """Explain every registered route query and fail on collection scans."""
+    check_client = MongoClient(uri) if uri else client
+    check_client.drop_database(database)
+    try:
+        results = query_plans.run_checks(check_client[database])
+    finally:
+        check_client.drop_database(database)
+    failed = [(name, problems) for name, problems in results if problems]
+    for name, problems in results:
+        print(f"{'FAIL' if problems else 'ok  '} {name}" + (f"  [{', '.join(problems)}]" if problems else ""))
+    print(f"{len(results) - len(failed)}/{len(results)} queries indexed")
+    if failed:
+        raise SystemExit(1)
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,395 @@
+"""ASGI entry point: ``uvicorn asgi:application``.
+
+The read-heavy routes below run on the event loop with PyMongo's async client
+and issue their independent queries concurrently:
+
+* ``/`` and ``/home`` (reference data cache misses load together)
+* ``/dashboard`` and ``/admin/dashboard_data``
+* ``/api/medicine/<id>``
+
+Every other request goes to the Flask app in ``app.py`` on a thread of its own. Both
+halves share the session cookie, the templates, the reference cache with its
+invalidation and rendered catalog fragments, and the cart store. The async routes only read the session; a
+request that would need to write it (say, a missing cart ID) falls back to
+defaults.
+"""
+import asyncio
+import re
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from flask import render_template
+from werkzeug.http import generate_etag, parse_etags, quote_etag
+from itsdangerous import BadSignature
+from markupsafe import Markup
+from pymongo import AsyncMongoClient
+
+import app as pharmacare
+import carts
+import catalog
+import stats
+import stock_levels
+from pricing import DealBook
+
+flask_app = pharmacare.app
+reference_cache = pharmacare.reference_cache
+instrumentation = pharmacare.instrumentation
+
+settings = pharmacare.mongo_settings
+_client = None
+
+
+def adb(read_only=False):
+    """The async database handle; ``read_only`` follows ``PHARMACARE_MONGO_READ_PREFERENCE`` like ``app.read_db``."""
+    global _client
+    if _client is None:
+        _client = AsyncMongoClient(**settings.client_options(), event_listeners=[instrumentation.listener])
+    return _client.get_database(settings.db_name, **settings.read_options(read_only))
+
+
+# ----------------- REQUEST / RESPONSE -----------------
+def load_session(scope):
+    """Decode Flask's signed session cookie; ``{}`` when missing or invalid."""
+    cookie = SimpleCookie()
+    for name, value in scope["headers"]:
+        if name == b"cookie":
+            cookie.load(value.decode("latin-1"))
+    morsel = cookie.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if morsel is None:
+        return {}
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        return serializer.loads(morsel.value, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+def header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def int_arg(params, name, default):
+    # Same leniency as Flask's request.args.get(name, default, type=int)
+    try:
+        return int(params[name][0])
+    except (KeyError, ValueError):
+        return default
+
+
+async def respond(send, status, body, content_type, headers=()):
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", content_type.encode("latin-1")),
+        (b"content-length", str(len(body)).encode("latin-1")),
+        *headers,
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def respond_json(send, data, status=200):
+    await respond(send, status, flask_app.json.dumps(data).encode("utf-8"), "application/json")
+
+
+def _render(template, context):
+    with flask_app.app_context():
+        return render_template(template, **context)
+
+
+async def render(template, **context):
+    # Jinja is CPU-bound; render on a worker thread, not the event loop
+    return await asyncio.to_thread(_render, template, context)
+
+
+async def respond_html(send, template, **context):
+    await respond(send, 200, (await render(template, **context)).encode("utf-8"), "text/html; charset=utf-8")
+
+
+async def respond_cacheable(scope, send, body, content_type, max_age):
+    """Like ``app.cacheable``: strong ETag, ``Cache-Control`` and 304 on ``If-None-Match``."""
+    etag = generate_etag(body)
+    headers = [(b"etag", quote_etag(etag).encode("latin-1")),
+               (b"cache-control", f"public, max-age={max_age}".encode("latin-1"))]
+    if parse_etags(header(scope, b"if-none-match")).contains(etag):
+        await send({"type": "http.response.start", "status": 304, "headers": headers})
+        return await send({"type": "http.response.body", "body": b""})
+    await respond(send, 200, body, content_type, headers)
+
+
+async def redirect_to_login(send):
+    await respond(send, 302, b"", "text/html; charset=utf-8", [(b"location", b"/login")])
+
+
+# ----------------- REFERENCE DATA -----------------
+async def _load(collection, sort=None, limit=0):
+    cursor = adb()[collection].find()
+    if sort:
+        cursor = cursor.sort(*sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    docs = await cursor.to_list()
+    for doc in docs:
+        doc["_id"] = str(doc["_id"])
+    return docs
+
+
+async def _load_rows(sort=None, limit=0):
+    # Same projected rows as app.cached_medicines, which shares the cache
+    cursor = adb(read_only=True).medicines.find({}, catalog.LIST_FIELDS)
+    if sort:
+        cursor = cursor.sort(*sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    return catalog.rows(await cursor.to_list())
+
+
+def cached_medicines():
+    return reference_cache.aget("medicines", _load_rows)
+
+def cached_top_medicines():
+    return reference_cache.aget("top_medicines", lambda: _load_rows(("sold", -1), 8))
+
+def cached_carousel():
+    return reference_cache.aget("carousel", lambda: _load("carousel"))
+
+def cached_deals():
+    return reference_cache.aget("deals", lambda: _load("deals"))
+
+def cached_brands():
+    return reference_cache.aget("brands", lambda: _load("brands"))
+
+async def cached_deal_book():
+    async def build():
+        return DealBook(await cached_deals())
+    return await reference_cache.aget("deal_book", build)
+
+
+async def fragment(name, context):
+    """``app.fragment`` for the async routes; ``context`` is a coroutine function."""
+    template, depends = pharmacare.FRAGMENTS[name]
+
+    async def render_fragment():
+        return await render(template, **await context())
+    return Markup(await reference_cache.afragment(name, depends, render_fragment))
+
+
+async def offers_context():
+    all_medicines, all_deals, deal_book = await asyncio.gather(cached_medicines(), cached_deals(), cached_deal_book())
+    return {"medicines": [med for med in all_medicines if deal_book.has_deal(med['category'])], "deals": all_deals}
+
+
+async def landing_offers_context():
+    all_medicines, all_deals = await asyncio.gather(cached_medicines(), cached_deals())
+    return {"medicines": all_medicines, "deals": all_deals}
+
+
+async def top_sellers_context():
+    return {"top_medicines": await cached_top_medicines()}
+
+
+async def carousel_context():
+    return {"carousel_banners": await cached_carousel()}
+
+
+async def brands_context():
+    return {"brands": await cached_brands()}
+
+
+async def cart_and_wishlist(session):
+    cart_id = session.get("cart_id")
+    if cart_id is None:
+        return [], []
+    if isinstance(pharmacare.cart_store, carts.MongoCartStore):
+        lists = carts.lists_from(await adb().carts.find_one({"_id": cart_id}, carts.LISTS_PROJECTION))
+    else:
+        lists = pharmacare.cart_store.get_all(cart_id)
+    docs = []
+    if any(lists.values()):
+        docs = await adb().medicines.find(carts.detail_query(lists), carts.DETAIL_FIELDS).to_list()
+    hydrated = carts.lines_from(lists, docs)
+    return hydrated[carts.CART], hydrated[carts.WISHLIST]
+
+
+# ----------------- ROUTES -----------------
+async def landing_page(scope, send):
+    offers, top_sellers, carousel, brands, all_deals = await asyncio.gather(
+        fragment("landing_offers", landing_offers_context), fragment("landing_top_sellers", top_sellers_context),
+        fragment("carousel", carousel_context), fragment("landing_brands", brands_context), cached_deals())
+    html = await render("landing_page.html", deals=all_deals, fragments={
+        "landing_offers": offers, "landing_top_sellers": top_sellers, "carousel": carousel, "landing_brands": brands})
+    await respond_cacheable(scope, send, html.encode("utf-8"), "text/html; charset=utf-8", pharmacare.LANDING_MAX_AGE)
+
+
+async def user_home(scope, send):
+    session = load_session(scope)
+    if 'user' not in session:
+        return await redirect_to_login(send)
+    offers, top_sellers, carousel, brands, all_deals, (cart, wishlist) = await asyncio.gather(
+        fragment("home_offers", offers_context), fragment("home_top_sellers", top_sellers_context),
+        fragment("carousel", carousel_context), fragment("home_brands", brands_context),
+        cached_deals(), cart_and_wishlist(session))
+    await respond_html(send, "user_index.html",
+                       user=session['user'],
+                       fragments={"home_offers": offers, "home_top_sellers": top_sellers,
+                                  "carousel": carousel, "home_brands": brands},
+                       cart=cart,
+                       wishlist=wishlist,
+                       deals=all_deals)
+
+
+async def revenue_totals():
+    doc = await adb().counters.find_one({"_id": stats.REVENUE_ID})
+    if not stats.is_backfilled(doc):
+        # One-off on a fresh deployment; reuse the sync implementation.
+        return await asyncio.to_thread(stats.revenue_totals, pharmacare.db)
+    return stats.revenue_from(doc)
+
+
+async def stock_counts():
+    doc = await adb().counters.find_one({"_id": stock_levels.STOCK_ID})
+    if doc is None:
+        # One-off on a fresh deployment; reuse the sync implementation.
+        return await asyncio.to_thread(stock_levels.stock_counts, pharmacare.db,
+                                       pharmacare.cached_stock_thresholds())
+    return stock_levels.counts_from(doc)
+
+
+async def catalog_kpis():
+    rows = await (await adb().medicines.aggregate(stats.catalog_kpis_pipeline())).to_list(1)
+    return stats.kpis_from(rows[0] if rows else None)
+
+
+async def dashboard(scope, send):
+    session = load_session(scope)
+    if 'admin' not in session:
+        return await redirect_to_login(send)
+    all_medicines, kpis, stock, revenue, total_users_count, all_deals, banners, all_brands = await asyncio.gather(
+        _load_rows(), catalog_kpis(), stock_counts(), revenue_totals(), adb().users.estimated_document_count(),
+        cached_deals(), cached_carousel(), cached_brands())
+    await respond_html(send, "dashboard.html",
+                       admin=session['admin'],
+                       medicines=all_medicines,
+                       deals=all_deals,
+                       banners=banners,
+                       brands=all_brands,
+                       total_medicines=kpis["total_medicines"],
+                       low_stock=stock["low_stock"],
+                       out_of_stock=stock["out_of_stock"],
+                       total_sales=kpis["total_sales"],
+                       total_users=total_users_count,
+                       total_revenue=revenue["total"])
+
+
+async def dashboard_data(scope, send):
+    session = load_session(scope)
+    if 'admin' not in session:
+        return await respond_json(send, {"error": "Unauthorized"}, 401)
+    params = parse_qs(scope["query_string"].decode("latin-1"))
+    days = int_arg(params, "days", 7)
+    granularity = params.get("granularity", ["day"])[0]
+    if not stats.valid_chart_window(days, granularity):
+        return await respond_json(send, {"error": "Unsupported chart window"}, 400)
+    top_limit = max(1, min(int_arg(params, "top_limit", 5), stats.MAX_LEADERBOARD))
+    top_offset = max(0, int_arg(params, "top_offset", 0))
+
+    db = adb()
+    query, projection, points = stats.sales_query(days, granularity)
+
+    async def top_customers():
+        cursor = await db.user_stats.aggregate(stats.top_customers_pipeline(top_limit, top_offset))
+        return stats.customer_rows(await cursor.to_list())
+
+    rollups, top_meds_docs, stock_status, top_users_list = await asyncio.gather(
+        db.sales_rollups.find(query, projection).to_list(),
+        db.medicines.find({}, {"name": 1, "sold": 1}).sort("sold", -1).limit(5).to_list(),
+        stock_counts(),
+        top_customers(),
+    )
+    await respond_json(send, {
+        "sales_over_time": stats.sales_series(points, rollups),
+        "top_medicines": {"names": [m["name"] for m in top_meds_docs],
+                          "sold": [m.get("sold", 0) for m in top_meds_docs]},
+        "stock_status": stock_status,
+        "top_users": top_users_list,
+    })
+
+
+async def medicine_details(scope, send, id):
+    try:
+        med = await adb(read_only=True).medicines.find_one({"_id": ObjectId(id)}, pharmacare.MEDICINE_DETAIL_FIELDS)
+    except InvalidId as e:
+        return await respond_json(send, {"error": str(e)}, 500)
+    if med is None:
+        return await respond_json(send, {"error": "Medicine not found"}, 404)
+    med['_id'] = str(med['_id'])
+    await respond_cacheable(scope, send, flask_app.json.dumps(med).encode("utf-8"), "application/json",
+                            pharmacare.MEDICINE_MAX_AGE)
+
+
+# (Flask-style rule for metrics labels, path pattern, handler)
+ROUTES = [
+    ("/", re.compile(r"/"), landing_page),
+    ("/home", re.compile(r"/home"), user_home),
+    ("/dashboard", re.compile(r"/dashboard"), dashboard),
+    ("/admin/dashboard_data", re.compile(r"/admin/dashboard_data"), dashboard_data),
+    ("/api/medicine/<id>", re.compile(r"/api/medicine/(?P<id>[^/]+)"), medicine_details),
+]
+
+
+# ----------------- APPLICATION -----------------
+async def traced(rule, handler, scope, send, **kwargs):
+    # The Flask half is traced by its own request hooks
+    trace = instrumentation.start(rule)
+    status = 500
+
+    async def send_and_record(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        await send(message)
+    try:
+        await handler(scope, send_and_record, **kwargs)
+    finally:
+        instrumentation.finish(trace, scope["method"], status)
+
+
+# Calls flask_app, i.e. app.wsgi_app, so the ProxyFix configured in app.py
+# (PHARMACARE_PROXY_HOPS) applies to these requests too.
+_flask_wsgi = WsgiToAsgi(flask_app)
+
+
+async def flask_asgi(scope, receive, send):
+    # WsgiToAsgi runs the app thread-sensitively, i.e. on one thread shared
+    # by the whole process unless a ThreadSensitiveContext gives the request
+    # a thread of its own; with one, Flask requests run in parallel.
+    async with ThreadSensitiveContext():
+        await _flask_wsgi(scope, receive, send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            adb()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _client is not None:
+                await _client.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["method"] == "GET":
+        for rule, pattern, handler in ROUTES:
+            match = pattern.fullmatch(scope["path"])
+            if match:
+                return await traced(rule, handler, scope, send, **match.groupdict())
+    await flask_asgi(scope, receive, send)
@@ -0,0 +1,142 @@
+"""Requests/sec and latency of the read-heavy routes: gunicorn (sync) vs uvicorn (ASGI).
+
+Start both servers against the same database with the same number of worker
+processes, so they use comparable memory, then point the script at them (the
+admin routes log in as ``--admin-email``; create it with ``flask create-admin``):
+
+    gunicorn -w 4 -k gthread --threads 8 -b 127.0.0.1:8000 app:app
+    uvicorn asgi:application --workers 4 --port 8001
+    python benchmarks/asgi_bench.py --sync-url http://127.0.0.1:8000 \\
+        --async-url http://127.0.0.1:8001 --sync-pid <gunicorn master pid> --async-pid <uvicorn pid>
+
+Each route is hammered by ``--concurrency`` keep-alive clients for
+``--duration`` seconds per server. Passing the server pids adds the resident
+memory of each process tree to the report so the comparison can be checked
+for equal memory.
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+ROUTES = [
+    ("landing", "/", None),
+    ("home", "/home", "user"),
+    ("dashboard", "/dashboard", "admin"),
+    ("dashboard_data", "/admin/dashboard_data?days=30", "admin"),
+    ("medicine", "/api/medicine/{med_id}", None),
+]
+
+
+class Client:
+    def __init__(self, base, cookie=None):
+        parts = urlsplit(base)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        self.cookie = cookie
+
+    def request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        self.conn.request(method, path, body=None if body is None else json.dumps(body), headers=headers)
+        resp = self.conn.getresponse()
+        data = resp.read()
+        return resp, data
+
+
+def login(base, email, password):
+    resp, _ = Client(base).request("POST", "/login", {"email": email, "password": password})
+    if resp.status != 200:
+        raise SystemExit(f"login as {email} failed on {base}: {resp.status}")
+    return resp.getheader("Set-Cookie").split(";", 1)[0]
+
+
+def run(base, path, cookie, concurrency, duration):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        nonlocal errors
+        client = Client(base, cookie)
+        mine, failed = [], 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            resp, _ = client.request("GET", path)
+            mine.append(time.perf_counter() - start)
+            failed += resp.status != 200
+        with lock:
+            latencies.extend(mine)
+            errors += failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2)  # noqa: E731
+    return {"rps": round(len(latencies) / elapsed, 1), "p50_ms": pick(0.50), "p99_ms": pick(0.99),
+            "requests": len(latencies), "errors": errors}
+
+
+def rss_mb(pid):
+    """Resident memory of ``pid`` and its children, from /proc."""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, StopIteration):
+            continue
+    return round(total / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sync-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--async-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--sync-pid", type=int)
+    parser.add_argument("--async-pid", type=int)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--admin-email", default="admin@example.com")
+    parser.add_argument("--admin-password", default="admin123")
+    parser.add_argument("--output", help="also write the full report as JSON to this path")
+    args = parser.parse_args()
+
+    user = {"owner_name": "Bench", "email": "asgi-bench@example.com", "phone": "0", "password": "bench-password"}
+    Client(args.sync_url).request("POST", "/register", user)
+    _, body = Client(args.sync_url).request("GET", "/api/medicines?limit=1")
+    med_id = json.loads(body)["items"][0]["_id"]
+
+    report = {}
+    for label, base, pid in (("sync", args.sync_url, args.sync_pid), ("async", args.async_url, args.async_pid)):
+        cookies = {"user": login(base, user["email"], user["password"]),
+                   "admin": login(base, args.admin_email, args.admin_password), None: None}
+        results = {}
+        for name, path, role in ROUTES:
+            results[name] = run(base, path.format(med_id=med_id), cookies[role], args.concurrency, args.duration)
+        if pid:
+            results["rss_mb"] = rss_mb(pid)
+        report[label] = results
+
+    for name, _, _ in ROUTES:
+        sync, asyn = report["sync"][name], report["async"][name]
+        print(f"{name:15} rps {sync['rps']:>8} -> {asyn['rps']:>8}   p99 {sync['p99_ms']:>8}ms -> {asyn['p99_ms']:>8}ms")
+    if args.sync_pid and args.async_pid:
+        print(f"{'rss':15} {report['sync']['rss_mb']}MB -> {report['async']['rss_mb']}MB")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
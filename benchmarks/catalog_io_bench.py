@@ -0,0 +1,107 @@
+"""Throughput and memory of the bulk medicine import and export.
+
+Writes a generated catalog to a temporary file, imports it into a scratch
+database (inserts on the first pass, updates on the second), then exports it
+back, reporting rows/second and peak Python heap for each step. The file is
+read and written streaming, so peak memory should not grow with ``--rows``.
+
+    python benchmarks/catalog_io_bench.py --rows 100000                   # mongomock
+    python benchmarks/catalog_io_bench.py --uri mongodb://localhost:27017/ --rows 100000
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog_io  # noqa: E402
+
+CATEGORIES = ["Pain Relief", "Antibiotics", "Vitamins", "Cold & Flu", "Diabetes", "Heart", "Skin Care", "Allergy"]
+
+
+def connect(uri):
+    if uri:
+        from pymongo import MongoClient
+        return MongoClient(uri)
+    import mongomock
+    return mongomock.MongoClient()
+
+
+def write_catalog(path, fmt, rows, rng):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        fields = ["name", "category", "price", "quantity", "description"]
+        writer = csv.DictWriter(f, fields)
+        if fmt == "csv":
+            writer.writeheader()
+        for i in range(rows):
+            row = {"name": f"SKU {i:07d}", "category": rng.choice(CATEGORIES),
+                   "price": round(rng.uniform(1, 120), 2), "quantity": rng.randint(0, 500),
+                   "description": f"Wholesale item {i}"}
+            if fmt == "csv":
+                writer.writerow(row)
+            else:
+                f.write(json.dumps(row) + "\n")
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, round(peak / 1024 / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", help="MongoDB to run against; mongomock if omitted")
+    parser.add_argument("--database", default="pharmacy_db_iobench")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--format", dest="fmt", choices=catalog_io.FORMATS, default="csv")
+    parser.add_argument("--batch-size", type=int, default=catalog_io.BATCH_SIZE)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    client = connect(args.uri)
+    client.drop_database(args.database)
+    collection = client[args.database].medicines
+    collection.create_index("name")
+    report = {"rows": args.rows, "format": args.fmt, "batch_size": args.batch_size}
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, f"catalog.{args.fmt}")
+        write_catalog(source, args.fmt, args.rows, random.Random(args.seed))
+
+        def run_import():
+            with open(source, encoding="utf-8", newline="" if args.fmt == "csv" else None) as f:
+                return catalog_io.import_medicines(collection, f, args.fmt, args.batch_size)
+
+        for label in ("import_insert", "import_update"):
+            result, elapsed, peak = measure(run_import)
+            report[label] = {"rows_per_s": round(result.rows / elapsed), "seconds": round(elapsed, 2),
+                             "peak_mb": peak, "inserted": result.inserted, "updated": result.updated,
+                             "failed": result.failed}
+
+        def run_export():
+            exported = 0
+            with open(os.path.join(tmp, f"export.{args.fmt}"), "w", encoding="utf-8", newline="") as f:
+                for chunk in catalog_io.export_medicines(collection, args.fmt, args.batch_size):
+                    exported += chunk.count("\n")
+                    f.write(chunk)
+            return exported
+
+        lines, elapsed, peak = measure(run_export)
+        report["export"] = {"rows_per_s": round(args.rows / elapsed), "seconds": round(elapsed, 2),
+                            "peak_mb": peak, "lines": lines}
+    client.drop_database(args.database)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
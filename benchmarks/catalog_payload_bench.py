@@ -0,0 +1,191 @@
+"""Memory and bytes per catalog render: full medicine documents vs projected rows.
+
+Seeds a catalog whose medicines carry realistic descriptions, then reports:
+
+* ``cache``: loading the whole catalog as the reference cache does, once as
+  full documents with ``_id`` stringified in a loop (how list pages loaded
+  it before) and once as ``catalog.rows`` over ``catalog.LIST_FIELDS``:
+  bytes read from Mongo, Python heap retained by the list, the pickled size
+  (what a Redis cache entry holds) and load time
+* ``routes``: response bytes of each list page and API, and the bytes Mongo
+  sent to render it (from command monitoring; null on mongomock)
+
+The ``routes`` section runs whatever the checked-out tree serves, so compare
+two commits with ``--output`` and ``--compare``::
+
+    python benchmarks/catalog_payload_bench.py --mongomock --output results/after.json
+    python benchmarks/catalog_payload_bench.py --mongomock --compare results/before.json
+
+Against MongoDB the app's own database is emptied and reseeded, so
+``--reset`` is required.
+"""
+import argparse
+import json
+import os
+import pickle
+import random
+import sys
+import time
+import tracemalloc
+
+import bson
+from pymongo import monitoring
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CATEGORIES = ["Pain Relief", "Antibiotics", "Vitamins", "Cold & Flu", "Diabetes", "Heart", "Skin Care", "Allergy"]
+WORDS = ("tablet dose adults children daily water meal relief symptoms consult pharmacist doctor pregnancy "
+         "store below room temperature keep out of reach side effects include mild nausea headache dizziness "
+         "stop use if rash appears do not exceed stated dose contains active ingredient").split()
+ROUTES = [
+    ("landing", "/", None),
+    ("home", "/home", "user"),
+    ("medicines", "/medicines", "user"),
+    ("api_medicines", "/api/medicines?limit=100", None),
+    ("search_full", "/api/search?q=bench&full=1&limit=50", None),
+    ("dashboard", "/dashboard", "admin"),
+]
+
+
+class ReplyBytes(monitoring.CommandListener):
+    """BSON bytes of every command reply, i.e. what Mongo sent back."""
+
+    def __init__(self):
+        self.total = 0
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.total += len(bson.encode(event.reply))
+
+    def failed(self, event):
+        pass
+
+
+def load_app(mongomock):
+    if mongomock:
+        import mongomock as mm
+        import pymongo
+        shared = mm.MongoClient()
+        pymongo.MongoClient = lambda *args, **kwargs: shared
+    os.environ.setdefault("PHARMACARE_HASH_WORKERS", "0")
+    os.environ.setdefault("PHARMACARE_ORDER_WORKERS", "0")
+    import app
+    return app
+
+
+def seed(pharmacare, count, description_words, rng):
+    db = pharmacare.db
+    db.medicines.delete_many({})
+    db.deals.delete_many({})
+    db.medicines.insert_many([{
+        "name": f"Bench {CATEGORIES[i % len(CATEGORIES)].split()[0]} {i:06d}",
+        "category": CATEGORIES[i % len(CATEGORIES)],
+        "price": round(rng.uniform(1, 120), 2),
+        "quantity": rng.randint(0, 500),
+        "sold": rng.randint(0, 2_000),
+        "description": " ".join(rng.choice(WORDS) for _ in range(description_words)).capitalize() + ".",
+        "image": "/static/images/default.png",
+    } for i in range(count)])
+    db.deals.insert_many([{"title": f"Deal {category}", "description": "", "discount": "10%", "discount_pct": 10,
+                           "code": f"BENCH{i}", "category": category} for i, category in enumerate(CATEGORIES[:4])])
+    pharmacare.reference_cache.invalidate("medicines", "top_medicines", "categories", "deals", "deal_book")
+    pharmacare.search_index.rebuild(pharmacare.load_search_docs())
+
+
+def measure_load(load, replies):
+    replies.total = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    value = load()
+    elapsed = time.perf_counter() - start
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"mongo_kb": round(replies.total / 1024, 1) if replies.total else None,
+            "heap_kb": round(retained / 1024, 1), "pickled_kb": round(len(pickle.dumps(value)) / 1024, 1),
+            "load_ms": round(elapsed * 1000, 1)}
+
+
+def cache_section(pharmacare, replies):
+    import catalog
+    medicines = pharmacare.medicines
+
+    def full_documents():
+        docs = list(medicines.find())
+        for doc in docs:
+            doc["_id"] = str(doc["_id"])
+        return docs
+
+    results = {}
+    loaders = {"full_documents": (full_documents, None)}
+    if hasattr(catalog, "rows"):
+        loaders["rows"] = (lambda: catalog.rows(medicines.find({}, catalog.LIST_FIELDS)), catalog.LIST_FIELDS)
+    for label, (load, projection) in loaders.items():
+        stats = measure_load(load, replies)
+        # Size of the documents as read, for mongomock where no command
+        # replies are observed.
+        stats["documents_kb"] = round(sum(len(bson.encode(doc)) for doc in medicines.find({}, projection)) / 1024, 1)
+        results[label] = stats
+    return results
+
+
+def routes_section(pharmacare, replies):
+    client = pharmacare.app.test_client()
+    sessions = {"user": {"user": {"name": "Bench", "email": "catalog-bench@example.com"}},
+                "admin": {"admin": {"name": "Bench Admin", "email": "admin@example.com"}}}
+    results = {}
+    for name, path, role in ROUTES:
+        with client.session_transaction() as session:
+            session.clear()
+            session.update(sessions.get(role, {}))
+        # Cold: the reference cache and fragments are rebuilt for this render.
+        pharmacare.reference_cache.invalidate("medicines", "top_medicines")
+        replies.total = 0
+        resp = client.get(path)
+        results[name] = {"status": resp.status_code, "response_kb": round(len(resp.data) / 1024, 1),
+                         "mongo_kb": round(replies.total / 1024, 1) if replies.total else None}
+    return results
+
+
+def compare(report, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    for name, after in report["routes"].items():
+        before = baseline.get("routes", {}).get(name)
+        if before:
+            print(f"{name:15} response {before['response_kb']:>9}KB -> {after['response_kb']:>9}KB   "
+                  f"mongo {before['mongo_kb']}KB -> {after['mongo_kb']}KB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongomock", action="store_true", help="run against an in-process mongomock")
+    parser.add_argument("--reset", action="store_true", help="allow emptying the app's MongoDB database")
+    parser.add_argument("--medicines", type=int, default=5_000)
+    parser.add_argument("--description-words", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    parser.add_argument("--compare", help="print route bytes against a report from another commit")
+    args = parser.parse_args()
+    if not args.mongomock and not args.reset:
+        parser.error("against MongoDB the app's database is emptied first; pass --reset to confirm")
+
+    replies = ReplyBytes()
+    # Global listeners only reach clients created afterwards.
+    monitoring.register(replies)
+    pharmacare = load_app(args.mongomock)
+    seed(pharmacare, args.medicines, args.description_words, random.Random(args.seed))
+
+    report = {"medicines": args.medicines, "description_words": args.description_words,
+              "cache": cache_section(pharmacare, replies), "routes": routes_section(pharmacare, replies)}
+    print(json.dumps(report, indent=2))
+    if args.compare:
+        compare(report, args.compare)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""Seeded load test of the main routes, with JSON results to compare commits.
+
+Seeds medicines, users, deals, banners, brands and a history of orders, then
+drives the shopper flow (``/``, ``/home``, ``/medicines``, add to cart,
+``/checkout``, ``/complete_payment``, ``/user/receipts``) and the admin
+dashboard (``/dashboard``, ``/admin/dashboard_data``) twice:
+
+* ``client``: one request at a time through the Flask test client, i.e. the
+  server-side cost of each route without sockets
+* ``http``: ``--concurrency`` keep-alive clients against a threaded server
+  started in-process, or against ``--url``
+
+``/complete_payment`` only queues the order, so its numbers leave out the
+stock and rollup writes done by the app's order worker threads.
+
+Each route reports requests, errors, throughput, p50/p95/p99 and Mongo
+commands per request (from the app's command monitoring at ``/admin/metrics``;
+mongomock issues no commands, so it is null there). Sessions are minted with
+the app's secret key, so the login rate limits and bcrypt stay out of the
+numbers.
+
+    python benchmarks/load_test.py --mongomock --output results/head.json
+    python benchmarks/load_test.py --mongomock --compare results/base.json
+
+Against MongoDB the app's own database is used and emptied first, so
+``--reset`` is required. To load a separately started server, seed first and
+then point at it with the same volumes::
+
+    python benchmarks/load_test.py --reset --seed-only
+    gunicorn -w 4 -k gthread --threads 8 -b 127.0.0.1:8000 app:app
+    python benchmarks/load_test.py --no-seed --url http://127.0.0.1:8000
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CATEGORIES = ["Pain Relief", "Antibiotics", "Vitamins", "Cold & Flu", "Diabetes", "Heart", "Skin Care", "Allergy"]
+SEEDED = ["medicines", "users", "deals", "orders", "carousel", "brands", "carts", "sales_rollups",
+          "user_stats", "counters", "payments"]
+BENCH_PASSWORD = b"bench-password"
+ADMIN_EMAIL = "bench-admin@example.com"
+
+# (name, method, path, role, metrics route label)
+USER_FLOW = [
+    ("landing", "GET", "/", None, "/"),
+    ("home", "GET", "/home", "user", "/home"),
+    ("medicines", "GET", "/medicines", "user", "/medicines"),
+    ("add_to_cart", "POST", "/user/add_to_cart", "user", "/user/add_to_cart"),
+    ("checkout", "GET", "/checkout", "user", "/checkout"),
+    ("complete_payment", "POST", "/complete_payment", "user", "/complete_payment"),
+    ("receipts", "GET", "/user/receipts", "user", "/user/receipts"),
+]
+ADMIN_FLOW = [
+    ("dashboard", "GET", "/dashboard", "admin", "/dashboard"),
+    ("dashboard_data", "GET", "/admin/dashboard_data?days=30", "admin", "/admin/dashboard_data"),
+]
+STEPS = USER_FLOW + ADMIN_FLOW
+
+
+def load_app(mongomock):
+    if mongomock:
+        import mongomock as mm
+        import pymongo
+        shared = mm.MongoClient()
+        pymongo.MongoClient = lambda *args, **kwargs: shared
+    os.environ.setdefault("PHARMACARE_HASH_WORKERS", "0")
+    import app
+    return app
+
+
+# ----------------- SEEDING -----------------
+def seed(pharmacare, volumes, rng):
+    import bcrypt
+    import stats
+
+    db = pharmacare.db
+    for name in SEEDED:
+        db[name].delete_many({})
+    db.admins.delete_many({"email": ADMIN_EMAIL})
+    password = bcrypt.hashpw(BENCH_PASSWORD, bcrypt.gensalt(4))
+    db.admins.insert_one({"owner_name": "Bench Admin", "email": ADMIN_EMAIL, "password": password, "role": "admin"})
+
+    meds = [{
+        "name": f"Bench {CATEGORIES[i % len(CATEGORIES)].split()[0]} {i:06d}",
+        "category": CATEGORIES[i % len(CATEGORIES)],
+        "price": round(rng.uniform(1, 120), 2),
+        "quantity": rng.randint(5_000, 20_000),
+        "sold": rng.randint(0, 2_000),
+        "description": f"Seeded medicine {i} for load testing.",
+        "image": "/static/images/default.png",
+    } for i in range(volumes["medicines"])]
+    db.medicines.insert_many(meds)
+    db.users.insert_many([{"owner_name": f"Bench User {i}", "email": user_email(i), "phone": "0",
+                           "password": password, "role": "user"} for i in range(volumes["users"])])
+    db.deals.insert_many([{
+        "title": f"Deal {i}", "description": "", "discount": f"{pct}%", "discount_pct": pct,
+        "code": f"BENCH{i}", "category": CATEGORIES[i % len(CATEGORIES)],
+    } for i, pct in enumerate(rng.choice([5, 10, 15, 20]) for _ in range(volumes["deals"]))])
+    db.carousel.insert_many([{"title": f"Banner {i}", "description": "", "image": "/static/images/default.png",
+                              "link": "/medicines"} for i in range(5)])
+    db.brands.insert_many([{"name": f"Brand {i}", "image": "/static/images/default.png"} for i in range(12)])
+
+    now = datetime.now()
+    batch = []
+    for i in range(volumes["orders"]):
+        lines = [{"id": str(med["_id"]), "name": med["name"], "price": med["price"], "category": med["category"],
+                  "image": med["image"], "quantity": rng.randint(1, 3)}
+                 for med in rng.sample(meds, rng.randint(1, 4))]
+        user = rng.randrange(volumes["users"])
+        batch.append({
+            "user_email": user_email(user), "user_name": f"Bench User {user}", "cart": lines,
+            "total": round(sum(line["price"] * line["quantity"] for line in lines), 2),
+            "payment_info": {"card_last4": "4242", "method": "Card"},
+            "date": now - timedelta(days=rng.uniform(0, 90)),
+            # mongomock ignores the partial filter on the idempotency index,
+            # so give history its own keys; they are still counted as
+            # pre-pipeline orders (no status).
+            "idempotency_key": f"seed-{i}",
+        })
+        if len(batch) == 1000:
+            db.orders.insert_many(batch)
+            batch = []
+    if batch:
+        db.orders.insert_many(batch)
+
+    stats.backfill_rollups(db)
+    pharmacare.reference_cache.invalidate("medicines", "top_medicines", "categories", "carousel", "deals",
+                                          "deal_book", "brands")
+    pharmacare.search_index.rebuild(pharmacare.load_search_docs())
+
+
+def user_email(i):
+    return f"bench-user-{i}@example.com"
+
+
+# ----------------- SESSIONS -----------------
+def session_cookie(pharmacare, data):
+    serializer = pharmacare.app.session_interface.get_signing_serializer(pharmacare.app)
+    return pharmacare.app.config["SESSION_COOKIE_NAME"], serializer.dumps(data)
+
+
+def user_session(pharmacare, i):
+    return session_cookie(pharmacare, {"user": {"name": f"Bench User {i}", "email": user_email(i)},
+                                       "cart_id": uuid.uuid4().hex})
+
+
+def admin_session(pharmacare):
+    return session_cookie(pharmacare, {"admin": {"name": "Bench Admin", "email": ADMIN_EMAIL}})
+
+
+# ----------------- DRIVERS -----------------
+class TestClientDriver:
+    def __init__(self, pharmacare, cookie):
+        self.client = pharmacare.app.test_client()
+        if cookie:
+            self.client.set_cookie(*cookie)
+
+    def request(self, method, path, body=None):
+        resp = self.client.open(path, method=method, json=body)
+        resp.close()
+        return resp.status_code
+
+
+class HttpDriver:
+    def __init__(self, base, cookie):
+        parts = urlsplit(base)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+        self.cookie = f"{cookie[0]}={cookie[1]}" if cookie else None
+
+    def request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        self.conn.request(method, path, body=None if body is None else json.dumps(body), headers=headers)
+        resp = self.conn.getresponse()
+        resp.read()
+        return resp.status
+
+
+def run_flow(drivers, med_ids, rng, samples, errors):
+    """One shopper round trip plus one dashboard visit; latencies go into ``samples``."""
+    for name, method, path, role, _ in STEPS:
+        body = None
+        if name == "add_to_cart":
+            body = {"med_id": rng.choice(med_ids)}
+        elif name == "complete_payment":
+            body = {"cardNumber": "4242424242424242"}
+        start = time.perf_counter()
+        status = drivers[role].request(method, path, body)
+        samples[name].append(time.perf_counter() - start)
+        if status >= 400:
+            errors[name] += 1
+
+
+# ----------------- METRICS -----------------
+_COMMANDS = re.compile(r'^pharmacare_mongo_commands_total\{route="([^"]*)",command="[^"]*"\} (\d+)$', re.M)
+
+
+def mongo_commands(text):
+    totals = {}
+    for route, n in _COMMANDS.findall(text):
+        totals[route] = totals.get(route, 0) + int(n)
+    return totals
+
+
+def percentile(sorted_samples, q):
+    return round(sorted_samples[min(len(sorted_samples) - 1, int(q * len(sorted_samples)))] * 1000, 2)
+
+
+def summarize(samples, errors, elapsed, before, after):
+    results = {}
+    for name, _, _, _, route in STEPS:
+        latencies = sorted(samples[name])
+        if not latencies:
+            continue
+        commands = after.get(route, 0) - before.get(route, 0)
+        results[name] = {
+            "requests": len(latencies),
+            "errors": errors[name],
+            # Sequential runs: requests per second of time spent in the route
+            "rps": round(len(latencies) / (elapsed or sum(latencies)), 1),
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "mongo_ops_per_request": round(commands / len(latencies), 2) if after else None,
+        }
+    return results
+
+
+def run_client(pharmacare, med_ids, args, rng):
+    drivers = {None: TestClientDriver(pharmacare, None),
+               "user": TestClientDriver(pharmacare, user_session(pharmacare, 0)),
+               "admin": TestClientDriver(pharmacare, admin_session(pharmacare))}
+    samples, errors = {s[0]: [] for s in STEPS}, {s[0]: 0 for s in STEPS}
+    before = mongo_commands(pharmacare.instrumentation.render())
+    for _ in range(args.iterations):
+        run_flow(drivers, med_ids, rng, samples, errors)
+    after = mongo_commands(pharmacare.instrumentation.render())
+    return summarize(samples, errors, None, before, after)
+
+
+def run_http(pharmacare, base, med_ids, args):
+    admin_cookie = admin_session(pharmacare)
+
+    def scrape():
+        driver = HttpDriver(base, admin_cookie)
+        driver.conn.request("GET", "/admin/metrics", headers={"Cookie": driver.cookie})
+        resp = driver.conn.getresponse()
+        text = resp.read().decode("utf-8")
+        return mongo_commands(text) if resp.status == 200 else {}
+
+    samples, errors = {s[0]: [] for s in STEPS}, {s[0]: 0 for s in STEPS}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker(i):
+        rng = random.Random(args.seed * 1000 + i)
+        drivers = {None: HttpDriver(base, None),
+                   "user": HttpDriver(base, user_session(pharmacare, i % args.users)),
+                   "admin": HttpDriver(base, admin_cookie)}
+        mine, failed = {s[0]: [] for s in STEPS}, {s[0]: 0 for s in STEPS}
+        while time.monotonic() < deadline:
+            run_flow(drivers, med_ids, rng, mine, failed)
+        with lock:
+            for name in samples:
+                samples[name].extend(mine[name])
+                errors[name] += failed[name]
+
+    before = scrape()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(worker, range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    after = scrape()
+    return summarize(samples, errors, elapsed, before, after if any(after.values()) else {})
+
+
+def serve_in_process(pharmacare):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, pharmacare.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+# ----------------- REPORTING -----------------
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline_path, max_ratio):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    print(f"p95 vs {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for mode in ("client", "http"):
+        for name, now in report.get(mode, {}).items():
+            then = baseline.get(mode, {}).get(name)
+            if not then or not then["p95_ms"]:
+                continue
+            ratio = now["p95_ms"] / then["p95_ms"]
+            flag = "  REGRESSION" if ratio > max_ratio else ""
+            print(f"  {mode:6} {name:17} {then['p95_ms']:>9}ms -> {now['p95_ms']:>9}ms  x{ratio:.2f}{flag}")
+            if flag:
+                regressions.append(f"{mode}/{name}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongomock", action="store_true", help="run entirely in-process on mongomock")
+    parser.add_argument("--reset", action="store_true", help="allow emptying the app's MongoDB database")
+    parser.add_argument("--no-seed", action="store_true", help="reuse data seeded earlier with the same volumes")
+    parser.add_argument("--seed-only", action="store_true")
+    parser.add_argument("--medicines", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--deals", type=int, default=10)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=50, help="test-client rounds through every route")
+    parser.add_argument("--url", help="load this running server instead of an in-process one")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of HTTP load")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="earlier JSON report to compare p95 latencies against")
+    parser.add_argument("--max-ratio", type=float, default=1.25, help="p95 growth that counts as a regression")
+    args = parser.parse_args()
+
+    pharmacare = load_app(args.mongomock)
+    if not args.no_seed:
+        if not args.mongomock and not args.reset:
+            parser.error(f"seeding empties the {pharmacare.mongo_settings.db_name!r} database; pass --reset to allow it")
+        started = time.perf_counter()
+        seed(pharmacare, vars(args), random.Random(args.seed))
+        print(f"seeded in {time.perf_counter() - started:.1f}s")
+    if args.seed_only:
+        return
+    med_ids = [str(d["_id"]) for d in pharmacare.medicines.find({}, {"_id": 1})]
+
+    report = {"meta": {
+        "commit": git_commit(), "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "backend": "mongomock" if args.mongomock else "mongodb",
+        "volumes": {k: getattr(args, k) for k in ("medicines", "users", "deals", "orders")},
+        "iterations": args.iterations, "concurrency": args.concurrency, "duration": args.duration,
+        "seed": args.seed,
+    }}
+    report["client"] = run_client(pharmacare, med_ids, args, random.Random(args.seed))
+    if not args.skip_http:
+        server = None
+        base = args.url
+        if not base:
+            server, base = serve_in_process(pharmacare)
+        try:
+            report["http"] = run_http(pharmacare, base, med_ids, args)
+        finally:
+            if server:
+                server.shutdown()
+
+    for mode in ("client", "http"):
+        for name, r in report.get(mode, {}).items():
+            ops = "-" if r["mongo_ops_per_request"] is None else r["mongo_ops_per_request"]
+            print(f"{mode:6} {name:17} {r['rps']:>8} rps  p50 {r['p50_ms']:>8}ms  p95 {r['p95_ms']:>8}ms  "
+                  f"p99 {r['p99_ms']:>8}ms  ops/req {ops}  errors {r['errors']}")
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        regressions = compare(report, args.compare, args.max_ratio)
+        if regressions:
+            print(f"FAIL: p95 regressed more than x{args.max_ratio} on {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Catalog latency during a login flood.
+
+Measures ``GET /api/medicines`` latency against a running server, first on its
+own and then while many threads hammer ``POST /login`` with wrong passwords.
+With hashing in the bounded pool, excess logins are shed (429 from the rate
+limits, 503 from the full pool) and catalog latency should stay roughly flat;
+the run fails if the p95 under flood exceeds ``--max-ratio`` times baseline.
+
+    gunicorn -w 4 -k gthread --threads 8 app:app
+    python benchmarks/login_flood.py --url http://127.0.0.1:8000
+
+Every flood request comes from one IP, so the per-IP limit answers most of
+them with 429. To load the hashing pool itself, raise the limit for the run,
+e.g. ``PHARMACARE_AUTH_IP_RATE=10000 PHARMACARE_AUTH_IP_BURST=10000``.
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def request(url, body=None):
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def measure_catalog(base, threads, duration):
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            request(f"{base}/api/medicines?limit=24")
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    with ThreadPoolExecutor(threads) as pool:
+        for _ in range(threads):
+            pool.submit(worker)
+    return latencies
+
+
+def flood_logins(base, email, threads, stop, statuses):
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            # A mix of the real account and unknown ones, all with wrong passwords.
+            target = email if rng.random() < 0.5 else f"nobody{rng.randrange(10_000)}@example.com"
+            status = request(f"{base}/login", {"email": target, "password": f"wrong-{rng.random()}"})
+            with lock:
+                statuses[status] += 1
+
+    pool = ThreadPoolExecutor(threads)
+    for i in range(threads):
+        pool.submit(worker, i)
+    return pool
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000  # noqa: E731
+    return {"requests": len(latencies), "p50_ms": round(pick(0.50), 2), "p95_ms": round(pick(0.95), 2),
+            "p99_ms": round(pick(0.99), 2), "mean_ms": round(statistics.mean(latencies) * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per phase")
+    parser.add_argument("--catalog-threads", type=int, default=4)
+    parser.add_argument("--flood-threads", type=int, default=64)
+    parser.add_argument("--max-ratio", type=float, default=2.0)
+    args = parser.parse_args()
+    base = args.url.rstrip("/")
+
+    email = "flood-test@example.com"
+    request(f"{base}/register", {"owner_name": "Flood Test", "email": email, "phone": "0", "password": "correct horse"})
+
+    baseline = summary(measure_catalog(base, args.catalog_threads, args.duration))
+
+    statuses = Counter()
+    stop = threading.Event()
+    pool = flood_logins(base, email, args.flood_threads, stop, statuses)
+    time.sleep(1)  # let the flood ramp up
+    flooded = summary(measure_catalog(base, args.catalog_threads, args.duration))
+    stop.set()
+    pool.shutdown(wait=True)
+
+    ratio = flooded["p95_ms"] / baseline["p95_ms"] if baseline["p95_ms"] else float("inf")
+    print(json.dumps({"baseline": baseline, "during_flood": flooded,
+                      "login_statuses": dict(sorted(statuses.items())),
+                      "p95_ratio": round(ratio, 2)}, indent=2))
+    if ratio > args.max_ratio:
+        print(f"FAIL: catalog p95 grew {ratio:.1f}x during the login flood")
+        sys.exit(1)
+    print("OK: catalog latency stayed flat")
+
+
+if __name__ == "__main__":
+    main()
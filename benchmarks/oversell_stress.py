@@ -0,0 +1,96 @@
+"""Parallel checkout stress test for inventory.reserve_stock.
+
+Many threads race to buy overlapping carts from a small pool of stock; the
+run fails if any medicine ends up with negative stock or if units sold and
+units left stop adding up to the starting stock.
+
+    python benchmarks/oversell_stress.py                      # mongomock
+    python benchmarks/oversell_stress.py --uri mongodb://localhost:27017/
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import inventory  # noqa: E402
+
+
+def connect(uri):
+    if uri:
+        from pymongo import MongoClient
+        return MongoClient(uri)
+    import mongomock
+    return mongomock.MongoClient()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", help="MongoDB URI; defaults to an in-memory mongomock server")
+    parser.add_argument("--medicines", type=int, default=5)
+    parser.add_argument("--stock", type=int, default=50)
+    parser.add_argument("--checkouts", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=32)
+    args = parser.parse_args()
+
+    client = connect(args.uri)
+    db = client["pharmacare_stress"]
+    db.medicines.drop()
+    db.orders.drop()
+    ids = [str(db.medicines.insert_one({"name": f"Med {i}", "quantity": args.stock, "sold": 0}).inserted_id)
+           for i in range(args.medicines)]
+
+    outcomes = {"ok": 0, "out_of_stock": 0}
+    lock = threading.Lock()
+
+    def checkout(seed):
+        rng = random.Random(seed)
+        cart = [{"id": rng.choice(ids)} for _ in range(rng.randint(1, 4))]
+        quantities = inventory.collapse_cart(cart)
+
+        def place(txn):
+            inventory.reserve_stock(db.medicines, quantities, session=txn)
+            db.orders.insert_one({"cart": cart}, session=txn)
+
+        try:
+            inventory.run_in_transaction(client, place)
+            result = "ok"
+        except inventory.OutOfStock:
+            result = "out_of_stock"
+        with lock:
+            outcomes[result] += 1
+
+    with ThreadPoolExecutor(args.threads) as pool:
+        list(pool.map(checkout, range(args.checkouts)))
+
+    ordered = {med_id: 0 for med_id in ids}
+    for order in db.orders.find():
+        for item in order["cart"]:
+            ordered[item["id"]] += 1
+
+    failures = []
+    for doc in db.medicines.find():
+        med_id = str(doc["_id"])
+        if doc["quantity"] < 0:
+            failures.append(f"{doc['name']}: negative stock {doc['quantity']}")
+        if doc["quantity"] + doc["sold"] != args.stock:
+            failures.append(f"{doc['name']}: quantity + sold = {doc['quantity'] + doc['sold']}, expected {args.stock}")
+        if doc["sold"] != ordered[med_id]:
+            failures.append(f"{doc['name']}: sold {doc['sold']} but orders contain {ordered[med_id]}")
+        if doc.get(inventory.RESERVATIONS):
+            failures.append(f"{doc['name']}: leftover reservation tokens {doc[inventory.RESERVATIONS]}")
+
+    print(f"transactions={'yes' if inventory.supports_transactions(client) else 'no'} "
+          f"checkouts={args.checkouts} placed={outcomes['ok']} rejected={outcomes['out_of_stock']} "
+          f"units_sold={sum(ordered.values())}/{args.medicines * args.stock}")
+    if failures:
+        print("FAIL\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("OK: no oversell")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Cart pricing cost as the number of active deals grows.
+
+Compares the per-item scan over every deal that checkout/complete_payment used
+to do against ``DealBook.price_cart``.
+
+    python benchmarks/pricing_bench.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pricing import DealBook  # noqa: E402
+
+CATEGORIES = [f"Category {i}" for i in range(200)]
+
+
+def scan_price(cart, active_deals):
+    # The previous inline implementation, kept here as the baseline.
+    total = 0.0
+    for item in cart:
+        discount = 0
+        for deal in active_deals:
+            if deal.get('category') == item.get('category') or deal.get('category') == 'All':
+                try:
+                    discount = float(deal.get('discount', '0%').replace('%', ''))
+                except ValueError:
+                    pass
+        total += float(item['price']) * (1 - discount / 100)
+    return round(total, 2)
+
+
+def main():
+    rng = random.Random(1)
+    cart = [{"id": str(i), "name": f"Med {i}", "price": rng.uniform(1, 100),
+             "category": rng.choice(CATEGORIES)} for i in range(50)]
+    print(f"{'deals':>6} {'scan (us/cart)':>15} {'DealBook (us/cart)':>19}")
+    for n_deals in (1, 10, 100, 1000):
+        active_deals = [{"category": rng.choice(CATEGORIES + ["All"]), "discount": f"{rng.randint(5, 30)}%"}
+                        for _ in range(n_deals)]
+        book = DealBook(active_deals)
+        runs = 200
+        scan = timeit.timeit(lambda: scan_price(cart, active_deals), number=runs) / runs * 1e6
+        compiled = timeit.timeit(lambda: book.price_cart(cart), number=runs) / runs * 1e6
+        print(f"{n_deals:>6} {scan:>15.1f} {compiled:>19.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Build time and lookup latency of the co-purchase recommendations index.
+
+Generates synthetic order history in memory (Zipf-distributed medicine
+popularity plus a set of medicines commonly bought together) and reports:
+
+* ``build``: seconds to build the index from every order, and the snapshot's
+  size and save/load time
+* ``similar``: latency of recommendations for one medicine (and a 3-item
+  cart), p50/p99 over ``--queries`` random lookups
+* ``customer``: latency of a customer's picks
+* ``incremental``: time to fold in a batch of new orders
+
+The route adds one ``_id $in`` read to hydrate the picks on top of these.
+
+    python benchmarks/recommendations_bench.py --orders 100000 --output results/recommendations.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import recommendations  # noqa: E402
+
+
+def make_orders(count, medicines, customers, rng, start):
+    weights = [1 / (rank + 1) for rank in range(len(medicines))]
+    bundles = [rng.sample(medicines, 3) for _ in range(max(1, len(medicines) // 50))]
+    for i in range(count):
+        items = rng.choices(medicines, weights, k=rng.randint(1, 5))
+        if rng.random() < 0.3:
+            items += rng.choice(bundles)[:rng.randint(2, 3)]
+        stamp = start + timedelta(seconds=i)
+        yield {"_id": ObjectId(), "user_email": f"customer{rng.randrange(customers)}@example.com",
+               "cart": [{"id": med_id} for med_id in items], "date": stamp, "completed_at": stamp}
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {"p50_us": round(statistics.median(samples) * 1e6, 1),
+            "p99_us": round(samples[int(len(samples) * 0.99) - 1] * 1e6, 1)}
+
+
+def timed(fn, args_list):
+    samples = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--medicines", type=int, default=3_000)
+    parser.add_argument("--customers", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    parser.add_argument("--new-orders", type=int, default=1_000, help="orders folded in incrementally")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    medicines = [str(ObjectId()) for _ in range(args.medicines)]
+    start = datetime(2026, 1, 1)
+    history = list(make_orders(args.orders, medicines, args.customers, rng, start))
+
+    index = recommendations.CoPurchaseIndex()
+    started = time.perf_counter()
+    index.build(history)
+    build_s = time.perf_counter() - started
+
+    path = os.path.join(tempfile.mkdtemp(), "recommendations.npz")
+    started = time.perf_counter()
+    index.save(path)
+    save_s = time.perf_counter() - started
+    started = time.perf_counter()
+    recommendations.CoPurchaseIndex().load(path)
+    load_s = time.perf_counter() - started
+
+    singles = [([rng.choice(medicines)],) for _ in range(args.queries)]
+    carts = [(rng.sample(medicines, 3),) for _ in range(args.queries)]
+    customers = [(f"customer{rng.randrange(args.customers)}@example.com",) for _ in range(args.queries)]
+
+    later = start + timedelta(seconds=args.orders + 1)
+    fresh = list(make_orders(args.new_orders, medicines, args.customers, rng, later))
+    started = time.perf_counter()
+    index.add_orders(fresh)
+    incremental_s = time.perf_counter() - started
+
+    report = {
+        "orders": args.orders, "medicines": args.medicines, "customers": args.customers,
+        "build": {"seconds": round(build_s, 2), "snapshot_mb": round(os.path.getsize(path) / 2**20, 1),
+                  "save_seconds": round(save_s, 2), "load_seconds": round(load_s, 2)},
+        "similar": timed(index.similar, singles),
+        "similar_cart": timed(index.similar, carts),
+        "customer": timed(index.for_customer, customers),
+        "incremental": {"orders": args.new_orders, "per_order_us": round(incremental_s / args.new_orders * 1e6, 1)},
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Snapshot write time and query latency of the /admin/reports reports.
+
+Generates synthetic completed orders in memory (Zipf-distributed medicine
+popularity, a few deals, customers returning over a year) and reports:
+
+* ``snapshot``: seconds to stream every order into a snapshot and its size
+  on disk
+* ``reports``: latency of each report over the whole snapshot and over a
+  30-day window, p50/p99 over ``--runs`` runs against the memory-mapped
+  columns
+* ``python_loop``: category revenue computed by looping over the order
+  documents, for scale
+
+    python benchmarks/reports_bench.py --orders 200000 --output results/reports.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reports  # noqa: E402
+
+CATEGORIES = ["Pain Relief", "Antibiotics", "Vitamins", "Cold & Flu", "Diabetes", "Heart", "Skin Care", "Allergy"]
+
+
+def make_medicines(count):
+    return [{"_id": ObjectId(), "name": f"Bench {i:06d}", "category": CATEGORIES[i % len(CATEGORIES)]}
+            for i in range(count)]
+
+
+def make_orders(count, medicines, customers, rng, start):
+    weights = [1 / (rank + 1) for rank in range(len(medicines))]
+    deals = {category: (f"deal{i}", f"Deal {category}", 10 + 5 * i) for i, category in enumerate(CATEGORIES[:3])}
+    step = 365 * 86400 / count
+    for i in range(count):
+        cart, total = [], 0.0
+        for med in rng.choices(medicines, weights, k=rng.randint(1, 5)):
+            item = {"id": str(med["_id"]), "price": round(rng.uniform(1, 120), 2), "category": med["category"],
+                    "quantity": rng.randint(1, 3)}
+            deal = deals.get(med["category"])
+            if deal and rng.random() < 0.5:
+                item.update(deal_id=deal[0], deal=deal[1], discount_percent=float(deal[2]))
+            total += item["price"] * item["quantity"] * (1 - item.get("discount_percent", 0) / 100)
+            cart.append(item)
+        yield {"user_email": f"customer{rng.randrange(customers)}@example.com", "cart": cart,
+               "total": round(total, 2), "date": start + timedelta(seconds=i * step)}
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {"p50_ms": round(statistics.median(samples) * 1e3, 2),
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e3, 2)}
+
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def loop_category_revenue(orders):
+    revenue = Counter()
+    for order in orders:
+        for item in order["cart"]:
+            revenue[item["category"]] += item["price"] * item["quantity"] * (1 - item.get("discount_percent", 0) / 100)
+    return revenue
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--medicines", type=int, default=3_000)
+    parser.add_argument("--customers", type=int, default=20_000)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    medicines = make_medicines(args.medicines)
+    start = datetime(2025, 1, 1)
+    history = list(make_orders(args.orders, medicines, args.customers, rng, start))
+
+    root = tempfile.mkdtemp()
+    started = time.perf_counter()
+    manifest = reports.write_snapshot(root, history, medicines)
+    write_s = time.perf_counter() - started
+    path = os.path.join(root, manifest["name"])
+    size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    snapshot = reports.Reports(root).current()
+    window = (datetime(2025, 6, 1), datetime(2025, 6, 30))
+    results = {}
+    for name, report in reports.REPORTS.items():
+        results[name] = {"all": timed(lambda: report(snapshot), args.runs),
+                         "30_days": timed(lambda: report(snapshot, *window), args.runs)}
+
+    output = {
+        "orders": args.orders, "lines": manifest["lines"], "customers": args.customers,
+        "snapshot": {"write_seconds": round(write_s, 2), "size_mb": round(size / 2**20, 1)},
+        "reports": results,
+        "python_loop": {"category_revenue": timed(lambda: loop_category_revenue(history), max(1, args.runs // 10))},
+    }
+    print(json.dumps(output, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
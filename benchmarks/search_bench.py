@@ -0,0 +1,71 @@
+"""Per-keystroke latency of the in-memory search index at catalog scale.
+
+    python benchmarks/search_bench.py --docs 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SearchIndex  # noqa: E402
+
+SYLLABLES = [c + v + coda for c in "bcdfghklmnprstvxz" for v in "aeiou" for coda in ("", "l", "n", "x")]
+CATEGORIES = ["Pain Relief", "Antibiotics", "Vitamins", "Cold & Flu", "Diabetes", "Heart", "Skin Care", "Allergy"]
+
+
+def fake_word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def fake_docs(n, rng):
+    for i in range(n):
+        yield {
+            "_id": f"{i:024x}",
+            "name": f"{fake_word(rng).title()} {rng.choice([250, 500, 100, 20])}mg",
+            "category": rng.choice(CATEGORIES),
+            "description": " ".join(fake_word(rng) for _ in range(12)),
+            "price": round(rng.uniform(1, 120), 2),
+            "sold": rng.randint(0, 5000),
+        }
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    docs = list(fake_docs(args.docs, rng))
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.rebuild(docs)
+    print(f"built index over {len(index)} docs in {time.perf_counter() - start:.2f}s")
+    index.search("warmup")  # first query sorts the global ranking
+
+    # Replay typing of product names one keystroke at a time, with an
+    # occasional typo that has to go through the trigram fallback.
+    words = [rng.choice(docs)["name"].split()[0].lower() for _ in range(args.queries)]
+    words = [w[:2] + "q" + w[3:] if rng.random() < 0.1 else w for w in words]
+    samples = []
+    for word in words:
+        for i in range(1, len(word) + 1):
+            t0 = time.perf_counter()
+            index.search(word[:i], limit=8)
+            samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    print(f"{len(samples)} keystrokes: p50={percentile(samples, 0.5):.3f}ms "
+          f"p95={percentile(samples, 0.95):.3f}ms p99={percentile(samples, 0.99):.3f}ms "
+          f"max={samples[-1]:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
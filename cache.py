@@ -0,0 +1,197 @@
+"""Read-through cache for reference data that only changes on admin writes.
+
+Each cached name has a version counter kept in the backend. Admin write routes
+call ``invalidate(name)``, which bumps the counter; readers compare the counter
+against the version their value was loaded under and reload on mismatch. With a
+shared backend the counter is shared too, so a write handled by one gunicorn
+worker invalidates every worker's copy. TTLs bound staleness for data that
+changes outside the admin routes (stock levels, sales counts).
+
+Rendered HTML fragments are cached the same way through ``fragment``: the
+entry is keyed on the versions of every name it was rendered from, so
+invalidating any of them re-renders it.
+
+``aget`` and ``afragment`` serve async callers. A backend whose calls block
+on I/O says so with ``blocking``, and those calls then run through
+``asyncio.to_thread`` so they never stall the event loop.
+
+Backends:
+
+* ``LocalBackend``  in-process dict; the default, coherent within one process
+* ``RedisBackend``  any redis-py compatible client (``fakeredis`` works as a
+  local stand-in); needs the optional ``redis`` package for ``from_url``
+"""
+import asyncio
+import pickle
+import threading
+import time
+
+
+class LocalBackend:
+    blocking = False
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = {}
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            with self._lock:
+                self._data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+
+    def counter(self, key):
+        return self.get(key) or 0
+
+    def incr(self, key):
+        with self._lock:
+            value = self.counter(key) + 1
+            self._data[key] = (value, None)
+            return value
+
+
+class RedisBackend:
+    blocking = True
+
+    def __init__(self, client, prefix="pharmacare:cache:"):
+        self._client = client
+        self._prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        raw = self._client.get(self._prefix + key)
+        return None if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(self._prefix + key, pickle.dumps(value), ex=int(ttl) if ttl else None)
+
+    def counter(self, key):
+        return int(self._client.get(self._prefix + key) or 0)
+
+    def incr(self, key):
+        return self._client.incr(self._prefix + key)
+
+
+def backend_from_url(url):
+    if not url:
+        return LocalBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend.from_url(url)
+    raise ValueError(f"Unsupported cache URL: {url}")
+
+
+class ReferenceCache:
+    """Versioned read-through cache keyed by name.
+
+    ``ttls`` maps each name to its time-to-live in seconds; names not listed
+    use ``default_ttl``.
+    """
+
+    def __init__(self, backend=None, default_ttl=300, ttls=None):
+        self.backend = backend or LocalBackend()
+        self.default_ttl = default_ttl
+        self.ttls = dict(ttls or {})
+        # Per-process copy so a shared backend costs one version read per
+        # hit instead of a full fetch and unpickle.
+        self._local = {}
+
+    def _version(self, name):
+        return self.backend.counter(f"{name}:version")
+
+    def _ttl(self, name):
+        return self.ttls.get(name, self.default_ttl)
+
+    def _lookup(self, name, version, ttl):
+        """Return ``(found, value)`` for the entry cached under ``version``."""
+        local = self._local.get(name)
+        if local and local[0] == version and local[1] > time.monotonic():
+            return True, local[2]
+        stored = self.backend.get(name)
+        if stored is not None and stored[0] == version:
+            self._remember(name, version, stored[1], ttl)
+            return True, stored[1]
+        return False, None
+
+    def _remember(self, name, version, value, ttl):
+        self._local[name] = (version, time.monotonic() + ttl, value)
+
+    def _store(self, name, version, value, ttl):
+        # Stored under the version read *before* loading, so a concurrent
+        # invalidate() makes this entry stale rather than lost.
+        self.backend.set(name, (version, value), ttl)
+        self._remember(name, version, value, ttl)
+
+    def _read(self, name, ttl):
+        """Return ``(version, found, value)`` for ``name``."""
+        version = self._version(name)
+        return (version, *self._lookup(name, version, ttl))
+
+    async def _offload(self, fn, *args):
+        # Unknown backends are assumed to do I/O
+        if getattr(self.backend, "blocking", True):
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def get(self, name, loader):
+        version = self._version(name)
+        found, value = self._lookup(name, version, self._ttl(name))
+        if not found:
+            value = loader()
+            self._store(name, version, value, self._ttl(name))
+        return value
+
+    async def aget(self, name, loader):
+        """``get`` for async callers; ``loader`` is a coroutine function."""
+        ttl = self._ttl(name)
+        version, found, value = await self._offload(self._read, name, ttl)
+        if not found:
+            value = await loader()
+            await self._offload(self._store, name, version, value, ttl)
+        return value
+
+    def _fragment_key(self, name, depends):
+        # A fragment is current while none of the names it was rendered from
+        # has been invalidated, and lives no longer than the shortest of
+        # their TTLs.
+        version = tuple(self._version(dep) for dep in depends)
+        return f"fragment:{name}", version, min(self._ttl(dep) for dep in depends)
+
+    def fragment(self, name, depends, render):
+        """Cached ``render()`` output, re-rendered when any name in ``depends`` is invalidated."""
+        key, version, ttl = self._fragment_key(name, depends)
+        found, value = self._lookup(key, version, ttl)
+        if not found:
+            value = render()
+            self._store(key, version, value, ttl)
+        return value
+
+    def _fragment_read(self, name, depends):
+        key, version, ttl = self._fragment_key(name, depends)
+        return (key, version, ttl, *self._lookup(key, version, ttl))
+
+    async def afragment(self, name, depends, render):
+        """``fragment`` for async callers; ``render`` is a coroutine function."""
+        key, version, ttl, found, value = await self._offload(self._fragment_read, name, depends)
+        if not found:
+            value = await render()
+            await self._offload(self._store, key, version, value, ttl)
+        return value
+
+    def invalidate(self, *names):
+        for name in names:
+            self.backend.incr(f"{name}:version")
+            self._local.pop(name, None)
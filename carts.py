@@ -0,0 +1,130 @@
+"""Server-side carts and wishlists.
+
+Each list is a ``{med_id: quantity}`` map stored under a cart ID; the Flask
+session only carries that ID, so the cookie stays small no matter how big the
+cart gets. Medicine details are not copied in: ``hydrate`` fetches them for a
+whole list in one ``$in`` query when a page or API response needs them, which
+also means names and prices shown are always current.
+
+Backends:
+
+* ``MemoryCartStore``  in-process dict; for development and single-process runs
+* ``MongoCartStore``   one document per cart ID, updated with ``$inc``/``$set``/
+  ``$unset`` on ``<kind>.<med_id>``; abandoned carts expire through the TTL
+  index on ``updated_at`` (see ``indexes.py``)
+"""
+import threading
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+CART = "cart"
+WISHLIST = "wishlist"
+KINDS = (CART, WISHLIST)
+DEFAULT_IMAGE = "/static/images/default.png"
+DETAIL_FIELDS = {"name": 1, "price": 1, "category": 1, "image": 1}
+
+
+class MemoryCartStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lists = {}
+
+    def get(self, cart_id, kind):
+        with self._lock:
+            return dict(self._lists.get((cart_id, kind), {}))
+
+    def get_all(self, cart_id):
+        return {kind: self.get(cart_id, kind) for kind in KINDS}
+
+    def add(self, cart_id, kind, med_id, quantity=1):
+        with self._lock:
+            items = self._lists.setdefault((cart_id, kind), {})
+            items[med_id] = items.get(med_id, 0) + quantity
+
+    def set(self, cart_id, kind, med_id, quantity):
+        if quantity <= 0:
+            return self.remove(cart_id, kind, med_id)
+        with self._lock:
+            self._lists.setdefault((cart_id, kind), {})[med_id] = quantity
+
+    def remove(self, cart_id, kind, med_id):
+        with self._lock:
+            self._lists.get((cart_id, kind), {}).pop(med_id, None)
+
+    def clear(self, cart_id, kind):
+        with self._lock:
+            self._lists.pop((cart_id, kind), None)
+
+
+LISTS_PROJECTION = {kind: 1 for kind in KINDS}
+
+
+def lists_from(doc):
+    """``{kind: {med_id: quantity}}`` from a ``MongoCartStore`` document (or None)."""
+    doc = doc or {}
+    return {kind: doc.get(kind, {}) for kind in KINDS}
+
+
+class MongoCartStore:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def _update(self, cart_id, update):
+        update.setdefault("$set", {})["updated_at"] = datetime.now()
+        self.collection.update_one({"_id": cart_id}, update, upsert=True)
+
+    def get(self, cart_id, kind):
+        doc = self.collection.find_one({"_id": cart_id}, {kind: 1})
+        return (doc or {}).get(kind, {})
+
+    def get_all(self, cart_id):
+        return lists_from(self.collection.find_one({"_id": cart_id}, LISTS_PROJECTION))
+
+    def add(self, cart_id, kind, med_id, quantity=1):
+        self._update(cart_id, {"$inc": {f"{kind}.{med_id}": quantity}})
+
+    def set(self, cart_id, kind, med_id, quantity):
+        if quantity <= 0:
+            return self.remove(cart_id, kind, med_id)
+        self._update(cart_id, {"$set": {f"{kind}.{med_id}": quantity}})
+
+    def remove(self, cart_id, kind, med_id):
+        self._update(cart_id, {"$unset": {f"{kind}.{med_id}": ""}})
+
+    def clear(self, cart_id, kind):
+        self._update(cart_id, {"$unset": {kind: ""}})
+
+
+def detail_query(lists):
+    """The ``$in`` filter that fetches every medicine named in ``lists``."""
+    ids = {med_id for quantities in lists.values() for med_id in quantities}
+    return {"_id": {"$in": [ObjectId(med_id) for med_id in ids]}}
+
+
+def lines_from(lists, docs):
+    """``{kind: lines}`` for ``lists`` given the medicines ``detail_query`` matched."""
+    docs = {str(d["_id"]): d for d in docs}
+    hydrated = {}
+    for kind, quantities in lists.items():
+        hydrated[kind] = [{
+            "id": med_id,
+            "name": docs[med_id]["name"],
+            "price": docs[med_id]["price"],
+            "category": docs[med_id]["category"],
+            "image": docs[med_id].get("image", DEFAULT_IMAGE),
+            "quantity": quantity,
+        } for med_id, quantity in quantities.items() if med_id in docs]
+    return hydrated
+
+
+def hydrate(medicines, lists):
+    """Turn ``{kind: {med_id: quantity}}`` into ``{kind: lines}``.
+
+    All lists are resolved with a single ``$in`` query. Lines keep list order
+    and carry ``id``, ``name``, ``price``, ``category``, ``image`` and
+    ``quantity``; medicines deleted since they were added are dropped.
+    """
+    if not any(lists.values()):
+        return {kind: [] for kind in lists}
+    return lines_from(lists, medicines.find(detail_query(lists), DETAIL_FIELDS))
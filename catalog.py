@@ -0,0 +1,160 @@
+"""Catalog browsing helpers: server-side filters, sort orders and keyset pagination.
+
+Pages are addressed by an opaque cursor holding the sort key and ``_id`` of the
+last row returned, so fetching page N costs the same as fetching page 1 and
+never uses ``skip()``.
+
+List pages never show a medicine's description (only ``/api/medicine/<id>``
+does), so they read ``LIST_FIELDS`` only and hold the results as
+``MedicineRow``\\s built by ``rows``.
+"""
+import base64
+import json
+
+from bson.objectid import ObjectId
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# Sort option -> (field, direction). ``_id`` in the same direction is always
+# appended as a tiebreaker so the order is total and cursors are stable.
+SORTS = {
+    "name": ("name", 1),
+    "price_asc": ("price", 1),
+    "price_desc": ("price", -1),
+    "popular": ("sold", -1),
+}
+DEFAULT_SORT = "name"
+
+# Everything a catalog card, top-seller tile or inventory row shows.
+LIST_FIELDS = {"name": 1, "category": 1, "price": 1, "quantity": 1, "sold": 1, "image": 1}
+
+# Named price buckets used by the filter buttons on /medicines.
+PRICE_RANGES = {
+    "under10": {"$lt": 10},
+    "10to50": {"$gte": 10, "$lte": 50},
+    "above50": {"$gt": 50},
+}
+
+
+def encode_cursor(value, _id):
+    raw = json.dumps([value, str(_id)], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        value, _id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return value, ObjectId(_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _to_float(value):
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid price: {value}")
+
+
+def build_filter(category=None, min_price=None, max_price=None, price_range=None):
+    """Translate request arguments into a Mongo filter on ``medicines``."""
+    query = {}
+    if category and category != "All":
+        query["category"] = category
+
+    if price_range and price_range != "Any":
+        if price_range not in PRICE_RANGES:
+            raise ValueError(f"Unknown price range: {price_range}")
+        query["price"] = dict(PRICE_RANGES[price_range])
+        return query
+
+    price = {}
+    min_price, max_price = _to_float(min_price), _to_float(max_price)
+    if min_price is not None:
+        price["$gte"] = min_price
+    if max_price is not None:
+        price["$lte"] = max_price
+    if price:
+        query["price"] = price
+    return query
+
+
+class MedicineRow:
+    """A medicine as list pages render it: ``LIST_FIELDS`` plus a string ``_id``.
+
+    Slotted, so a cached catalog holds no per-row dict. Fields missing from
+    the document stay unset and read as undefined in templates, so
+    ``|default`` filters behave as they do for documents.
+    """
+    __slots__ = ("_id", "name", "category", "price", "quantity", "sold", "image")
+
+    def __init__(self, doc):
+        for field in self.__slots__[1:]:
+            if field in doc:
+                setattr(self, field, doc[field])
+        self._id = str(doc["_id"])
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def as_dict(self):
+        """JSON-ready fields, for the API routes."""
+        return {field: getattr(self, field) for field in self.__slots__ if hasattr(self, field)}
+
+
+def rows(docs):
+    """``MedicineRow``\\s for documents read with ``LIST_FIELDS``."""
+    return [MedicineRow(doc) for doc in docs]
+
+
+def _after_cursor(field, direction, value, _id):
+    op = "$gt" if direction == 1 else "$lt"
+    return {"$or": [
+        {field: {op: value}},
+        {field: value, "_id": {op: _id}},
+    ]}
+
+
+def page_cursor(collection, query, sort=DEFAULT_SORT, cursor=None, limit=PAGE_SIZE, projection=LIST_FIELDS):
+    """The pymongo cursor behind ``fetch_page``; it reads ``limit + 1`` rows."""
+    if sort not in SORTS:
+        raise ValueError(f"Unknown sort: {sort}")
+    field, direction = SORTS[sort]
+
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        query = {"$and": [query, _after_cursor(field, direction, value, last_id)]} if query \
+            else _after_cursor(field, direction, value, last_id)
+
+    # Fetch one extra row to learn whether another page exists.
+    return (
+        collection.find(query, projection)
+        .sort([(field, direction), ("_id", direction)])
+        .limit(limit + 1)
+    )
+
+
+def fetch_page(collection, query, sort=DEFAULT_SORT, cursor=None, limit=PAGE_SIZE):
+    """Return ``(rows, next_cursor)`` for one page of ``collection``.
+
+    ``next_cursor`` is ``None`` once the last page has been reached.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    page = rows(page_cursor(collection, query, sort, cursor, limit))
+    next_cursor = None
+    if len(page) > limit:
+        field = SORTS[sort][0]
+        page = page[:limit]
+        last = page[-1]
+        next_cursor = encode_cursor(last.get(field), last["_id"])
+    return page, next_cursor
@@ -0,0 +1,233 @@
+"""Bulk medicine import and export as CSV or JSON Lines.
+
+Imports stream: rows are parsed one at a time, checked with ``medicine_fields``
+(the same rules as the admin add/edit routes) and upserted in unordered
+``bulk_write`` chunks of ``batch_size``, so memory stays flat however long the
+file is. A row with an ``_id`` updates that medicine (or creates it under that
+``_id``); a row without one is always a new medicine, since names are not
+unique. ``sold`` is left alone on existing medicines and starts at 0 on new
+ones. Bad rows do not stop the import; they are reported with their line
+number. A CSV record that cannot be parsed at all ends the import there, and
+is reported the same way.
+
+Exports stream rows from a cursor in ``_id`` order and never hold more than
+one chunk of output in memory.
+"""
+import csv
+import io
+import json
+import math
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+FORMATS = ("csv", "jsonl")
+EXPORT_FIELDS = ["_id", "name", "category", "price", "quantity", "sold", "description", "image"]
+DEFAULT_CATEGORY = "General"
+DEFAULT_DESCRIPTION = "No description available."
+DEFAULT_IMAGE = "/static/images/default.png"
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+class MalformedFile(ValueError):
+    """The upload cannot be read past ``line``."""
+
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.line = line
+
+
+def _whole_number(value):
+    # int() would truncate 2.9 to 2; only whole numbers (or their text) pass
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(value)
+        return int(value)
+    if isinstance(value, (int, str)):
+        return int(value)
+    raise TypeError(value)
+
+
+def _text(data, field, default):
+    value = data.get(field, default)
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid {field}: {value!r}")
+    return value
+
+
+def medicine_fields(data):
+    """Validated medicine fields from admin form or import row ``data``.
+
+    Raises ``ValueError`` with a message fit for the client.
+    """
+    name = _text(data, "name", "").strip()
+    if not name:
+        raise ValueError("Missing field: name")
+    try:
+        price = float(data["price"])
+    except KeyError:
+        raise ValueError("Missing field: price")
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid price: {data['price']!r}")
+    try:
+        quantity = _whole_number(data["quantity"])
+    except KeyError:
+        raise ValueError("Missing field: quantity")
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid quantity: {data['quantity']!r}")
+    if price < 0 or not math.isfinite(price):
+        raise ValueError(f"Invalid price: {data['price']!r}")
+    if quantity < 0:
+        raise ValueError(f"Invalid quantity: {data['quantity']!r}")
+    return {
+        "name": name,
+        "category": _text(data, "category", DEFAULT_CATEGORY),
+        "price": price,
+        "quantity": quantity,
+        "description": _text(data, "description", DEFAULT_DESCRIPTION),
+        "image": _text(data, "image", DEFAULT_IMAGE),
+    }
+
+
+def format_for(filename, default="csv"):
+    """``csv`` or ``jsonl`` from a file name's extension."""
+    lowered = (filename or "").lower()
+    if lowered.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    if lowered.endswith(".csv"):
+        return "csv"
+    return default
+
+
+def parse_rows(stream, fmt):
+    """Yield ``(line, data, error)`` for each row of a text stream.
+
+    ``error`` is a message when the row could not be parsed at all. Empty
+    CSV cells count as missing, so defaults apply as they do for the form.
+    Raises ``MalformedFile`` at a CSV record the reader cannot get past.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        try:
+            for data in reader:
+                row = {key: value for key, value in data.items() if key and value not in ("", None)}
+                yield reader.line_num, row, None
+        except csv.Error as e:
+            raise MalformedFile(reader.line_num + 1, f"Malformed CSV: {e}")
+    elif fmt == "jsonl":
+        for line, text in enumerate(stream, 1):
+            if not text.strip():
+                continue
+            try:
+                data = json.loads(text)
+            except (ValueError, RecursionError) as e:
+                yield line, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(data, dict):
+                yield line, None, "Expected a JSON object"
+                continue
+            yield line, data, None
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def upsert_op(data):
+    fields = medicine_fields(data)
+    if not data.get("_id"):
+        return InsertOne({**fields, "sold": 0})
+    try:
+        query = {"_id": ObjectId(str(data["_id"]))}
+    except InvalidId:
+        raise ValueError(f"Invalid _id: {data['_id']!r}")
+    return UpdateOne(query, {"$set": fields, "$setOnInsert": {"sold": 0}}, upsert=True)
+
+
+class ImportReport:
+    def __init__(self, max_errors=MAX_REPORTED_ERRORS):
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def error(self, line, message):
+        self.failed += 1
+        # Keep the count exact but the list bounded.
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self):
+        return {"rows": self.rows, "inserted": self.inserted, "updated": self.updated,
+                "failed": self.failed, "errors": self.errors}
+
+
+def _flush(collection, ops, lines, report):
+    try:
+        result = collection.bulk_write(ops, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        for err in details["writeErrors"]:
+            report.error(lines[err["index"]], err["errmsg"])
+    report.inserted += details["nUpserted"] + details["nInserted"]
+    report.updated += details["nMatched"]
+
+
+def import_medicines(collection, stream, fmt, batch_size=BATCH_SIZE):
+    """Upsert every valid row of ``stream``; returns an ``ImportReport``."""
+    report = ImportReport()
+    ops, lines = [], []
+    try:
+        for line, data, error in parse_rows(stream, fmt):
+            report.rows += 1
+            if error is None:
+                try:
+                    ops.append(upsert_op(data))
+                    lines.append(line)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                report.error(line, error)
+            if len(ops) >= batch_size:
+                _flush(collection, ops, lines, report)
+                ops, lines = [], []
+    except MalformedFile as e:
+        report.error(e.line, str(e))
+    if ops:
+        _flush(collection, ops, lines, report)
+    return report
+
+
+def _export_value(value):
+    return str(value) if isinstance(value, ObjectId) else value
+
+
+def export_medicines(collection, fmt, batch_size=BATCH_SIZE):
+    """Yield the medicines collection as CSV or JSON Lines text chunks."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    cursor = collection.find({}, {field: 1 for field in EXPORT_FIELDS}).sort("_id", 1).batch_size(batch_size)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, EXPORT_FIELDS, extrasaction="ignore")
+    if fmt == "csv":
+        writer.writeheader()
+    rows = 0
+    for doc in cursor:
+        row = {field: _export_value(doc[field]) for field in EXPORT_FIELDS if field in doc}
+        if fmt == "csv":
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row) + "\n")
+        rows += 1
+        if rows % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,143 @@
+"""Index definitions, ensured when each process first connects.
+
+``create_indexes`` is idempotent: re-running it with the same specs is a no-op
+on the server, so every worker can call it on its first connection (see
+``mongo.Connection``). Deploys that would rather build them once run ``flask
+ensure-indexes`` and set ``PHARMACARE_ENSURE_INDEXES=0``.
+
+When a spec here changes (say an index becomes unique) the existing index is
+left in place and logged; ``flask ensure-indexes --rebuild`` drops and
+rebuilds it. A unique index that existing duplicates block is built without
+``unique`` instead, and the duplicate keys are logged, so queries stay
+indexed until they are cleaned up.
+
+Every query a route runs should be served by one of these; ``query_plans``
+(``flask check-query-plans``) fails on any that falls back to a COLLSCAN.
+"""
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+log = logging.getLogger(__name__)
+
+INDEXES = {
+    "medicines": [
+        # Unfiltered catalog sorts (see catalog.SORTS); sold_id also serves
+        # the landing page and dashboard top sellers.
+        IndexModel([("name", ASCENDING), ("_id", ASCENDING)], name="name_id"),
+        IndexModel([("price", ASCENDING), ("_id", ASCENDING)], name="price_id"),
+        IndexModel([("sold", DESCENDING), ("_id", DESCENDING)], name="sold_id"),
+        # Category-filtered sorts; the price one also serves price-range filters.
+        IndexModel([("category", ASCENDING), ("name", ASCENDING), ("_id", ASCENDING)], name="category_name_id"),
+        IndexModel([("category", ASCENDING), ("price", ASCENDING), ("_id", ASCENDING)], name="category_price_id"),
+        IndexModel([("category", ASCENDING), ("sold", DESCENDING), ("_id", DESCENDING)], name="category_sold_id"),
+        # Low-stock list, emptiest first (see stock_levels).
+        IndexModel([("stock_status", ASCENDING), ("quantity", ASCENDING), ("_id", ASCENDING)],
+                   name="stock_status_quantity_id"),
+    ],
+    "users": [
+        # Login, register and profile updates.
+        IndexModel([("email", ASCENDING)], name="email", unique=True),
+    ],
+    "admins": [
+        IndexModel([("email", ASCENDING)], name="email", unique=True),
+    ],
+    "orders": [
+        # Receipt history, newest first (see order_history).
+        IndexModel([("user_email", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)], name="user_email_date_id"),
+        # Date-range backfills in stats.
+        IndexModel([("date", ASCENDING)], name="date"),
+        # Checkout retries (see order_pipeline); orders from before the
+        # pipeline have no key.
+        IndexModel([("user_email", ASCENDING), ("idempotency_key", ASCENDING)], name="user_email_idempotency_key",
+                   unique=True, partialFilterExpression={"idempotency_key": {"$exists": True}}),
+        # The order queue: only orders still waiting for a worker are indexed.
+        IndexModel([("queued_at", ASCENDING)], name="queued_at",
+                   partialFilterExpression={"queued_at": {"$exists": True}}),
+        # Orders completed since the recommendations were last refreshed.
+        IndexModel([("completed_at", ASCENDING)], name="completed_at",
+                   partialFilterExpression={"completed_at": {"$exists": True}}),
+    ],
+    "sales_rollups": [
+        IndexModel([("granularity", ASCENDING), ("bucket", ASCENDING)], name="granularity_bucket"),
+    ],
+    "carts": [
+        # Abandoned carts and wishlists expire after 30 days untouched.
+        IndexModel([("updated_at", ASCENDING)], name="updated_at_ttl", expireAfterSeconds=30 * 24 * 3600),
+    ],
+    "user_stats": [
+        IndexModel([("total_spent", DESCENDING), ("_id", ASCENDING)], name="total_spent_id"),
+    ],
+}
+
+# Server error codes for an existing index that clashes with a spec.
+INDEX_OPTIONS_CONFLICT = 85
+INDEX_KEY_SPECS_CONFLICT = 86
+DUPLICATE_KEY = 11000
+
+
+def _create(collection, model):
+    """Create one index; False when existing data violates its uniqueness."""
+    try:
+        collection.create_indexes([model])
+        return True
+    except OperationFailure as e:
+        if e.code != DUPLICATE_KEY:
+            raise
+        log.warning("Cannot build unique index %s.%s: %s",
+                    collection.name, model.document["name"], e.details.get("errmsg", e))
+        return False
+
+
+def _log_duplicates(collection, spec, limit=20):
+    pipeline = [{"$match": spec["partialFilterExpression"]}] if "partialFilterExpression" in spec else []
+    pipeline += [
+        {"$group": {"_id": [f"${field}" for field in spec["key"]], "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": limit},
+    ]
+    for dup in collection.aggregate(pipeline):
+        log.warning("Duplicate %s.%s key %r in %d documents",
+                    collection.name, spec["name"], dup["_id"], dup["count"])
+
+
+def _create_or_fallback(collection, model):
+    if _create(collection, model):
+        return
+    spec = model.document
+    _log_duplicates(collection, spec)
+    # Keep queries indexed until the duplicates are cleaned up.
+    options = {k: v for k, v in spec.items() if k not in ("key", "name", "unique")}
+    collection.create_index(list(spec["key"].items()), name=spec["name"], **options)
+
+
+def _ensure_one(collection, model, rebuild):
+    spec = model.document
+    try:
+        _create_or_fallback(collection, model)
+        return
+    except OperationFailure as e:
+        if e.code not in (INDEX_OPTIONS_CONFLICT, INDEX_KEY_SPECS_CONFLICT):
+            raise
+    clashing = [existing["name"] for existing in collection.list_indexes()
+                if existing["name"] == spec["name"] or dict(existing["key"]) == dict(spec["key"])]
+    if not rebuild:
+        log.warning("Index %s.%s differs from its spec (existing: %s); run `flask ensure-indexes --rebuild`",
+                    collection.name, spec["name"], ", ".join(clashing))
+        return
+    for name in clashing:
+        log.warning("Dropping index %s.%s to rebuild it", collection.name, name)
+        collection.drop_index(name)
+    _create_or_fallback(collection, model)
+
+
+def ensure_indexes(db, rebuild=False):
+    """Create every index in ``INDEXES``; ``rebuild`` drops existing ones that differ from their spec."""
+    for collection, models in INDEXES.items():
+        try:
+            db[collection].create_indexes(models)
+        except OperationFailure:
+            # One bad spec fails the whole batch; sort it out index by index.
+            for model in models:
+                _ensure_one(db[collection], model, rebuild)
@@ -0,0 +1,155 @@
+"""Atomic stock reservation for checkout.
+
+A cart is collapsed to ``{med_id: quantity}`` and applied as one
+``bulk_write`` whose filters require ``quantity >= n``, so stock can never go
+negative. Either every line is applied or none is:
+
+* on a replica set or sharded cluster the bulk write runs in a transaction
+  that is aborted if any line is short;
+* on a standalone server each update also tags the document with a
+  reservation token, and a shortfall is undone with a compensating
+  ``bulk_write`` that only touches documents carrying that token.
+
+With a caller-supplied token the tags stay until ``settle_reservation``, so
+a reservation left behind by a caller that died can still be undone with
+``release_stock(..., token=...)`` (the order pipeline does this on retry).
+"""
+import uuid
+import weakref
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+RESERVATIONS = "_reservations"
+
+
+class OutOfStock(Exception):
+    def __init__(self, items):
+        self.items = items
+        names = ", ".join(item["name"] for item in items)
+        super().__init__(f"Not enough stock for: {names}")
+
+
+def collapse_cart(cart):
+    """Sum cart lines into ``{med_id: quantity}``, preserving first-seen order."""
+    quantities = {}
+    for item in cart:
+        quantities[item["id"]] = quantities.get(item["id"], 0) + item.get("quantity", 1)
+    return quantities
+
+
+# Keyed on the client itself (a LazyClient outlives every request), not id(),
+# which a later client could reuse.
+_transaction_support = weakref.WeakKeyDictionary()
+
+
+def supports_transactions(client):
+    """True when ``client`` talks to a replica set or mongos.
+
+    The answer is remembered per client once ``hello`` succeeds; if it fails
+    the call answers False and the next one asks again.
+    """
+    try:
+        return _transaction_support[client]
+    except KeyError:
+        pass
+    try:
+        hello = client.admin.command("hello")
+    except (PyMongoError, NotImplementedError):
+        return False
+    supported = _transaction_support[client] = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return supported
+
+
+def run_in_transaction(client, callback):
+    """Call ``callback(session)`` inside a transaction when the deployment
+    supports one, otherwise ``callback(None)``.
+
+    Transient transaction errors (write conflicts between concurrent
+    checkouts) are retried by the driver.
+    """
+    if not supports_transactions(client):
+        return callback(None)
+    with client.start_session() as session:
+        return session.with_transaction(callback)
+
+
+def _stock_report(collection, quantities, session=None, only_short=True):
+    ids = [ObjectId(med_id) for med_id in quantities]
+    docs = {d["_id"]: d for d in collection.find({"_id": {"$in": ids}}, {"name": 1, "quantity": 1}, session=session)}
+    report = []
+    for (med_id, requested), oid in zip(quantities.items(), ids):
+        doc = docs.get(oid) or {}
+        available = max(doc.get("quantity", 0), 0)
+        if available < requested or not only_short:
+            report.append({"id": med_id, "name": doc.get("name", med_id),
+                           "requested": requested, "available": available})
+    return report
+
+
+def reserve_stock(collection, quantities, session=None, token=None):
+    """Decrement ``quantity`` and increment ``sold`` for every line, or for none.
+
+    Raises ``OutOfStock`` listing the lines that could not be satisfied.
+    Pass the session of an active transaction to rely on it for atomicity;
+    without one the compensating path described in the module docstring is
+    used, under ``token`` if given.
+    """
+    ids = [ObjectId(med_id) for med_id in quantities]
+    if session is not None:
+        ops = [UpdateOne({"_id": oid, "quantity": {"$gte": n}}, {"$inc": {"quantity": -n, "sold": n}})
+               for oid, n in zip(ids, quantities.values())]
+        result = collection.bulk_write(ops, ordered=False, session=session)
+        if result.matched_count < len(ops):
+            # Raising aborts the surrounding transaction.
+            raise OutOfStock(_stock_report(collection, quantities, session=session))
+        return
+
+    keep_tags = token is not None
+    token = token or uuid.uuid4().hex
+    ops = [UpdateOne({"_id": oid, "quantity": {"$gte": n}},
+                     {"$inc": {"quantity": -n, "sold": n}, "$push": {RESERVATIONS: token}})
+           for oid, n in zip(ids, quantities.values())]
+    result = collection.bulk_write(ops, ordered=False)
+    if result.matched_count == len(ops):
+        if not keep_tags:
+            settle_reservation(collection, quantities, token)
+        return
+
+    applied = {d["_id"] for d in collection.find({"_id": {"$in": ids}, RESERVATIONS: token}, {"_id": 1})}
+    release_stock(collection, quantities, token=token)
+    failed = {med_id: n for (med_id, n), oid in zip(quantities.items(), ids) if oid not in applied}
+    raise OutOfStock(_stock_report(collection, failed, only_short=False))
+
+
+def _drop_empty_tags(collection, ids, session=None):
+    # $pull leaves an empty array behind; remove it so settled documents look
+    # like ones that were never reserved.
+    collection.update_many({"_id": {"$in": ids}, RESERVATIONS: {"$size": 0}},
+                           {"$unset": {RESERVATIONS: ""}}, session=session)
+
+
+def settle_reservation(collection, quantities, token):
+    """Drop ``token``'s tags once the reservation it made is final."""
+    ids = [ObjectId(med_id) for med_id in quantities]
+    collection.update_many({"_id": {"$in": ids}}, {"$pull": {RESERVATIONS: token}})
+    _drop_empty_tags(collection, ids)
+
+
+def release_stock(collection, quantities, token=None, session=None):
+    """Undo ``reserve_stock``; with ``token`` only documents tagged by that
+    reservation are touched, so it is safe to call for partially applied ones."""
+    ids = [ObjectId(med_id) for med_id in quantities]
+    ops = []
+    for oid, n in zip(ids, quantities.values()):
+        query = {"_id": oid}
+        update = {"$inc": {"quantity": n, "sold": -n}}
+        if token is not None:
+            query[RESERVATIONS] = token
+            update["$pull"] = {RESERVATIONS: token}
+        ops.append(UpdateOne(query, update))
+    if ops:
+        collection.bulk_write(ops, ordered=False, session=session)
+        if token is not None:
+            _drop_empty_tags(collection, ids, session=session)
@@ -0,0 +1,231 @@
+"""Per-route request timing and MongoDB command tracing.
+
+``Instrumentation`` records, for every request:
+
+* its latency, in a histogram per route, method and status
+* the Mongo commands it issued (through pymongo's command monitoring), with
+  their count, time and documents returned, per route and command
+* repeated commands of one shape, such as a ``find_one`` per row of a result,
+  which are flagged as N+1 patterns and logged
+
+``render()`` returns everything in the Prometheus text format. Requests slower
+than ``slow_ms`` are logged with their command breakdown.
+
+The listener has to be passed to the client when it is created::
+
+    MongoClient(uri, event_listeners=[instrumentation.listener])
+
+Numbers are per process; with several gunicorn workers each scrape sees the
+worker that answered it.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter
+
+from pymongo import monitoring
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+# A shape repeated this many times in one request is reported as N+1.
+N_PLUS_ONE_THRESHOLD = 5
+BACKGROUND = "<background>"
+# Cursor continuations and cleanup repeat by design.
+_UNSHAPED = {"getMore", "killCursors", "endSessions"}
+
+_current = contextvars.ContextVar("pharmacare_request_trace", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6f}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+def command_shape(command_name, command):
+    """``find medicines {_id}``: command, collection and filter fields, without values."""
+    collection = command.get(command_name)
+    query = command.get("filter") or command.get("query") or {}
+    if command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or [{}]
+        query = statements[0].get("q", {})
+    elif command_name == "aggregate":
+        first = (command.get("pipeline") or [{}])[0]
+        query = first.get("$match", {})
+    fields = ",".join(sorted(query)) if isinstance(query, dict) else ""
+    return f"{command_name} {collection} {{{fields}}}"
+
+
+def _documents_returned(reply):
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or ())
+    return 0
+
+
+class RequestTrace:
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.pending = {}
+        self.token = None
+        self.commands = Counter()
+        self.command_seconds = Counter()
+        self.shapes = Counter()
+        self.documents = 0
+
+
+class _Listener(monitoring.CommandListener):
+    def __init__(self, instrumentation):
+        self.instrumentation = instrumentation
+
+    def started(self, event):
+        trace = _current.get()
+        if trace is not None:
+            shape = None if event.command_name in _UNSHAPED else command_shape(event.command_name, event.command)
+            trace.pending[(event.connection_id, event.request_id)] = shape
+
+    def succeeded(self, event):
+        self.instrumentation._command(event, _documents_returned(event.reply))
+
+    def failed(self, event):
+        self.instrumentation._command(event, 0)
+
+
+class Instrumentation:
+    def __init__(self, slow_ms=None, n_plus_one_threshold=N_PLUS_ONE_THRESHOLD):
+        self.slow_ms = slow_ms
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.listener = _Listener(self)
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._queries = {}
+        self._commands = Counter()
+        self._command_seconds = Counter()
+        self._documents = Counter()
+        self._n_plus_one = Counter()
+
+    # -- recording --
+    def _command(self, event, documents):
+        trace = _current.get()
+        seconds = event.duration_micros / 1e6
+        if trace is None:
+            with self._lock:
+                self._commands[(BACKGROUND, event.command_name)] += 1
+                self._command_seconds[(BACKGROUND, event.command_name)] += seconds
+                self._documents[BACKGROUND] += documents
+            return
+        shape = trace.pending.pop((event.connection_id, event.request_id), None)
+        trace.commands[event.command_name] += 1
+        trace.command_seconds[event.command_name] += seconds
+        trace.documents += documents
+        if shape:
+            trace.shapes[shape] += 1
+
+    def start(self, route):
+        """Attribute the Mongo commands issued from here on (in this context) to ``route``."""
+        trace = RequestTrace(route)
+        trace.token = _current.set(trace)
+        return trace
+
+    def finish(self, trace, method, status):
+        """Stop tracing and record the request with its response ``status``."""
+        _current.reset(trace.token)
+        elapsed = time.perf_counter() - trace.started
+        mongo_seconds = sum(trace.command_seconds.values())
+        repeated = {shape: n for shape, n in trace.shapes.items() if n >= self.n_plus_one_threshold}
+        queries = sum(trace.commands.values())
+        with self._lock:
+            key = (trace.route, method, str(status))
+            self._latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            self._queries.setdefault(trace.route, Histogram(QUERY_BUCKETS)).observe(queries)
+            for name, n in trace.commands.items():
+                self._commands[(trace.route, name)] += n
+                self._command_seconds[(trace.route, name)] += trace.command_seconds[name]
+            self._documents[trace.route] += trace.documents
+            for shape in repeated:
+                self._n_plus_one[(trace.route, shape)] += 1
+        for shape, n in repeated.items():
+            log.warning("N+1 query pattern on %s: %r ran %d times in one request", trace.route, shape, n)
+        if self.slow_ms is not None and elapsed * 1000 >= self.slow_ms:
+            log.warning("Slow request %s %s: %.0fms, %d Mongo commands (%.0fms, %d docs) %s",
+                        method, trace.route, elapsed * 1000, queries, mongo_seconds * 1000,
+                        trace.documents, dict(trace.shapes.most_common(5)))
+
+    # -- Flask --
+    def install(self, app):
+        """Trace every Flask request, labelled with its URL rule."""
+        from flask import g, request
+
+        @app.before_request
+        def _start_trace():
+            g._trace = self.start(request.url_rule.rule if request.url_rule else "<unmatched>")
+
+        @app.after_request
+        def _record_status(response):
+            g._trace_status = response.status_code
+            return response
+
+        @app.teardown_request
+        def _finish_trace(exc):
+            trace = g.pop("_trace", None)
+            if trace is not None:
+                self.finish(trace, request.method, g.pop("_trace_status", 500))
+
+    # -- exposition --
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        out = []
+        with self._lock:
+            out.append("# HELP pharmacare_request_duration_seconds Request latency by route.")
+            out.append("# TYPE pharmacare_request_duration_seconds histogram")
+            for (route, method, status), hist in sorted(self._latency.items()):
+                out.extend(hist.lines("pharmacare_request_duration_seconds",
+                                      f'route="{_escape(route)}",method="{method}",status="{status}"'))
+            out.append("# HELP pharmacare_mongo_commands_per_request Mongo commands issued per request.")
+            out.append("# TYPE pharmacare_mongo_commands_per_request histogram")
+            for route, hist in sorted(self._queries.items()):
+                out.extend(hist.lines("pharmacare_mongo_commands_per_request", f'route="{_escape(route)}"'))
+            out.append("# HELP pharmacare_mongo_commands_total Mongo commands by route and command.")
+            out.append("# TYPE pharmacare_mongo_commands_total counter")
+            for (route, name), n in sorted(self._commands.items()):
+                out.append(f'pharmacare_mongo_commands_total{{route="{_escape(route)}",command="{name}"}} {n}')
+            out.append("# HELP pharmacare_mongo_seconds_total Time spent in Mongo commands by route and command.")
+            out.append("# TYPE pharmacare_mongo_seconds_total counter")
+            for (route, name), seconds in sorted(self._command_seconds.items()):
+                out.append(f'pharmacare_mongo_seconds_total{{route="{_escape(route)}",command="{name}"}} {seconds:.6f}')
+            out.append("# HELP pharmacare_mongo_documents_returned_total Documents returned by Mongo by route.")
+            out.append("# TYPE pharmacare_mongo_documents_returned_total counter")
+            for route, n in sorted(self._documents.items()):
+                out.append(f'pharmacare_mongo_documents_returned_total{{route="{_escape(route)}"}} {n}')
+            out.append("# HELP pharmacare_n_plus_one_total Requests that repeated one query shape.")
+            out.append("# TYPE pharmacare_n_plus_one_total counter")
+            for (route, shape), n in sorted(self._n_plus_one.items()):
+                out.append(f'pharmacare_n_plus_one_total{{route="{_escape(route)}",shape="{_escape(shape)}"}} {n}')
+        return "\n".join(out) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
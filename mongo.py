@@ -0,0 +1,275 @@
+"""MongoDB settings and a client created lazily in each process.
+
+``Settings.from_env()`` reads the connection from the environment:
+
+* ``PHARMACARE_MONGO_URI`` (default ``mongodb://localhost:27017/``) and
+  ``PHARMACARE_MONGO_DB`` (default ``pharmacy_db``)
+* ``PHARMACARE_MONGO_MAX_POOL`` / ``PHARMACARE_MONGO_MIN_POOL``: pooled
+  connections per server, per process
+* ``PHARMACARE_MONGO_CONNECT_TIMEOUT_MS``,
+  ``PHARMACARE_MONGO_SERVER_SELECTION_TIMEOUT_MS``,
+  ``PHARMACARE_MONGO_SOCKET_TIMEOUT_MS`` and
+  ``PHARMACARE_MONGO_WAIT_QUEUE_TIMEOUT_MS`` (how long a request waits for a
+  free pooled connection)
+* ``PHARMACARE_MONGO_READ_PREFERENCE``: used by the handles from
+  ``database(read_only=True)``, which only read-only routes use (say
+  ``secondaryPreferred`` to take catalog reads off the primary). Everything
+  else reads from the primary.
+
+``Connection`` opens its ``MongoClient`` on first use and again in every
+process that uses it after a fork, so importing the app connects to nothing
+and gunicorn workers forked after ``--preload`` each get their own pool
+instead of sockets shared with the master. ``LazyDatabase`` and
+``LazyCollection`` stand in for the database and collections at module level
+and resolve to the current process's client on each call.
+
+``on_connect(database)`` runs once per process, on the first use, before
+anything else gets the client; a failure is raised to that caller and retried
+on the next use. ``check()`` pings the server and reports this process's
+connection pools for readiness probes.
+"""
+import os
+import threading
+import time
+from collections import Counter
+
+import pymongo
+from pymongo import MongoClient, ReadPreference, monitoring
+from pymongo.errors import PyMongoError
+
+DEFAULT_URI = "mongodb://localhost:27017/"
+DEFAULT_DB = "pharmacy_db"
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+APP_NAME = "pharmacare"
+
+
+def _int_env(environ, name, default):
+    value = environ.get(name)
+    return int(value) if value else default
+
+
+class Settings:
+    def __init__(self, uri=DEFAULT_URI, db_name=DEFAULT_DB, max_pool_size=100, min_pool_size=0,
+                 connect_timeout_ms=5000, server_selection_timeout_ms=10000, socket_timeout_ms=None,
+                 wait_queue_timeout_ms=None, read_preference="primary"):
+        if read_preference not in READ_PREFERENCES:
+            raise ValueError(f"Unknown read preference {read_preference!r}; "
+                             f"expected one of {', '.join(READ_PREFERENCES)}")
+        self.uri = uri
+        self.db_name = db_name
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.connect_timeout_ms = connect_timeout_ms
+        self.server_selection_timeout_ms = server_selection_timeout_ms
+        self.socket_timeout_ms = socket_timeout_ms
+        self.wait_queue_timeout_ms = wait_queue_timeout_ms
+        self.read_preference = read_preference
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            uri=environ.get("PHARMACARE_MONGO_URI") or DEFAULT_URI,
+            db_name=environ.get("PHARMACARE_MONGO_DB") or DEFAULT_DB,
+            max_pool_size=_int_env(environ, "PHARMACARE_MONGO_MAX_POOL", 100),
+            min_pool_size=_int_env(environ, "PHARMACARE_MONGO_MIN_POOL", 0),
+            connect_timeout_ms=_int_env(environ, "PHARMACARE_MONGO_CONNECT_TIMEOUT_MS", 5000),
+            server_selection_timeout_ms=_int_env(environ, "PHARMACARE_MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000),
+            socket_timeout_ms=_int_env(environ, "PHARMACARE_MONGO_SOCKET_TIMEOUT_MS", None),
+            wait_queue_timeout_ms=_int_env(environ, "PHARMACARE_MONGO_WAIT_QUEUE_TIMEOUT_MS", None),
+            read_preference=environ.get("PHARMACARE_MONGO_READ_PREFERENCE") or "primary",
+        )
+
+    def client_options(self):
+        """Keyword arguments for ``MongoClient`` (or ``AsyncMongoClient``)."""
+        return {
+            "host": self.uri,
+            "appname": APP_NAME,
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "connectTimeoutMS": self.connect_timeout_ms,
+            "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+            "socketTimeoutMS": self.socket_timeout_ms,
+            "waitQueueTimeoutMS": self.wait_queue_timeout_ms,
+        }
+
+    def read_options(self, read_only):
+        """Keyword arguments for ``client.get_database`` on a read-only handle."""
+        return {"read_preference": READ_PREFERENCES[self.read_preference]} if read_only else {}
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool state per server address, from pymongo's pool events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def _pool(self, address):
+        return self._pools.setdefault(address, Counter())
+
+    def _count(self, event, **deltas):
+        with self._lock:
+            pool = self._pool(event.address)
+            for key, delta in deltas.items():
+                pool[key] += delta
+
+    def pool_created(self, event):
+        self._count(event)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._count(event, cleared=1)
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._pools.pop(event.address, None)
+
+    def connection_created(self, event):
+        self._count(event, open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count(event, open=-1)
+
+    def connection_check_out_started(self, event):
+        self._count(event, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._count(event, waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._count(event, waiting=-1, in_use=1)
+
+    def connection_checked_in(self, event):
+        self._count(event, in_use=-1)
+
+    def snapshot(self):
+        """``{"host:port": {"open", "in_use", "waiting", "cleared", "checkout_failures"}}``."""
+        keys = ("open", "in_use", "waiting", "cleared", "checkout_failures")
+        with self._lock:
+            return {f"{host}:{port}": {key: pool[key] for key in keys}
+                    for (host, port), pool in self._pools.items()}
+
+
+class Connection:
+    def __init__(self, settings, event_listeners=(), on_connect=None):
+        self.settings = settings
+        self.event_listeners = list(event_listeners)
+        self.on_connect = on_connect
+        self.pool = PoolStats()
+        self._lock = threading.RLock()
+        self._pid = None
+        self._client = None
+        self._collections = {}
+        self._ready_pid = None
+
+    def _open(self):
+        # Only the process that created a client may use it; a forked child
+        # starts over with a client (and pool counts) of its own.
+        with self._lock:
+            if self._pid != os.getpid():
+                self.pool = PoolStats()
+                self._client = MongoClient(**self.settings.client_options(),
+                                           event_listeners=self.event_listeners + [self.pool])
+                self._collections = {}
+                self._pid = os.getpid()
+            return self._client
+
+    def client(self):
+        client = self._client if self._pid == os.getpid() else self._open()
+        if self._ready_pid != os.getpid():
+            with self._lock:
+                if self._ready_pid != os.getpid():
+                    if self.on_connect is not None:
+                        self.on_connect(client[self.settings.db_name])
+                    self._ready_pid = os.getpid()
+        return client
+
+    def database(self, read_only=False):
+        return self.client().get_database(self.settings.db_name, **self.settings.read_options(read_only))
+
+    def collection(self, name, read_only=False):
+        client = self.client()
+        try:
+            return self._collections[name, read_only]
+        except KeyError:
+            collection = client.get_database(self.settings.db_name, **self.settings.read_options(read_only))[name]
+            self._collections[name, read_only] = collection
+            return collection
+
+    def check(self, timeout=2.0):
+        """Return ``(ready, details)``: a ping within ``timeout`` seconds, and this process's pools.
+
+        Not ready when the server cannot be reached or a pool is exhausted
+        with requests queued for a connection.
+        """
+        started = time.perf_counter()
+        try:
+            with pymongo.timeout(timeout):
+                self.client().admin.command("ping")
+        except PyMongoError as e:
+            return False, {"mongo": "unreachable", "error": str(e), "pools": self.pool.snapshot()}
+        pools = self.pool.snapshot()
+        exhausted = [address for address, pool in pools.items()
+                     if pool["waiting"] and pool["in_use"] >= self.settings.max_pool_size]
+        details = {"mongo": "ok", "ping_ms": round((time.perf_counter() - started) * 1000, 1), "pools": pools}
+        if exhausted:
+            details["exhausted"] = exhausted
+        return not exhausted, details
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._pid = self._ready_pid = self._client = None
+            self._collections = {}
+
+
+class LazyClient:
+    """The current process's ``MongoClient``, opened on first use."""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection.client(), name)
+
+    def __getitem__(self, name):
+        return self._connection.client()[name]
+
+
+class LazyDatabase:
+    """The app database; ``db["name"]`` is a ``LazyCollection`` and touches nothing until used."""
+
+    def __init__(self, connection, read_only=False):
+        self._connection = connection
+        self._read_only = read_only
+
+    def __getattr__(self, name):
+        return getattr(self._connection.database(self._read_only), name)
+
+    def __getitem__(self, name):
+        return LazyCollection(self._connection, name, self._read_only)
+
+
+class LazyCollection:
+    def __init__(self, connection, name, read_only=False):
+        self._connection = connection
+        self._read_only = read_only
+        self.name = name
+
+    def __getattr__(self, name):
+        return getattr(self._connection.collection(self.name, self._read_only), name)
+
+    def __repr__(self):
+        return f"LazyCollection({self.name!r}{', read_only=True' if self._read_only else ''})"
@@ -0,0 +1,55 @@
+"""A customer's order history, newest first, one page at a time.
+
+Pages are keyed on ``(date, _id)`` within a user's orders and served by the
+``orders.user_email_date_id`` index, so any page costs the same as the first.
+List rows carry a summary only; the embedded ``cart`` is reduced to a line
+count server-side and never sent over the wire.
+"""
+from datetime import datetime
+
+import catalog
+import order_pipeline
+
+PAGE_SIZE = 12
+MAX_PAGE_SIZE = 50
+
+
+def encode_cursor(order):
+    return catalog.encode_cursor(order["date"].isoformat(), order["_id"])
+
+
+def decode_cursor(cursor):
+    value, last_id = catalog.decode_cursor(cursor)
+    try:
+        return datetime.fromisoformat(value), last_id
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def fetch_history(orders, user_email, cursor=None, limit=PAGE_SIZE):
+    """Return ``(summaries, next_cursor)`` for one page of ``user_email``'s orders.
+
+    Each summary has ``_id`` (as a string), ``date``, ``total``, ``status``
+    and ``item_count``. ``next_cursor`` is ``None`` on the last page.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    match = {"user_email": user_email}
+    if cursor:
+        date, last_id = decode_cursor(cursor)
+        match["$or"] = [{"date": {"$lt": date}}, {"date": date, "_id": {"$lt": last_id}}]
+
+    docs = list(orders.aggregate([
+        {"$match": match},
+        {"$sort": {"date": -1, "_id": -1}},
+        # One extra row tells us whether another page exists.
+        {"$limit": limit + 1},
+        {"$project": {"date": 1, "total": 1, "status": {"$ifNull": ["$status", order_pipeline.DEFAULT_STATUS]},
+                      "item_count": {"$size": {"$ifNull": ["$cart", []]}}}},
+    ]))
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1])
+    for doc in docs:
+        doc["_id"] = str(doc["_id"])
+    return docs, next_cursor
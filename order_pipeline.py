@@ -0,0 +1,250 @@
+"""Checkout as a queue: accept the order now, apply it in the background.
+
+``submit`` writes the priced order with ``status: "pending"`` and returns at
+once. The ``orders`` collection doubles as the job queue: a queued order
+carries ``queued_at`` (served by a partial index), and a worker ``claim``\\s
+the oldest one with a single ``find_one_and_update`` that takes a lease. The
+worker then reserves stock, marks the order ``completed`` and adds it to the
+sales rollups, or marks it ``failed`` and puts the lines back in the
+customer's current cart (the ``cart_id`` on their user document, since
+logging in again issues a new one) when stock has run out.
+
+Retries are safe at both ends:
+
+* each order has a per-user idempotency key under a unique index, so a
+  resubmitted checkout returns the order it already created;
+* every claim gets a fresh token, and the final write only applies while the
+  order still holds it, so a worker whose lease expired cannot finish an
+  order someone else has taken over. On a standalone server stock is
+  reserved under the claim token and the next claimer releases whatever a
+  previous claim left behind before trying again.
+
+With transactions the reservation, the status change and the rollups commit
+together. Without them a worker dying between completing an order and
+recording it leaves that order out of the live sales totals.
+
+``stock_changed``, if given, is called with the medicine IDs an order touched
+once a worker is done with it.
+
+Workers are threads started on first use in each process; run ``flask
+order-worker`` to process the queue from a dedicated process instead.
+"""
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import carts
+import inventory
+import stats
+
+log = logging.getLogger(__name__)
+
+PENDING = "pending"
+PROCESSING = "processing"
+COMPLETED = "completed"
+FAILED = "failed"
+# Orders placed before the pipeline have no status and were applied inline.
+DEFAULT_STATUS = COMPLETED
+COMPLETED_ORDERS = {"$or": [{"status": {"$exists": False}}, {"status": COMPLETED}]}
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 5.0
+
+
+class Superseded(Exception):
+    """The lease expired and another worker claimed the order."""
+
+
+def status_of(order):
+    return order.get("status", DEFAULT_STATUS)
+
+
+class OrderPipeline:
+    """Pending orders in ``db.orders``, processed by ``workers`` threads per process."""
+
+    def __init__(self, client, db, cart_store, workers=1, lease=30.0, poll=1.0, stock_changed=None):
+        self.client = client
+        self.db = db
+        self.orders = db["orders"]
+        self.medicines = db["medicines"]
+        self.cart_store = cart_store
+        self.workers = workers
+        self.lease = lease
+        self.poll = poll
+        self.stock_changed = stock_changed
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pid = None
+
+    # -- submitting --
+    def find(self, user_email, idempotency_key):
+        return self.orders.find_one({"user_email": user_email, "idempotency_key": idempotency_key})
+
+    def submit(self, order, idempotency_key, cart_id=None):
+        """Queue ``order``; returns ``(order, created)``.
+
+        ``created`` is False when ``idempotency_key`` was already used by this
+        customer, in which case the earlier order is returned unchanged.
+
+        The cart under ``cart_id`` is emptied before the order can be claimed,
+        so a worker that fails it straight away refills the cart instead of
+        having its refill cleared; the lines go back if no order is created.
+        """
+        doc = dict(order, status=PENDING, idempotency_key=idempotency_key,
+                   cart_id=cart_id, queued_at=datetime.now(), attempts=0)
+        if cart_id:
+            self.cart_store.clear(cart_id, carts.CART)
+        try:
+            doc["_id"] = self.orders.insert_one(doc).inserted_id
+        except DuplicateKeyError:
+            self._refill(cart_id, order["cart"])
+            existing = self.find(order["user_email"], idempotency_key)
+            if existing is None:
+                raise
+            return existing, False
+        except Exception:
+            self._refill(cart_id, order["cart"])
+            raise
+        self.start()
+        self._wake.set()
+        return doc, True
+
+    # -- processing --
+    def claim(self, now=None):
+        """Lease the oldest queued order, or return None when there is none.
+
+        The returned order carries its new ``claim`` token, and the token of
+        the claim it replaced (if any) as ``previous_claim``.
+        """
+        now = now or datetime.now()
+        token = uuid.uuid4().hex
+        job = self.orders.find_one_and_update(
+            {"queued_at": {"$exists": True},
+             "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]},
+            {"$set": {"status": PROCESSING, "claim": token, "lease_until": now + timedelta(seconds=self.lease)},
+             "$inc": {"attempts": 1}},
+            sort=[("queued_at", 1)],
+            return_document=ReturnDocument.BEFORE,
+        )
+        if job is None:
+            return None
+        job["previous_claim"] = job.get("claim")
+        job["claim"] = token
+        job["attempts"] = job.get("attempts", 0) + 1
+        return job
+
+    def _close(self, job, status, fields, session=None):
+        """Move a claimed order to its final ``status``; raises ``Superseded`` if it lost the claim."""
+        result = self.orders.update_one(
+            {"_id": job["_id"], "claim": job["claim"]},
+            {"$set": dict(fields, status=status),
+             "$unset": {"queued_at": "", "lease_until": "", "claim": ""}},
+            session=session,
+        )
+        if not result.matched_count:
+            raise Superseded(job["_id"])
+
+    def _fail(self, job, reason, message, **details):
+        self._close(job, FAILED, {"failed_at": datetime.now(),
+                                  "failure": dict(details, reason=reason, message=message)})
+
+    def process(self, job):
+        """Apply a claimed order. Returns its final status, or None if it was superseded or will be retried."""
+        quantities = inventory.collapse_cart(job["cart"])
+        transactional = inventory.supports_transactions(self.client)
+        try:
+            return self._apply(job, quantities, transactional)
+        except Superseded:
+            if not transactional:
+                inventory.release_stock(self.medicines, quantities, token=job["claim"])
+            log.info("Order %s was claimed by another worker", job["_id"])
+            return None
+        finally:
+            if self.stock_changed is not None:
+                self.stock_changed(list(quantities))
+
+    def _apply(self, job, quantities, transactional):
+        if not transactional and job["previous_claim"]:
+            inventory.release_stock(self.medicines, quantities, token=job["previous_claim"])
+        if job["attempts"] > MAX_ATTEMPTS:
+            self._fail(job, "error", "Order could not be processed")
+            self.restore_cart(job)
+            return FAILED
+
+        def finalize(txn):
+            inventory.reserve_stock(self.medicines, quantities, session=txn,
+                                    token=None if transactional else job["claim"])
+            self._close(job, COMPLETED, {"completed_at": datetime.now()}, session=txn)
+            stats.record_order(self.db, job, session=txn)
+
+        try:
+            inventory.run_in_transaction(self.client, finalize)
+        except inventory.OutOfStock as e:
+            self._fail(job, "out_of_stock", str(e), out_of_stock=e.items)
+            self.restore_cart(job)
+            return FAILED
+        except Superseded:
+            raise
+        except Exception:
+            log.exception("Order %s failed on attempt %d", job["_id"], job["attempts"])
+            # Leave the reservation for the next claim to release.
+            self.orders.update_one({"_id": job["_id"], "claim": job["claim"]},
+                                   {"$set": {"lease_until": datetime.now() + timedelta(seconds=RETRY_DELAY)}})
+            return None
+        if not transactional:
+            inventory.settle_reservation(self.medicines, quantities, job["claim"])
+        return COMPLETED
+
+    def restore_cart(self, job):
+        """Put a failed order's lines back in the customer's current cart."""
+        user = self.db["users"].find_one({"email": job["user_email"]}, {"cart_id": 1})
+        self._refill((user or {}).get("cart_id") or job.get("cart_id"), job["cart"])
+
+    def _refill(self, cart_id, cart):
+        if not cart_id:
+            return
+        for med_id, quantity in inventory.collapse_cart(cart).items():
+            self.cart_store.add(cart_id, carts.CART, med_id, quantity)
+
+    def run_once(self):
+        """Process one queued order; False when the queue was empty."""
+        job = self.claim()
+        if job is None:
+            return False
+        self.process(job)
+        return True
+
+    def run(self, stop=None):
+        """Work the queue until ``stop`` (an Event) is set."""
+        stop = stop or self._stop
+        while not stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                log.exception("Order worker error")
+            self._wake.wait(self.poll)
+            self._wake.clear()
+
+    # -- worker threads --
+    def start(self):
+        # Started on first use and per process, so gunicorn workers forked
+        # after import each run their own.
+        if not self.workers or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            for i in range(self.workers):
+                threading.Thread(target=self.run, args=(self._stop,), name=f"order-worker-{i}", daemon=True).start()
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
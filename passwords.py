@@ -0,0 +1,111 @@
+"""bcrypt hashing off the request thread.
+
+Hashes and checks run in a small process pool so a burst of logins cannot pin
+every web worker on bcrypt. The pool admits at most ``max_pending`` jobs;
+beyond that ``Overloaded`` is raised straight away so the route can answer 503
+instead of queueing requests behind seconds of hashing.
+
+The work factor is configurable. A successful check against a hash made with a
+different factor reports ``needs_rehash`` so callers can upgrade it in place.
+
+Pool workers are spawned rather than forked (the web process already runs
+driver threads), so like any spawn pool they re-import ``__main__``: scripts
+that hash passwords must keep their entry point under ``if __name__ ==
+"__main__"``.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+DEFAULT_ROUNDS = 12
+
+
+class Overloaded(Exception):
+    """The hashing pool is full or did not answer in time."""
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def _as_bytes(value):
+    return value.encode("utf-8") if isinstance(value, str) else bytes(value)
+
+
+def hash_rounds(hashed):
+    """Work factor of a ``$2b$12$...`` style hash."""
+    return int(_as_bytes(hashed)[4:6])
+
+
+class PasswordHasher:
+    """bcrypt through a bounded process pool; ``workers=0`` hashes inline."""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=2, max_pending=32, timeout=10.0):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._pool = None
+        self._pool_pid = None
+
+    def _executor(self):
+        # Created on first use and per process, so gunicorn workers forked
+        # after import each get their own pool.
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def _done(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise Overloaded("Password hashing queue is full")
+            self._pending += 1
+            try:
+                future = self._executor().submit(fn, *args)
+            except BrokenProcessPool:
+                self._pending -= 1
+                self._pool = None
+                raise Overloaded("Password hashing pool restarted")
+            except BaseException:
+                self._pending -= 1
+                raise
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise Overloaded("Password hashing timed out")
+        except BrokenProcessPool:
+            with self._lock:
+                self._pool = None
+            raise Overloaded("Password hashing pool restarted")
+
+    def hash(self, password):
+        return self._run(_hashpw, _as_bytes(password), self.rounds)
+
+    def check(self, password, hashed):
+        return self._run(_checkpw, _as_bytes(password), _as_bytes(hashed))
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self.rounds
+
+    def shutdown(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
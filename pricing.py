@@ -0,0 +1,81 @@
+"""Deal pricing shared by checkout, payment and the home page deal filter.
+
+Deals are compiled once into a category -> best deal lookup, so pricing a cart
+is O(items) no matter how many deals exist.
+
+Precedence: an item gets the highest discount among the deals for its own
+category and the deals for "All". When a category deal and an "All" deal offer
+the same percentage, the category deal is the one reported as applied.
+"""
+
+ALL_CATEGORIES = "All"
+
+
+def parse_discount(value):
+    """Parse "15%", "15" or 15 into a percentage in [0, 100].
+
+    Raises ``ValueError`` for anything else; deal writes call this so bad
+    input is rejected once instead of being skipped on every checkout.
+    """
+    if isinstance(value, str):
+        value = value.strip().rstrip("%").strip()
+    pct = float(value)
+    if not 0 <= pct <= 100:
+        raise ValueError(f"Discount must be between 0% and 100%, got {pct:g}%")
+    return pct
+
+
+def deal_discount(deal):
+    # Deals written before discounts were parsed on insert only carry the
+    # raw string.
+    if "discount_pct" in deal:
+        return deal["discount_pct"]
+    try:
+        return parse_discount(deal.get("discount", "0%"))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class DealBook:
+    def __init__(self, deals):
+        self._best = {}
+        for deal in deals:
+            category = deal.get("category", ALL_CATEGORIES)
+            pct = deal_discount(deal)
+            if pct > 0 and pct > self._best.get(category, (0.0, None))[0]:
+                self._best[category] = (pct, deal)
+        self._all = self._best.pop(ALL_CATEGORIES, (0.0, None))
+
+    def deal_for(self, category):
+        """Return ``(discount_percent, deal)``; ``(0.0, None)`` when nothing applies."""
+        specific = self._best.get(category)
+        if specific and specific[0] >= self._all[0]:
+            return specific
+        return self._all
+
+    def has_deal(self, category):
+        return self.deal_for(category)[1] is not None
+
+    def price_cart(self, items):
+        """Price cart lines carrying ``price``, ``category`` and optional ``quantity``.
+
+        Returns ``(lines, subtotal, total_savings)`` with one priced line per
+        input item; totals are rounded to cents.
+        """
+        lines = []
+        subtotal = 0.0
+        total_savings = 0.0
+        for item in items:
+            quantity = item.get("quantity", 1)
+            pct, deal = self.deal_for(item.get("category"))
+            original_price = float(item["price"])
+            final_price = original_price * (1 - pct / 100)
+            subtotal += final_price * quantity
+            total_savings += (original_price - final_price) * quantity
+            lines.append({
+                "id": item.get("id"), "name": item.get("name"), "image": item.get("image"),
+                "category": item.get("category"), "quantity": quantity,
+                "original_price": original_price, "final_price": final_price,
+                "discount_percent": pct, "applied_deal": deal,
+            })
+        return lines, round(subtotal, 2), round(total_savings, 2)
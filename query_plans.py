@@ -0,0 +1,252 @@
+"""Query-plan regression check.
+
+Each ``@check`` below reproduces the query shape of a route against a small
+seeded database and returns its ``explain`` output. ``run_checks`` fails any
+whose winning plan contains a COLLSCAN (or a ``$lookup`` that scans the foreign
+collection), so a new route or a dropped index cannot quietly bring back full
+scans. Run it with ``flask check-query-plans``.
+
+Whole-collection reads are scans by design and are not registered: the cached
+reference data loaders, the search index rebuild, the recommendations build,
+the reports snapshot and ``stats.catalog_kpis``.
+When adding a route, add a check for every query it filters or sorts on.
+"""
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+import catalog
+import order_history
+import recommendations
+import stock_levels
+from indexes import ensure_indexes
+
+SAMPLE_EMAIL = "user7@example.com"
+CATEGORIES = ("Pain", "Cold", "Vitamins", "Skin")
+
+CHECKS = []
+
+
+def check(name):
+    def register(fn):
+        CHECKS.append((name, fn))
+        return fn
+    return register
+
+
+def seed(db, n=500):
+    """Fill ``db`` with enough of every collection for the planner to choose indexes."""
+    now = datetime.now()
+    db.medicines.insert_many([
+        {"name": f"Medicine {i:04d}", "category": CATEGORIES[i % len(CATEGORIES)],
+         "price": float(i % 90) + 0.5, "quantity": i % 25, "sold": i * 7 % 300,
+         "description": "sample", "image": ""}
+        for i in range(n)
+    ])
+    db.users.insert_many([
+        {"owner_name": f"User {i}", "email": f"user{i}@example.com", "phone": "0", "role": "user"}
+        for i in range(n // 10)
+    ])
+    db.admins.insert_one({"name": "Admin", "email": "admin@example.com", "role": "admin"})
+    db.orders.insert_many([
+        {"user_email": f"user{i % (n // 10)}@example.com", "cart": [], "total": float(i % 40) + 1,
+         "date": now - timedelta(hours=i)}
+        for i in range(n)
+    ])
+    db.user_stats.insert_many([
+        {"_id": f"user{i}@example.com", "total_spent": float(i), "order_count": 1}
+        for i in range(n // 10)
+    ])
+    db.sales_rollups.insert_many([
+        {"_id": f"hour:{i}", "granularity": "hour", "bucket": now - timedelta(hours=i), "total": 1.0}
+        for i in range(n)
+    ])
+    stock_levels.rebuild(db, {})
+
+
+def _explain_command(db, command):
+    return db.command("explain", command, verbosity="queryPlanner")
+
+
+def _explain_count(db, collection, query):
+    # count_documents() runs as this pipeline.
+    return _explain_command(db, {"aggregate": collection, "cursor": {}, "pipeline": [
+        {"$match": query}, {"$group": {"_id": 1, "n": {"$sum": 1}}},
+    ]})
+
+
+def _explain_update(db, collection, query, update):
+    return _explain_command(db, {"update": collection, "updates": [{"q": query, "u": update}]})
+
+
+# ---- Auth / profile ----
+@check("register: users by email")
+def _users_by_email(db):
+    return db.users.find({"email": SAMPLE_EMAIL}).limit(1).explain()
+
+
+@check("login: admins and users by email")
+def _account_by_email(db):
+    return _explain_command(db, {"aggregate": "admins", "cursor": {}, "pipeline": [
+        {"$match": {"email": SAMPLE_EMAIL}},
+        {"$unionWith": {"coll": "users", "pipeline": [{"$match": {"email": SAMPLE_EMAIL}}]}},
+        {"$limit": 1},
+    ]})
+
+
+@check("update_profile: users by email")
+def _update_profile(db):
+    return _explain_update(db, "users", {"email": SAMPLE_EMAIL}, {"$set": {"phone": "1"}})
+
+
+# ---- Catalog ----
+@check("landing, dashboard_data: top sellers")
+def _top_sellers(db):
+    return db.medicines.find().sort("sold", -1).limit(8).explain()
+
+
+def _catalog_page_check(sort, category, price_range, paged):
+    def explain(db):
+        query = catalog.build_filter(category=category, price_range=price_range)
+        cursor = None
+        if paged:
+            field = catalog.SORTS[sort][0]
+            last = db.medicines.find_one({}, {field: 1})
+            cursor = catalog.encode_cursor(last[field], last["_id"])
+        return catalog.page_cursor(db.medicines, query, sort, cursor).explain()
+    return explain
+
+
+for _sort in catalog.SORTS:
+    for _category, _price_range in ((None, None), ("Pain", None), (None, "under10"), ("Cold", "10to50")):
+        for _paged in (False, True):
+            check(f"api/medicines: sort={_sort} category={_category} price={_price_range}"
+                  f"{' next page' if _paged else ''}")(_catalog_page_check(_sort, _category, _price_range, _paged))
+
+
+@check("api/search, checkout: medicines by id list")
+def _medicines_by_ids(db):
+    ids = [d["_id"] for d in db.medicines.find({}, {"_id": 1}).limit(5)]
+    return db.medicines.find({"_id": {"$in": ids}}, {"name": 1, "quantity": 1}).explain()
+
+
+@check("complete_payment: conditional stock reservation")
+def _reserve_stock(db):
+    return _explain_update(db, "medicines", {"_id": ObjectId(), "quantity": {"$gte": 1}},
+                           {"$inc": {"quantity": -1, "sold": 1}})
+
+
+@check("admin/medicines/import: upsert by _id")
+def _import_upsert(db):
+    return _explain_update(db, "medicines", {"_id": db.medicines.find_one({}, {"_id": 1})["_id"]},
+                           {"$set": {"quantity": 1}, "$setOnInsert": {"sold": 0}})
+
+
+# ---- Orders ----
+@check("receipt, user_receipts, api/orders: order history page")
+def _order_history(db):
+    last = db.orders.find_one({"user_email": SAMPLE_EMAIL})
+    return _explain_command(db, {"aggregate": "orders", "cursor": {}, "pipeline": [
+        {"$match": {"user_email": SAMPLE_EMAIL, "$or": [
+            {"date": {"$lt": last["date"]}}, {"date": last["date"], "_id": {"$lt": last["_id"]}},
+        ]}},
+        {"$sort": {"date": -1, "_id": -1}},
+        {"$limit": order_history.PAGE_SIZE + 1},
+    ]})
+
+
+@check("complete_payment: order by idempotency key")
+def _order_by_idempotency_key(db):
+    return db.orders.find({"user_email": SAMPLE_EMAIL, "idempotency_key": "retry"}).limit(1).explain()
+
+
+@check("order worker: claim the oldest queued order")
+def _claim_order(db):
+    now = datetime.now()
+    return _explain_command(db, {"findAndModify": "orders", "query": {
+        "queued_at": {"$exists": True},
+        "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}],
+    }, "sort": {"queued_at": 1}, "update": {"$set": {"lease_until": now}}})
+
+
+@check("api/recommendations: orders completed since the last refresh")
+def _orders_completed_since(db):
+    return recommendations.completed_since(db.orders, datetime.now() - timedelta(minutes=1)).explain()
+
+
+@check("receipt: order by id")
+def _order_by_id(db):
+    return db.orders.find({"_id": ObjectId()}).limit(1).explain()
+
+
+# ---- Dashboard ----
+@check("admin/low_stock: medicines needing restock")
+def _low_stock(db):
+    return db.medicines.find(
+        {"stock_status": {"$in": stock_levels.NEEDS_RESTOCK}, "category": CATEGORIES[0]}
+    ).sort([("quantity", 1), ("_id", 1)]).limit(stock_levels.PAGE_SIZE + 1).explain()
+
+
+@check("dashboard_data: sales rollups window")
+def _sales_window(db):
+    end = datetime.now()
+    return db.sales_rollups.find(
+        {"granularity": "hour", "bucket": {"$gte": end - timedelta(days=7), "$lte": end}}
+    ).explain()
+
+
+@check("dashboard_data: top customers")
+def _top_customers(db):
+    return _explain_command(db, {"aggregate": "user_stats", "cursor": {}, "pipeline": [
+        {"$sort": {"total_spent": -1, "_id": 1}},
+        {"$limit": 5},
+        {"$lookup": {"from": "users", "localField": "_id", "foreignField": "email", "as": "user"}},
+    ]})
+
+
+@check("dashboard, backfill-rollups: orders before recording started")
+def _orders_before(db):
+    return _explain_count(db, "orders", {"date": {"$lt": datetime.now() - timedelta(days=1)},
+                                         "status": {"$exists": False}})
+
+
+def _winning_plans(explain):
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                yield value
+            else:
+                yield from _winning_plans(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from _winning_plans(value)
+
+
+def _scans(plan):
+    """Stage names in ``plan`` that read a whole collection."""
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            yield "COLLSCAN"
+        if plan.get("stage") == "EQ_LOOKUP" and plan.get("strategy") == "NestedLoopJoin":
+            yield f"EQ_LOOKUP NestedLoopJoin on {plan.get('foreignCollection')}"
+        for value in plan.values():
+            yield from _scans(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _scans(value)
+
+
+def run_checks(db):
+    """Seed ``db``, ensure indexes and explain every check.
+
+    Returns ``[(name, problems)]`` where ``problems`` lists the scanning
+    stages found; an empty list means the query is fully indexed.
+    """
+    ensure_indexes(db)
+    seed(db)
+    results = []
+    for name, explain in CHECKS:
+        plan = explain(db)
+        problems = sorted({stage for winning in _winning_plans(plan) for stage in _scans(winning)})
+        results.append((name, problems))
+    return results
@@ -0,0 +1,42 @@
+"""In-memory token buckets for throttling by key (client IP, email, ...).
+
+State is per process, so with N gunicorn workers a key gets up to N times the
+configured rate; size limits with that in mind.
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """``capacity`` requests in a burst, refilled at ``rate`` per second."""
+
+    def __init__(self, rate, capacity, max_keys=100_000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key):
+        """Spend one token for ``key``.
+
+        Returns 0 when allowed, otherwise the seconds until a token is free.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return 0
+
+    def _prune(self, now):
+        # Buckets that have refilled completely hold no state worth keeping.
+        full = [key for key, (tokens, last) in self._buckets.items()
+                if tokens + (now - last) * self.rate >= self.capacity]
+        for key in full:
+            del self._buckets[key]
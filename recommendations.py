@@ -0,0 +1,324 @@
+"""Item-to-item recommendations from order history ("frequently bought together").
+
+Every completed order's cart is a basket. ``CoPurchaseIndex.build`` puts the
+baskets in a sparse order x medicine matrix ``X`` (SciPy CSR), takes the
+co-purchase counts ``C = X.T @ X`` and scores each pair by cosine similarity,
+``C[i, j] / sqrt(n_i * n_j)`` where ``n_i`` is the number of orders
+containing ``i``. The ``top_k`` neighbours of every medicine are kept in
+memory, so recommendations for a medicine are a dict lookup, and a
+customer's merge the neighbour lists of what they bought most recently.
+
+``add_orders`` folds newly completed orders in: their pairs go into a small
+delta on top of the matrix and only the medicines in those orders get their
+neighbour lists recomputed. Other medicines keep scores computed with
+slightly older counts until the next full build. The delta is merged into
+the matrix once it holds ``FOLD_PAIRS`` pairs.
+
+The build reads every order, so ``flask build-recommendations`` can run it
+offline and ``save`` a NumPy ``.npz`` snapshot; servers ``load`` the newest
+snapshot and catch up with the orders completed after its watermark
+(``refresh``).
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+from bson.objectid import ObjectId
+from scipy import sparse
+
+import order_pipeline
+
+log = logging.getLogger(__name__)
+
+TOP_K = 20
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 50
+# Most recently bought medicines a customer's recommendations start from.
+RECENT_ITEMS = 50
+FOLD_PAIRS = 100_000
+ORDER_FIELDS = {"cart.id": 1, "user_email": 1, "date": 1, "completed_at": 1}
+
+
+def basket(order):
+    """Distinct medicine IDs in ``order``'s cart, in cart order."""
+    return list(dict.fromkeys(item["id"] for item in order.get("cart", ()) if item.get("id")))
+
+
+def completed_orders(collection):
+    """Every completed order, oldest first."""
+    return collection.find(order_pipeline.COMPLETED_ORDERS, ORDER_FIELDS).sort("date", 1)
+
+
+def completed_since(collection, watermark):
+    """Orders completed at or after ``watermark`` (all pipeline orders when None), oldest first."""
+    query = {"completed_at": {"$gte": watermark} if watermark else {"$exists": True}}
+    return collection.find(query, ORDER_FIELDS).sort("completed_at", 1)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime if path else None
+    except FileNotFoundError:
+        return None
+
+
+class CoPurchaseIndex:
+    def __init__(self, top_k=TOP_K):
+        self.top_k = top_k
+        self._lock = threading.RLock()
+        self._ids = []               # column -> medicine ID
+        self._columns = {}           # medicine ID -> column
+        self._counts = np.zeros(0, dtype=np.int64)          # orders containing each medicine
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.int64)  # co-purchase counts, zero diagonal
+        self._delta = {}             # column -> Counter of columns, pairs not folded in yet
+        self._delta_pairs = 0
+        self._neighbours = {}        # medicine ID -> [(medicine ID, score)], best first
+        self._customers = {}         # email -> {medicine ID: None}, least recent first
+        self._at_watermark = set()   # IDs of the orders completed exactly at the watermark
+        self.watermark = None
+        self.orders = 0
+        self.built_at = 0.0
+        self.snapshot_mtime = None
+        self._refreshed_at = None
+        self._refreshing = False
+
+    def __len__(self):
+        return len(self._ids)
+
+    # ---------------- BUILD ----------------
+    def build(self, orders):
+        """Replace the index with one built from ``orders`` (oldest first)."""
+        fresh = CoPurchaseIndex(self.top_k)
+        rows, cols = [], []
+        for order in orders:
+            columns = fresh._columns_for(basket(order))
+            if not columns:
+                continue
+            rows.extend([fresh.orders] * len(columns))
+            cols.extend(columns)
+            fresh.orders += 1
+            fresh._remember(order)
+        baskets = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)),
+                                    shape=(fresh.orders, len(fresh._ids)))
+        matrix = (baskets.T @ baskets).tocsr()
+        fresh._counts = matrix.diagonal().astype(np.int64)
+        matrix.setdiag(0)
+        matrix.eliminate_zeros()
+        fresh._matrix = matrix
+        fresh._rank_all()
+        self._swap(fresh)
+
+    def _swap(self, fresh):
+        with self._lock:
+            self._ids, self._columns, self._counts = fresh._ids, fresh._columns, fresh._counts
+            self._matrix, self._delta, self._delta_pairs = fresh._matrix, fresh._delta, fresh._delta_pairs
+            self._neighbours, self._customers = fresh._neighbours, fresh._customers
+            self._at_watermark, self.watermark, self.orders = fresh._at_watermark, fresh.watermark, fresh.orders
+            self.built_at = time.monotonic()
+
+    def _columns_for(self, med_ids):
+        columns = []
+        for med_id in med_ids:
+            column = self._columns.get(med_id)
+            if column is None:
+                column = self._columns[med_id] = len(self._ids)
+                self._ids.append(med_id)
+            columns.append(column)
+        if len(self._ids) > len(self._counts):
+            self._counts = np.concatenate([self._counts, np.zeros(len(self._ids) - len(self._counts), np.int64)])
+        return columns
+
+    def _remember(self, order):
+        """Note the customer's purchases and move the watermark."""
+        bought = self._customers.setdefault(order.get("user_email"), {})
+        for med_id in basket(order):
+            bought.pop(med_id, None)
+            bought[med_id] = None
+        stamp = order.get("completed_at") or order.get("date")
+        if stamp is None:
+            return
+        if self.watermark is None or stamp > self.watermark:
+            self.watermark = stamp
+            self._at_watermark = {order["_id"]}
+        elif stamp == self.watermark:
+            self._at_watermark.add(order["_id"])
+
+    # ---------------- INCREMENTAL ----------------
+    def add_orders(self, orders):
+        """Fold in newly completed ``orders``; returns how many were new."""
+        added = 0
+        with self._lock:
+            touched = set()
+            for order in orders:
+                if order["_id"] in self._at_watermark:
+                    continue
+                columns = self._columns_for(basket(order))
+                self._remember(order)
+                if not columns:
+                    continue
+                self._counts[columns] += 1
+                for i in columns:
+                    row = self._delta.setdefault(i, Counter())
+                    for j in columns:
+                        if i != j:
+                            row[j] += 1
+                self._delta_pairs += len(columns) * (len(columns) - 1)
+                touched.update(columns)
+                self.orders += 1
+                added += 1
+            for i in touched:
+                self._neighbours[self._ids[i]] = self._rank(i)
+            if self._delta_pairs >= FOLD_PAIRS:
+                self._fold()
+        return added
+
+    def _fold(self):
+        if not self._delta:
+            return
+        rows, cols, counts = [], [], []
+        for i, row in self._delta.items():
+            rows.extend([i] * len(row))
+            cols.extend(row.keys())
+            counts.extend(row.values())
+        size = len(self._ids)
+        matrix = self._matrix.copy()
+        matrix.resize((size, size))
+        self._matrix = (matrix + sparse.csr_matrix((counts, (rows, cols)), shape=(size, size), dtype=np.int64)).tocsr()
+        self._delta, self._delta_pairs = {}, 0
+
+    # ---------------- SCORING ----------------
+    def _row(self, i):
+        """``(columns, counts)`` bought together with column ``i``, unfolded pairs included."""
+        if i < self._matrix.shape[0]:
+            start, end = self._matrix.indptr[i], self._matrix.indptr[i + 1]
+            cols, counts = self._matrix.indices[start:end], self._matrix.data[start:end]
+        else:
+            cols, counts = np.zeros(0, np.int64), np.zeros(0, np.int64)
+        delta = self._delta.get(i)
+        if delta:
+            cols = np.concatenate([cols, np.fromiter(delta.keys(), np.int64, len(delta))])
+            counts = np.concatenate([counts, np.fromiter(delta.values(), np.int64, len(delta))])
+            cols, inverse = np.unique(cols, return_inverse=True)
+            counts = np.bincount(inverse, weights=counts).astype(np.int64)
+        return cols, counts
+
+    def _rank(self, i):
+        cols, counts = self._row(i)
+        if not len(cols):
+            return []
+        scores = counts / np.sqrt(self._counts[i] * self._counts[cols])
+        if len(scores) > self.top_k:
+            best = np.argpartition(-scores, self.top_k - 1)[:self.top_k]
+            cols, scores = cols[best], scores[best]
+        order = np.lexsort((cols, -scores))
+        return [(self._ids[c], round(float(s), 4)) for c, s in zip(cols[order], scores[order])]
+
+    def _rank_all(self):
+        self._neighbours = {med_id: self._rank(i) for i, med_id in enumerate(self._ids)}
+
+    # ---------------- QUERIES ----------------
+    def similar(self, med_ids, limit=DEFAULT_LIMIT, exclude=()):
+        """Medicines bought together with ``med_ids``, best first, as ``[(med_id, score)]``."""
+        skip = set(med_ids).union(exclude)
+        if len(med_ids) == 1:
+            return [pair for pair in self._neighbours.get(med_ids[0], ()) if pair[0] not in skip][:limit]
+        scores = {}
+        for med_id in med_ids:
+            for other, score in self._neighbours.get(med_id, ()):
+                scores[other] = scores.get(other, 0.0) + score
+        best = heapq.nlargest(limit, ((score, other) for other, score in scores.items() if other not in skip))
+        return [(other, round(score, 4)) for score, other in best]
+
+    def for_customer(self, email, limit=DEFAULT_LIMIT):
+        """Picks for a customer from what they bought recently, leaving out anything they already bought."""
+        bought = self._customers.get(email)
+        if not bought:
+            return []
+        bought = list(bought)
+        return self.similar(bought[-RECENT_ITEMS:], limit, exclude=bought)
+
+    # ---------------- SNAPSHOTS ----------------
+    def save(self, path):
+        """Write the index to ``path`` as an ``.npz``, replacing any previous snapshot atomically."""
+        with self._lock:
+            self._fold()
+            emails = list(self._customers)
+            bought = [[self._columns[med_id] for med_id in self._customers[email]] for email in emails]
+            arrays = {
+                "ids": np.array(self._ids, dtype=str),
+                "counts": self._counts,
+                "data": self._matrix.data, "indices": self._matrix.indices, "indptr": self._matrix.indptr,
+                "emails": np.array(emails, dtype=str),
+                "bought": np.array([c for columns in bought for c in columns], dtype=np.int64),
+                "bought_indptr": np.cumsum([0] + [len(columns) for columns in bought], dtype=np.int64),
+                "watermark": np.array(self.watermark.isoformat() if self.watermark else ""),
+                "at_watermark": np.array([str(_id) for _id in self._at_watermark], dtype=str),
+                "orders": np.array(self.orders),
+            }
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        """Replace the index with the snapshot at ``path``."""
+        mtime = _mtime(path)
+        fresh = CoPurchaseIndex(self.top_k)
+        with np.load(path, allow_pickle=False) as snapshot:
+            fresh._ids = snapshot["ids"].tolist()
+            fresh._columns = {med_id: i for i, med_id in enumerate(fresh._ids)}
+            fresh._counts = snapshot["counts"]
+            size = len(fresh._ids)
+            fresh._matrix = sparse.csr_matrix((snapshot["data"], snapshot["indices"], snapshot["indptr"]),
+                                              shape=(size, size))
+            bought, bought_indptr = snapshot["bought"].tolist(), snapshot["bought_indptr"].tolist()
+            fresh._customers = {
+                email: dict.fromkeys(fresh._ids[c] for c in bought[bought_indptr[n]:bought_indptr[n + 1]])
+                for n, email in enumerate(snapshot["emails"].tolist())
+            }
+            watermark = str(snapshot["watermark"])
+            fresh.watermark = datetime.fromisoformat(watermark) if watermark else None
+            fresh._at_watermark = {ObjectId(_id) for _id in snapshot["at_watermark"].tolist()}
+            fresh.orders = int(snapshot["orders"])
+        fresh._rank_all()
+        self._swap(fresh)
+        self.snapshot_mtime = mtime
+
+    # ---------------- REFRESH ----------------
+    def refresh(self, collection, path=None):
+        """Load a newer snapshot from ``path`` (or build from ``collection`` the first time), then catch up."""
+        mtime = _mtime(path)
+        if mtime is not None and mtime != self.snapshot_mtime:
+            self.load(path)
+        elif not self.built_at:
+            self.build(completed_orders(collection))
+        self.add_orders(completed_since(collection, self.watermark))
+        self._refreshed_at = time.monotonic()
+
+    def refresh_async(self, collection, max_age, path=None):
+        """``refresh`` on a background thread, at most once every ``max_age`` seconds.
+
+        Until the first refresh finishes the index is empty and queries
+        return no recommendations.
+        """
+        with self._lock:
+            if self._refreshing or (self._refreshed_at is not None
+                                    and time.monotonic() - self._refreshed_at < max_age):
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh(collection, path)
+            except Exception:
+                log.exception("Recommendations refresh failed")
+                self._refreshed_at = time.monotonic()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,385 @@
+"""Sales reports from a columnar snapshot, so reporting never queries the live orders.
+
+``write_snapshot`` streams completed orders (oldest first) and the catalog
+into a directory of NumPy ``.npy`` files, one per column:
+
+* ``orders``: ``date`` (datetime64[s]), ``customer``, ``total`` (what was
+  paid), ``gross`` (before deals), ``units`` and ``lines``
+* ``lines``, one row per cart line: ``order`` (row in ``orders``),
+  ``medicine``, ``category``, ``quantity``, ``price`` (list price),
+  ``discount`` (amount taken off the line) and ``deal`` (-1 for none)
+* the strings those integer codes stand for (``customers``, ``medicines``,
+  ``medicine_names``, ``categories``, ``deals``, ``deal_titles``) and a
+  ``manifest.json``
+
+Each snapshot is a timestamped directory under one root; ``CURRENT`` names
+the newest and is only replaced once a snapshot is complete. ``Reports``
+memory-maps the current snapshot (``np.load(mmap_mode="r")``) and reopens it
+when ``CURRENT`` changes, so workers share the page cache instead of each
+holding a copy. Both tables are in date order, so a date window is a
+``searchsorted`` slice, and the reports are ``bincount``/``unique`` over
+those slices.
+
+Checkout records the deal each line was priced under; savings on orders
+placed before it did are reported as unattributed.
+"""
+import json
+import os
+import shutil
+import threading
+from array import array
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import order_pipeline
+
+ORDER_FIELDS = {"user_email": 1, "date": 1, "total": 1, "cart.id": 1, "cart.price": 1, "cart.category": 1,
+                "cart.quantity": 1, "cart.discount_percent": 1, "cart.deal_id": 1, "cart.deal": 1}
+MEDICINE_FIELDS = {"name": 1, "category": 1}
+ORDER_COLUMNS = {"date": "q", "customer": "i", "total": "d", "gross": "d", "units": "i", "lines": "i"}
+LINE_COLUMNS = {"order": "i", "medicine": "i", "category": "i", "quantity": "i", "price": "d", "discount": "d",
+                "deal": "i"}
+DICTIONARIES = ("customers", "medicines", "medicine_names", "categories", "deals", "deal_titles")
+CURRENT = "CURRENT"
+KEEP_SNAPSHOTS = 2
+BATCH_SIZE = 2000
+UNCATEGORIZED = "Uncategorized"
+# Units per order: 1, 2, 3, 4, 5, 6-10, 11+
+BASKET_EDGES = [2, 3, 4, 5, 6, 11]
+BASKET_LABELS = ["1", "2", "3", "4", "5", "6-10", "11+"]
+COHORT_MONTHS = 12
+MAX_COHORT_MONTHS = 36
+_EPOCH = datetime(1970, 1, 1)
+
+
+def completed_orders(collection):
+    """Completed orders, oldest first, with the fields a snapshot keeps."""
+    return collection.find(order_pipeline.COMPLETED_ORDERS, ORDER_FIELDS).sort("date", 1).batch_size(BATCH_SIZE)
+
+
+def parse_day(value):
+    """``YYYY-MM-DD`` -> datetime; None for a missing value."""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+
+
+class _Codes:
+    """Interns values as consecutive integer codes."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def __call__(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+# ---------------- WRITING ----------------
+def write_snapshot(root, orders, medicines, now=None):
+    """Write ``orders`` (completed, oldest first) and ``medicines`` as the new current snapshot.
+
+    Returns the snapshot's manifest. Older snapshots beyond
+    ``KEEP_SNAPSHOTS`` are removed.
+    """
+    now = now or datetime.now()
+    customers, meds, categories, deals = _Codes(), _Codes(), _Codes(), _Codes()
+    names, med_category, deal_titles = {}, {}, {}
+    for doc in medicines:
+        med_id = str(doc["_id"])
+        meds(med_id)
+        names[med_id] = doc.get("name", "")
+        med_category[med_id] = doc.get("category") or UNCATEGORIZED
+
+    columns = {f"orders.{name}": array(code) for name, code in ORDER_COLUMNS.items()}
+    columns.update({f"lines.{name}": array(code) for name, code in LINE_COLUMNS.items()})
+    o = {name: columns[f"orders.{name}"] for name in ORDER_COLUMNS}
+    line = {name: columns[f"lines.{name}"] for name in LINE_COLUMNS}
+    last = None
+    for order in orders:
+        stamp = int((order["date"] - _EPOCH).total_seconds())
+        if last is not None and stamp < last:
+            raise ValueError("orders must be passed oldest first")
+        last = stamp
+        row = len(o["date"])
+        gross, units, cart = 0.0, 0, order.get("cart") or []
+        for item in cart:
+            med_id = str(item.get("id"))
+            quantity = int(item.get("quantity", 1))
+            price = float(item.get("price", 0))
+            line["order"].append(row)
+            line["medicine"].append(meds(med_id))
+            line["category"].append(categories(item.get("category") or med_category.get(med_id) or UNCATEGORIZED))
+            line["quantity"].append(quantity)
+            line["price"].append(price)
+            line["discount"].append(price * quantity * float(item.get("discount_percent") or 0) / 100)
+            deal_id = item.get("deal_id")
+            if deal_id:
+                deal_titles[deal_id] = item.get("deal") or deal_id
+            line["deal"].append(deals(deal_id) if deal_id else -1)
+            gross += price * quantity
+            units += quantity
+        o["date"].append(stamp)
+        o["customer"].append(customers(order.get("user_email") or ""))
+        o["total"].append(float(order.get("total", 0)))
+        o["gross"].append(gross)
+        o["units"].append(units)
+        o["lines"].append(len(cart))
+
+    name = now.strftime("%Y%m%dT%H%M%S%f")
+    path = os.path.join(root, name)
+    os.makedirs(path)
+    for column, values in columns.items():
+        data = np.frombuffer(values, dtype=values.typecode) if len(values) else np.zeros(0, values.typecode)
+        if column == "orders.date":
+            data = data.view("datetime64[s]")
+        np.save(os.path.join(path, f"{column}.npy"), data)
+    strings = {
+        "customers": customers.values, "medicines": meds.values,
+        "medicine_names": [names.get(med_id, "") for med_id in meds.values],
+        "categories": categories.values, "deals": deals.values,
+        "deal_titles": [deal_titles[deal_id] for deal_id in deals.values],
+    }
+    for column, values in strings.items():
+        np.save(os.path.join(path, f"{column}.npy"), np.array(values, dtype=str))
+    dates = o["date"]
+    manifest = {
+        "name": name, "created_at": now.isoformat(timespec="seconds"),
+        "orders": len(dates), "lines": len(line["order"]),
+        "first_order": (_EPOCH + timedelta(seconds=dates[0])).isoformat() if dates else None,
+        "last_order": (_EPOCH + timedelta(seconds=dates[-1])).isoformat() if dates else None,
+    }
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+    tmp = os.path.join(root, f"{CURRENT}.tmp")
+    with open(tmp, "w") as f:
+        f.write(name)
+    os.replace(tmp, os.path.join(root, CURRENT))
+    _prune(root, name)
+    return manifest
+
+
+def _prune(root, current):
+    snapshots = sorted(entry for entry in os.listdir(root)
+                       if entry != current and os.path.isdir(os.path.join(root, entry)))
+    # Readers that still have an older snapshot mapped keep their pages
+    # after it is deleted.
+    for entry in snapshots[:max(0, len(snapshots) - (KEEP_SNAPSHOTS - 1))]:
+        shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+
+# ---------------- READING ----------------
+def _load(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # Empty columns cannot be memory-mapped
+        return np.load(path)
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.name = self.manifest["name"]
+        self.orders = {name: _load(os.path.join(path, f"orders.{name}.npy")) for name in ORDER_COLUMNS}
+        self.lines = {name: _load(os.path.join(path, f"lines.{name}.npy")) for name in LINE_COLUMNS}
+        for name in DICTIONARIES:
+            setattr(self, name, _load(os.path.join(path, f"{name}.npy")))
+
+    def __len__(self):
+        return len(self.orders["date"])
+
+    def rows(self, start=None, end=None):
+        """``(orders, lines)`` slices covering orders placed from ``start`` through the day ``end``."""
+        dates = self.orders["date"]
+        lo = int(np.searchsorted(dates, np.datetime64(start, "s"))) if start else 0
+        hi = int(np.searchsorted(dates, np.datetime64(end + timedelta(days=1), "s"))) if end else len(dates)
+        line_orders = self.lines["order"]
+        return slice(lo, hi), slice(int(np.searchsorted(line_orders, lo)), int(np.searchsorted(line_orders, hi)))
+
+
+class Reports:
+    """The current snapshot under ``root``, reopened whenever a newer one is written."""
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def current(self):
+        """The current ``Snapshot``, or None before the first one is written."""
+        try:
+            with open(os.path.join(self.root, CURRENT)) as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.name != name:
+            with self._lock:
+                if self._snapshot is None or self._snapshot.name != name:
+                    self._snapshot = Snapshot(os.path.join(self.root, name))
+                snapshot = self._snapshot
+        return snapshot
+
+
+# ---------------- REPORTS ----------------
+def _money(value):
+    return round(float(value), 2)
+
+
+def _distinct_orders(groups, orders, size):
+    """Orders per group, counting an order once however many of its lines fall in the group."""
+    # Lines are in order, so order-major keys are nearly sorted already and
+    # a stable (merge) sort is far cheaper than np.unique's
+    size = max(size, 1)
+    keys = np.sort(orders.astype(np.int64) * size + groups, kind="stable")
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return np.bincount(keys[first] % size, minlength=size)
+
+
+def category_revenue(snapshot, start=None, end=None):
+    """Revenue, units, orders and revenue share per category, highest revenue first."""
+    _, lines = snapshot.rows(start, end)
+    category = snapshot.lines["category"][lines]
+    quantity = snapshot.lines["quantity"][lines]
+    net = snapshot.lines["price"][lines] * quantity - snapshot.lines["discount"][lines]
+    size = len(snapshot.categories)
+    revenue = np.bincount(category, weights=net, minlength=size)
+    units = np.bincount(category, weights=quantity, minlength=size)
+    orders = _distinct_orders(category, snapshot.lines["order"][lines], size)
+    total = revenue.sum()
+    return {
+        "revenue": _money(total),
+        "categories": [{"category": str(snapshot.categories[i]), "revenue": _money(revenue[i]),
+                        "units": int(units[i]), "orders": int(orders[i]),
+                        "share": round(float(revenue[i] / total), 4) if total else 0.0}
+                       for i in np.argsort(-revenue, kind="stable") if units[i]],
+    }
+
+
+def basket_size(snapshot, start=None, end=None):
+    """Units and lines per order, with order count and average value per basket size."""
+    orders, _ = snapshot.rows(start, end)
+    units = snapshot.orders["units"][orders]
+    totals = snapshot.orders["total"][orders]
+    bucket = np.digitize(units, BASKET_EDGES)
+    counts = np.bincount(bucket, minlength=len(BASKET_LABELS))
+    value = np.bincount(bucket, weights=totals, minlength=len(BASKET_LABELS))
+    if not len(units):
+        return {"orders": 0, "buckets": []}
+    return {
+        "orders": len(units),
+        "mean_units": round(float(units.mean()), 2),
+        "median_units": float(np.median(units)),
+        "p90_units": float(np.percentile(units, 90)),
+        "mean_lines": round(float(snapshot.orders["lines"][orders].mean()), 2),
+        "average_order_value": _money(totals.mean()),
+        "buckets": [{"units": label, "orders": int(counts[i]), "share": round(float(counts[i] / len(units)), 4),
+                     "average_order_value": _money(value[i] / counts[i]) if counts[i] else 0.0}
+                    for i, label in enumerate(BASKET_LABELS)],
+    }
+
+
+def discount_impact(snapshot, start=None, end=None):
+    """Per deal: orders, units, list value, discount given and revenue; and orders with vs without a deal."""
+    orders, lines = snapshot.rows(start, end)
+    deal = snapshot.lines["deal"][lines]
+    applied = deal >= 0
+    deal = deal[applied]
+    line_orders = snapshot.lines["order"][lines][applied]
+    quantity = snapshot.lines["quantity"][lines][applied]
+    gross = snapshot.lines["price"][lines][applied] * quantity
+    discount = snapshot.lines["discount"][lines][applied]
+    size = len(snapshot.deals)
+    deal_gross = np.bincount(deal, weights=gross, minlength=size)
+    deal_discount = np.bincount(deal, weights=discount, minlength=size)
+    deal_units = np.bincount(deal, weights=quantity, minlength=size)
+    deal_orders = _distinct_orders(deal, line_orders, size)
+
+    totals = snapshot.orders["total"][orders]
+    units = snapshot.orders["units"][orders]
+    with_deal = np.zeros(len(totals), dtype=bool)
+    with_deal[line_orders - orders.start] = True
+    all_savings = float((snapshot.orders["gross"][orders] - totals).sum())
+
+    def group(mask):
+        count = int(mask.sum())
+        return {"orders": count,
+                "average_order_value": _money(totals[mask].mean()) if count else 0.0,
+                "mean_units": round(float(units[mask].mean()), 2) if count else 0.0}
+
+    return {
+        "discount": _money(deal_discount.sum()),
+        # Savings on orders placed before checkout recorded the deal per line
+        "unattributed_discount": _money(max(0.0, all_savings - deal_discount.sum())),
+        "with_deal": group(with_deal),
+        "without_deal": group(~with_deal),
+        "deals": [{"deal_id": str(snapshot.deals[i]), "deal": str(snapshot.deal_titles[i]),
+                   "orders": int(deal_orders[i]), "units": int(deal_units[i]), "gross": _money(deal_gross[i]),
+                   "discount": _money(deal_discount[i]), "revenue": _money(deal_gross[i] - deal_discount[i]),
+                   "discount_rate": round(float(deal_discount[i] / deal_gross[i]), 4) if deal_gross[i] else 0.0}
+                  for i in np.argsort(-deal_discount, kind="stable") if deal_units[i]],
+    }
+
+
+def cohorts(snapshot, start=None, end=None, months=COHORT_MONTHS):
+    """Monthly cohorts by first order: size, then share of customers ordering and revenue per month since.
+
+    ``start`` and ``end`` pick which cohorts to show; first orders are
+    always taken from the whole snapshot.
+    """
+    months = max(1, min(int(months), MAX_COHORT_MONTHS))
+    if not len(snapshot):
+        return {"months": months, "cohorts": []}
+    month = snapshot.orders["date"].astype("datetime64[M]").astype(np.int64)
+    customer = snapshot.orders["customer"][:]
+    # Orders are in date order, so a customer's first row is their first order
+    seen, first_row = np.unique(customer, return_index=True)
+    first = np.zeros(len(snapshot.customers), dtype=np.int64)
+    first[seen] = month[first_row]
+    cohort = first[customer]
+    offset = month - cohort
+    keep = offset < months
+    if start:
+        keep &= cohort >= np.datetime64(start, "M").astype(np.int64)
+    if end:
+        keep &= cohort <= np.datetime64(end, "M").astype(np.int64)
+    if not keep.any():
+        return {"months": months, "cohorts": []}
+    cohort, offset, customer = cohort[keep], offset[keep], customer[keep]
+    base = int(cohort.min())
+    span = int(cohort.max()) - base + 1
+    cell = (cohort - base) * months + offset
+    active = np.bincount(np.unique(cell * len(snapshot.customers) + customer) // len(snapshot.customers),
+                         minlength=span * months).reshape(span, months)
+    revenue = np.bincount(cell, weights=snapshot.orders["total"][keep], minlength=span * months).reshape(span, months)
+    last = int(month[-1])
+    rows = []
+    for c in range(span):
+        size = int(active[c, 0])
+        if not size:
+            continue
+        observed = min(months, last - (base + c) + 1)
+        rows.append({"cohort": str(np.datetime64(base + c, "M")), "customers": size,
+                     "retention": [round(float(n / size), 4) for n in active[c, :observed]],
+                     "revenue": [_money(value) for value in revenue[c, :observed]]})
+    return {"months": months, "cohorts": rows}
+
+
+REPORTS = {
+    "category_revenue": category_revenue,
+    "basket_size": basket_size,
+    "discounts": discount_impact,
+    "cohorts": cohorts,
+}
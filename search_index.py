@@ -0,0 +1,230 @@
+"""In-process inverted index over the medicine catalog.
+
+Built once from the ``medicines`` collection and kept current by the admin
+write routes, so search and typeahead never touch Mongo.
+
+* ``tokens``   full words from name, category and description -> ids
+* ``prefixes`` leading 1..MAX_PREFIX characters of name/category words -> ids,
+  used for the word the user is still typing
+* ``trigrams`` character trigrams -> name/category words, used to fall back
+  to close spellings when a word matches nothing
+
+Results are ordered by popularity (``sold`` at index time, then name).
+"""
+import re
+import threading
+import time
+from collections import Counter
+from heapq import nlargest, nsmallest
+from itertools import chain
+
+MAX_PREFIX = 8
+# Fraction of trigrams a vocabulary word must share with a misspelt query word.
+FUZZY_THRESHOLD = 0.4
+# Closest vocabulary words a misspelt word expands to.
+FUZZY_WORDS = 5
+FUZZY_CACHE_SIZE = 4096
+FUZZY_MIN_COMMON = 256
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Fields kept per document so hits can be returned without a database read.
+HIT_FIELDS = ("name", "category", "price", "image")
+
+
+def tokenize(text):
+    return _WORD_RE.findall(str(text or "").lower())
+
+
+def _trigrams(word):
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs = {}       # id -> hit dict
+        self._doc_words = {}  # id -> (all words, name/category words)
+        self._rank = {}       # id -> sort key
+        self._tokens = {}
+        self._prefixes = {}
+        self._trigrams = {}
+        self._head_counts = {}  # name/category word -> number of docs using it
+        self._fuzzy_cache = {}
+        self._ranked = None   # ids in rank order, rebuilt lazily
+        self._refreshing = False
+        self._build_lock = threading.Lock()
+        self.built_at = 0.0
+
+    def __len__(self):
+        return len(self._docs)
+
+    # ---------------- BUILD / MAINTAIN ----------------
+    def rebuild(self, docs):
+        fresh = SearchIndex()
+        for doc in docs:
+            fresh._add(doc)
+        with self._lock:
+            self._docs, self._doc_words, self._rank = fresh._docs, fresh._doc_words, fresh._rank
+            self._tokens, self._prefixes, self._trigrams = fresh._tokens, fresh._prefixes, fresh._trigrams
+            self._head_counts = fresh._head_counts
+            self._fuzzy_cache = {}
+            self._ranked = None
+            self.built_at = time.monotonic()
+
+    def ensure_built(self, load_docs):
+        """Build from ``load_docs()`` if this index has never been built; concurrent callers wait for it."""
+        if self.built_at:
+            return
+        with self._build_lock:
+            if not self.built_at:
+                self.rebuild(load_docs())
+
+    def refresh_async(self, load_docs, max_age):
+        """Rebuild from ``load_docs()`` on a background thread once older than ``max_age`` seconds.
+
+        Writes made through another worker process only reach this process's
+        index through these periodic rebuilds.
+        """
+        with self._lock:
+            if self._refreshing or time.monotonic() - self.built_at < max_age:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.rebuild(load_docs())
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def upsert(self, doc):
+        """Index ``doc`` (must carry ``_id``), replacing any previous version."""
+        with self._lock:
+            _id = str(doc["_id"])
+            if "sold" not in doc and _id in self._rank:
+                doc = dict(doc, sold=-self._rank[_id][0])
+            self._remove(_id)
+            self._add(doc)
+            self._fuzzy_cache.clear()
+
+    def remove(self, _id):
+        with self._lock:
+            self._remove(str(_id))
+            self._fuzzy_cache.clear()
+
+    def _add(self, doc):
+        _id = str(doc["_id"])
+        head_words = set(tokenize(doc.get("name"))) | set(tokenize(doc.get("category")))
+        all_words = head_words | set(tokenize(doc.get("description")))
+
+        self._docs[_id] = {"_id": _id, **{f: doc.get(f) for f in HIT_FIELDS}}
+        self._doc_words[_id] = (all_words, head_words)
+        self._rank[_id] = (-(doc.get("sold") or 0), str(doc.get("name", "")).lower())
+        for word in all_words:
+            self._tokens.setdefault(word, set()).add(_id)
+        for word in head_words:
+            for i in range(1, min(len(word), MAX_PREFIX) + 1):
+                self._prefixes.setdefault(word[:i], set()).add(_id)
+            if word not in self._head_counts:
+                self._head_counts[word] = 0
+                for gram in _trigrams(word):
+                    self._trigrams.setdefault(gram, set()).add(word)
+            self._head_counts[word] += 1
+        self._ranked = None
+
+    def _remove(self, _id):
+        if _id not in self._docs:
+            return
+        all_words, head_words = self._doc_words.pop(_id)
+        for word in all_words:
+            postings = self._tokens[word]
+            postings.discard(_id)
+            if not postings:
+                del self._tokens[word]
+        for word in head_words:
+            for i in range(1, min(len(word), MAX_PREFIX) + 1):
+                postings = self._prefixes[word[:i]]
+                postings.discard(_id)
+                if not postings:
+                    del self._prefixes[word[:i]]
+            self._head_counts[word] -= 1
+            if not self._head_counts[word]:
+                del self._head_counts[word]
+                for gram in _trigrams(word):
+                    self._trigrams[gram].discard(word)
+                    if not self._trigrams[gram]:
+                        del self._trigrams[gram]
+        del self._docs[_id]
+        del self._rank[_id]
+        self._ranked = None
+
+    # ---------------- QUERY ----------------
+    def _prefix_matches(self, prefix):
+        ids = self._prefixes.get(prefix[:MAX_PREFIX], set())
+        if len(prefix) <= MAX_PREFIX:
+            return ids
+        return {i for i in ids if any(w.startswith(prefix) for w in self._doc_words[i][1])}
+
+    def _fuzzy_matches(self, word):
+        if len(word) < 4:
+            return set()
+        if word in self._fuzzy_cache:
+            return self._fuzzy_cache[word]
+        grams = _trigrams(word)
+        # Trigrams shared by a large slice of the vocabulary say little about
+        # which word was meant and dominate the counting cost, so skip them.
+        common = max(FUZZY_MIN_COMMON, len(self._head_counts) // 100)
+        postings = [p for p in (self._trigrams.get(g, ()) for g in grams) if len(p) <= common]
+        shared = Counter(chain.from_iterable(postings))
+        scored = []
+        # Only the words sharing the most trigrams can be the closest matches.
+        for candidate, n in shared.most_common(FUZZY_WORDS * 4):
+            # A padded word of length L has at most L distinct trigrams.
+            score = n / (len(grams) + len(candidate) - n)
+            if score >= FUZZY_THRESHOLD:
+                scored.append((score, candidate))
+        ids = set()
+        for _, candidate in nlargest(FUZZY_WORDS, scored):
+            ids |= self._tokens[candidate]
+        if len(self._fuzzy_cache) >= FUZZY_CACHE_SIZE:
+            self._fuzzy_cache.clear()
+        self._fuzzy_cache[word] = ids
+        return ids
+
+    def _word_matches(self, word, as_prefix):
+        ids = self._prefix_matches(word) if as_prefix else self._tokens.get(word, set())
+        return ids or self._fuzzy_matches(word)
+
+    def _top(self, candidates, limit):
+        # Large candidate sets: walk the global ranking until `limit` hits are
+        # found, which takes about limit * N / len(candidates) steps. Small
+        # sets: sort them directly.
+        if len(candidates) ** 2 * 4 > limit * len(self._docs):
+            if self._ranked is None:
+                self._ranked = sorted(self._rank, key=self._rank.__getitem__)
+            hits = []
+            for _id in self._ranked:
+                if _id in candidates:
+                    hits.append(_id)
+                    if len(hits) == limit:
+                        break
+            return hits
+        return nsmallest(limit, candidates, key=self._rank.__getitem__)
+
+    def search(self, query, limit=10, prefix=True):
+        """Return up to ``limit`` hits whose words contain every query word.
+
+        With ``prefix`` the last word matches as a prefix (typeahead);
+        otherwise every word must match a whole indexed word.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        with self._lock:
+            sets = [self._word_matches(w, prefix and i == len(words) - 1) for i, w in enumerate(words)]
+            sets.sort(key=len)
+            candidates = sets[0].intersection(*sets[1:]) if len(sets) > 1 else sets[0]
+            return [dict(self._docs[_id]) for _id in self._top(candidates, limit)]
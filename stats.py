@@ -0,0 +1,252 @@
+"""Dashboard statistics that stay cheap as the catalog and order history grow.
+
+Every order insert also updates, via ``record_order``:
+
+* a store-wide revenue counter in ``counters``;
+* daily and hourly buckets in ``sales_rollups``, read by the sales chart;
+* a per-customer spend/order-count summary in ``user_stats``, read by the
+  top-customers leaderboard.
+
+Orders queued through ``order_pipeline`` are recorded when a worker
+completes them, not when they are placed.
+
+Recording started at the counter's ``since`` timestamp. Orders placed before
+that are folded in once: the revenue counter on its first read, the rollups
+and customer summaries by ``backfill_rollups`` (``flask backfill-rollups``),
+which writes to separate ``backfilled_*`` fields so it is idempotent and never
+races live increments.
+"""
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+REVENUE_ID = "revenue"
+ROLLUP_WINDOWS = (7, 30, 90, 365)
+# Hourly points are only offered for short windows to keep charts readable.
+MAX_HOURLY_DAYS = 7
+MAX_LEADERBOARD = 100
+
+
+# Stock alert counts are kept by stock_levels.
+KPI_FIELDS = ("total_medicines", "total_sales")
+
+
+def catalog_kpis_pipeline():
+    return [
+        {"$project": {"sold": 1}},
+        {"$group": {
+            "_id": None,
+            "total_medicines": {"$sum": 1},
+            "total_sales": {"$sum": {"$ifNull": ["$sold", 0]}},
+        }},
+    ]
+
+
+def kpis_from(result):
+    result = result or {}
+    return {key: result.get(key, 0) for key in KPI_FIELDS}
+
+
+def catalog_kpis(medicines):
+    """Medicine count and units sold in a single pass."""
+    return kpis_from(next(medicines.aggregate(catalog_kpis_pipeline()), None))
+
+
+def _buckets(date):
+    day = datetime(date.year, date.month, date.day)
+    return {"day": day, "hour": day.replace(hour=date.hour)}
+
+
+def _rollup_id(granularity, bucket):
+    return f"{granularity}:{bucket.isoformat()}"
+
+
+def record_order(db, order, session=None):
+    """Add ``order`` to the running totals; call alongside the order insert."""
+    db.counters.update_one(
+        {"_id": REVENUE_ID},
+        {"$inc": {"total": order["total"], "orders": 1},
+         "$setOnInsert": {"since": order["date"], "backfilled": False}},
+        upsert=True, session=session,
+    )
+    db.sales_rollups.bulk_write([
+        UpdateOne({"_id": _rollup_id(granularity, bucket)},
+                  {"$inc": {"total": order["total"], "orders": 1},
+                   "$setOnInsert": {"granularity": granularity, "bucket": bucket}},
+                  upsert=True)
+        for granularity, bucket in _buckets(order["date"]).items()
+    ], ordered=False, session=session)
+    # total_* are what the leaderboard sorts on; live_* let a backfill
+    # recompute them without double counting.
+    db.user_stats.update_one(
+        {"_id": order["user_email"]},
+        {"$inc": {"total_spent": order["total"], "order_count": 1,
+                  "live_spent": order["total"], "live_orders": 1}},
+        upsert=True, session=session,
+    )
+
+
+def _before_recording(since):
+    # Orders from the order pipeline carry a status and are only ever
+    # counted live, when a worker completes them.
+    return {"date": {"$lt": since}, "status": {"$exists": False}}
+
+
+def _recording_since(db):
+    db.counters.update_one(
+        {"_id": REVENUE_ID},
+        {"$setOnInsert": {"since": datetime.now(), "backfilled": False, "total": 0, "orders": 0}},
+        upsert=True,
+    )
+    return db.counters.find_one({"_id": REVENUE_ID})["since"]
+
+
+def revenue_totals(db):
+    """Return ``{"total": ..., "orders": ...}`` across all orders ever placed."""
+    doc = db.counters.find_one({"_id": REVENUE_ID})
+    if not is_backfilled(doc):
+        doc = _backfill_revenue(db)
+    return revenue_from(doc)
+
+
+def is_backfilled(doc):
+    return doc is not None and doc.get("backfilled", False)
+
+
+def revenue_from(doc):
+    return {"total": doc.get("total", 0), "orders": doc.get("orders", 0)}
+
+
+def _backfill_revenue(db):
+    since = _recording_since(db)
+    before = next(db.orders.aggregate([
+        {"$match": _before_recording(since)},
+        {"$group": {"_id": None, "total": {"$sum": "$total"}, "orders": {"$sum": 1}}},
+    ]), None) or {"total": 0, "orders": 0}
+    # Only the first backfill to get here applies its sums.
+    db.counters.update_one(
+        {"_id": REVENUE_ID, "backfilled": False},
+        {"$inc": {"total": before["total"], "orders": before["orders"]}, "$set": {"backfilled": True}},
+    )
+    return db.counters.find_one({"_id": REVENUE_ID})
+
+
+def backfill_rollups(db, batch_size=1000):
+    """Fold orders placed before recording started into ``sales_rollups``
+    and ``user_stats``.
+
+    Hourly sums are grouped server-side and daily sums derived from them.
+    Safe to re-run. Returns ``(buckets, customers)`` written.
+    """
+    since = _recording_since(db)
+    hourly = db.orders.aggregate([
+        {"$match": _before_recording(since)},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%dT%H", "date": "$date"}},
+            "total": {"$sum": "$total"}, "orders": {"$sum": 1},
+        }},
+    ])
+    sums = {}
+    for row in hourly:
+        hour = datetime.strptime(row["_id"], "%Y-%m-%dT%H")
+        for granularity, bucket in _buckets(hour).items():
+            acc = sums.setdefault((granularity, bucket), [0, 0])
+            acc[0] += row["total"]
+            acc[1] += row["orders"]
+
+    ops = [
+        UpdateOne({"_id": _rollup_id(granularity, bucket)},
+                  {"$set": {"backfilled_total": total, "backfilled_orders": count},
+                   "$setOnInsert": {"granularity": granularity, "bucket": bucket}},
+                  upsert=True)
+        for (granularity, bucket), (total, count) in sums.items()
+    ]
+    for i in range(0, len(ops), batch_size):
+        db.sales_rollups.bulk_write(ops[i:i + batch_size], ordered=False)
+
+    customers = db.orders.aggregate([
+        {"$match": _before_recording(since)},
+        {"$group": {"_id": "$user_email", "spent": {"$sum": "$total"}, "orders": {"$sum": 1}}},
+    ])
+    user_ops = []
+    written = 0
+    for row in customers:
+        user_ops.append(UpdateOne({"_id": row["_id"]}, [{"$set": {
+            "backfilled_spent": row["spent"], "backfilled_orders": row["orders"],
+            "total_spent": {"$add": [{"$ifNull": ["$live_spent", 0]}, row["spent"]]},
+            "order_count": {"$add": [{"$ifNull": ["$live_orders", 0]}, row["orders"]]},
+        }}], upsert=True))
+        if len(user_ops) == batch_size:
+            db.user_stats.bulk_write(user_ops, ordered=False)
+            written += len(user_ops)
+            user_ops = []
+    if user_ops:
+        db.user_stats.bulk_write(user_ops, ordered=False)
+        written += len(user_ops)
+    return len(ops), written
+
+
+def top_customers_pipeline(limit=5, offset=0):
+    return [
+        {"$sort": {"total_spent": -1, "_id": 1}},
+        {"$skip": offset},
+        {"$limit": limit},
+        {"$lookup": {"from": "users", "localField": "_id", "foreignField": "email", "as": "user"}},
+        {"$project": {"total_spent": 1, "order_count": 1, "user.owner_name": 1}},
+    ]
+
+
+def customer_rows(rows):
+    return [{
+        "name": row["user"][0].get("owner_name", "Unknown User") if row["user"] else "Unknown User",
+        "email": row["_id"],
+        "spent": round(row["total_spent"], 2),
+        "orders": row["order_count"],
+    } for row in rows]
+
+
+def top_customers(db, limit=5, offset=0):
+    """Leaderboard rows from ``user_stats`` joined to ``users`` in one pipeline."""
+    return customer_rows(db.user_stats.aggregate(top_customers_pipeline(limit, offset)))
+
+
+def valid_chart_window(days, granularity):
+    return days in ROLLUP_WINDOWS and granularity in ("day", "hour") \
+        and not (granularity == "hour" and days > MAX_HOURLY_DAYS)
+
+
+def sales_query(days=7, granularity="day", now=None):
+    """Return ``(filter, projection, points)`` for a chart over the last ``days``
+    days; ``points`` lists the ``(bucket, label)`` of every point to plot."""
+    now = now or datetime.now()
+    if granularity == "hour":
+        step, label = timedelta(hours=1), "%d %b %H:00"
+        end = _buckets(now)["hour"]
+        start = end - timedelta(hours=days * 24 - 1)
+    else:
+        step, label = timedelta(days=1), "%d %b"
+        end = _buckets(now)["day"]
+        start = end - timedelta(days=days - 1)
+
+    points = []
+    bucket = start
+    while bucket <= end:
+        points.append((bucket, bucket.strftime(label)))
+        bucket += step
+    query = {"granularity": granularity, "bucket": {"$gte": start, "$lte": end}}
+    return query, {"bucket": 1, "total": 1, "backfilled_total": 1}, points
+
+
+def sales_series(points, docs):
+    """Chart series from ``sales_query`` points and the rollup docs it matched."""
+    totals = {doc["bucket"]: doc.get("total", 0) + doc.get("backfilled_total", 0) for doc in docs}
+    return {
+        "dates": [label for _, label in points],
+        "amounts": [round(totals.get(bucket, 0), 2) for bucket, _ in points],
+    }
+
+
+def sales_over_time(db, days=7, granularity="day", now=None):
+    """Chart series for the last ``days`` days, one point per day or hour."""
+    query, projection, points = sales_query(days, granularity, now)
+    return sales_series(points, db.sales_rollups.find(query, projection))
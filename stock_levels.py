@@ -0,0 +1,202 @@
+"""Stock status per medicine, with store-wide counts kept up to date.
+
+Every medicine carries a ``stock_status`` (``in_stock``, ``low_stock`` or
+``out_of_stock``) derived from its quantity and its category's low-stock
+threshold, and ``counters`` holds how many medicines are in each status. The
+dashboard reads the counts in one ``find_one`` and the low-stock list is an
+index range over the medicines that need restocking, however large the
+catalog.
+
+Routes that change stock call ``refresh`` with the medicines they touched. A
+status only moves with a compare-and-set on the previous status and the
+quantity it was derived from, and only the writer that moved it adjusts the
+counts, so concurrent refreshes never count a change twice. Deletes go
+through ``forget``. Writes from outside the app (the mongo shell, another
+service) are picked up by ``watch`` on a replica set (``flask
+watch-stock-levels``); ``rebuild`` recomputes everything from scratch and runs
+on first read, after a bulk import and when a threshold changes.
+"""
+from collections import Counter
+
+from bson.objectid import ObjectId
+
+import catalog
+
+STOCK_ID = "stock_status"
+STATUS_FIELD = "stock_status"
+IN_STOCK = "in_stock"
+LOW_STOCK = "low_stock"
+OUT_OF_STOCK = "out_of_stock"
+STATUSES = (IN_STOCK, LOW_STOCK, OUT_OF_STOCK)
+NEEDS_RESTOCK = [OUT_OF_STOCK, LOW_STOCK]
+DEFAULT_THRESHOLD = 10
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Refreshes that keep losing the compare-and-set to concurrent writers give
+# up; the writer that won refreshes the same medicine.
+MAX_RETRIES = 5
+LIST_FIELDS = {"name": 1, "category": 1, "quantity": 1, STATUS_FIELD: 1}
+
+
+def status_for(quantity, threshold):
+    if quantity <= 0:
+        return OUT_OF_STOCK
+    if quantity < threshold:
+        return LOW_STOCK
+    return IN_STOCK
+
+
+# -- thresholds --
+def load_thresholds(db):
+    """``{category: threshold}`` for categories that override ``DEFAULT_THRESHOLD``."""
+    return {doc["_id"]: doc["threshold"] for doc in db.stock_thresholds.find()}
+
+
+def threshold_for(thresholds, category):
+    return thresholds.get(category, DEFAULT_THRESHOLD)
+
+
+def set_threshold(db, category, threshold):
+    """Set ``category``'s threshold (``None`` restores the default) and recompute statuses."""
+    if threshold is None:
+        db.stock_thresholds.delete_one({"_id": category})
+    else:
+        db.stock_thresholds.update_one({"_id": category}, {"$set": {"threshold": threshold}}, upsert=True)
+    return rebuild(db, load_thresholds(db))
+
+
+# -- incremental updates --
+def refresh(db, med_ids, thresholds):
+    """Bring the status of ``med_ids`` in line with their quantity, adjusting the counts."""
+    pending = [ObjectId(med_id) for med_id in med_ids]
+    moves = Counter()
+    for _ in range(MAX_RETRIES):
+        if not pending:
+            break
+        lost = []
+        for doc in db.medicines.find({"_id": {"$in": pending}}, LIST_FIELDS):
+            quantity = doc.get("quantity", 0)
+            old = doc.get(STATUS_FIELD)
+            new = status_for(quantity, threshold_for(thresholds, doc.get("category")))
+            if new == old:
+                continue
+            moved = db.medicines.update_one(
+                {"_id": doc["_id"], STATUS_FIELD: old, "quantity": doc.get("quantity")},
+                {"$set": {STATUS_FIELD: new}},
+            )
+            if not moved.modified_count:
+                lost.append(doc["_id"])
+                continue
+            moves[new] += 1
+            if old is not None:
+                moves[old] -= 1
+        pending = lost
+    _apply(db, moves)
+
+
+def forget(db, doc):
+    """Take a deleted medicine out of the counts; ``doc`` is what ``find_one_and_delete`` returned."""
+    if doc and doc.get(STATUS_FIELD):
+        _apply(db, Counter({doc[STATUS_FIELD]: -1}))
+
+
+def _apply(db, moves):
+    moves = {status: n for status, n in moves.items() if n}
+    if moves:
+        # No upsert: until the first rebuild there are no counts to adjust.
+        db.counters.update_one({"_id": STOCK_ID}, {"$inc": moves})
+
+
+# -- full recompute --
+def _status_expression(thresholds):
+    branches = [{"case": {"$eq": ["$category", category]}, "then": threshold}
+                for category, threshold in thresholds.items()]
+    threshold = {"$switch": {"branches": branches, "default": DEFAULT_THRESHOLD}} if branches else DEFAULT_THRESHOLD
+    quantity = {"$ifNull": ["$quantity", 0]}
+    return {"$switch": {"branches": [
+        {"case": {"$lte": [quantity, 0]}, "then": OUT_OF_STOCK},
+        {"case": {"$lt": [quantity, threshold]}, "then": LOW_STOCK},
+    ], "default": IN_STOCK}}
+
+
+def recount(db):
+    """Reset the counts from the stored statuses."""
+    counts = dict.fromkeys(STATUSES, 0)
+    for row in db.medicines.aggregate([{"$group": {"_id": "$" + STATUS_FIELD, "n": {"$sum": 1}}}]):
+        if row["_id"] in counts:
+            counts[row["_id"]] = row["n"]
+    db.counters.update_one({"_id": STOCK_ID}, {"$set": counts}, upsert=True)
+    return counts
+
+
+def rebuild(db, thresholds):
+    """Recompute every status server-side, then the counts. Returns the counts."""
+    db.medicines.update_many({}, [{"$set": {STATUS_FIELD: _status_expression(thresholds)}}])
+    return recount(db)
+
+
+# -- reads --
+def counts_from(doc):
+    return {status: doc.get(status, 0) for status in STATUSES}
+
+
+def stock_counts(db, thresholds):
+    """``{"in_stock": n, "low_stock": n, "out_of_stock": n}``; builds the statuses on first use."""
+    doc = db.counters.find_one({"_id": STOCK_ID})
+    if doc is None:
+        return rebuild(db, thresholds)
+    return counts_from(doc)
+
+
+def low_stock(db, thresholds, category=None, cursor=None, limit=PAGE_SIZE):
+    """Return ``(items, next_cursor)``: medicines that need restocking, emptiest first.
+
+    Pages are keyed on ``(quantity, _id)`` within the low and out of stock
+    statuses. Each item has ``_id`` (as a string), ``name``, ``category``,
+    ``quantity``, ``stock_status`` and the ``threshold`` it was judged by.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = {STATUS_FIELD: {"$in": NEEDS_RESTOCK}}
+    if category:
+        query["category"] = category
+    if cursor:
+        quantity, last_id = catalog.decode_cursor(cursor)
+        query["$or"] = [{"quantity": {"$gt": quantity}}, {"quantity": quantity, "_id": {"$gt": last_id}}]
+    docs = list(db.medicines.find(query, LIST_FIELDS).sort([("quantity", 1), ("_id", 1)]).limit(limit + 1))
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = catalog.encode_cursor(docs[-1].get("quantity", 0), docs[-1]["_id"])
+    for doc in docs:
+        doc["_id"] = str(doc["_id"])
+        doc["threshold"] = threshold_for(thresholds, doc.get("category"))
+    return docs, next_cursor
+
+
+# -- change streams --
+_OWN_FIELDS = {STATUS_FIELD}
+
+
+def watch(db, thresholds, stop=None):
+    """Follow ``medicines`` through a change stream and refresh whatever changes.
+
+    ``thresholds`` is called for the current thresholds on each change. Only
+    works on a replica set or sharded cluster; the driver raises
+    ``OperationFailure`` on a standalone server.
+    """
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+    with db.medicines.watch(pipeline) as stream:
+        while stop is None or not stop.is_set():
+            change = stream.try_next()
+            if change is None:
+                continue
+            if change["operationType"] == "delete":
+                # The deleted document (and its status) is gone; recount.
+                recount(db)
+                continue
+            if change["operationType"] == "update":
+                description = change["updateDescription"]
+                changed = set(description.get("updatedFields", {})) | set(description.get("removedFields", []))
+                if changed <= _OWN_FIELDS:
+                    continue
+            refresh(db, [change["documentKey"]["_id"]], thresholds())